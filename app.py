@@ -1,12 +1,21 @@
 import os
+import json
+import time
+import secrets
+import atexit
 import logging
-import asyncio
-from flask import Flask, render_template, request, redirect, url_for, jsonify
-from telegram import Update
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, flash
 
 from config import Config
-from models import db, BotConfig
-from bot.telegram_bot import setup_bot
+from models import db, BotConfig, ChatMessage, FaqRule, upgrade_schema
+from bot.event_loop import BackgroundLoop
+from bot.config_cache import bump_config_version
+from bot.faq_rules import validate_pattern
+from bot.update_queue import UpdateQueue, UpdateWorkerPool
+from bot.metrics import get_metrics
+from bot.update_capture import get_update_capture
+from bot.bot_registry import BotRegistry
+from bot.interaction_log import get_interaction_log
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,26 +27,95 @@ app.config.from_object(Config)
 # Inicializar SQLAlchemy
 db.init_app(app)
 
-# Bot de Telegram (se inicializará una sola vez)
-telegram_app = setup_bot(app)
-_bot_initialized = False
+# Bots de Telegram: cada Application se construye en el primer uso (telegram, openai, etc.
+# no se importan al arrancar el worker, así /config y los arranques en frío no pagan ese costo)
+bot_registry = BotRegistry(app)
 
-async def _init_bot_instance():
-    global _bot_initialized
-    if not _bot_initialized:
-        await telegram_app.initialize()
-        _bot_initialized = True
+# Loop de eventos persistente: los bots y sus conexiones viven aquí entre peticiones
+bot_loop = BackgroundLoop()
+
+def get_telegram_app(bot_id=None):
+    """Retorna la Application del bot (None = el de TELEGRAM_BOT_TOKEN), construida una sola vez."""
+    return bot_registry.get(bot_id)
+
+async def _init_bot_instance(bot_id=None):
+    await bot_registry.initialize(bot_id)
+
+async def _process_update(data, bot_id=None):
+    """Procesa una actualización en el loop compartido."""
+    from telegram import Update
+    from bot.scheduler import dispatch_update
+
+    telegram_app = await bot_registry.initialize(bot_id)
+    if telegram_app is None:
+        logger.warning(f"Actualización descartada: el bot {bot_id} ya no tiene token")
+        return
+    update = Update.de_json(data, telegram_app.bot)
+    # Pasa por el planificador por chat (orden dentro del chat, concurrencia entre chats); si el bot
+    # se retira mientras tanto, su Application se detiene cuando terminan sus actualizaciones en curso
+    with bot_registry.in_flight(telegram_app):
+        await dispatch_update(telegram_app, update)
+
+async def _process_payload(payload):
+    """Procesa una actualización guardada en la cola durable."""
+    data = json.loads(payload)
+    await _process_update(data, data.pop("_bot_id", None))
+
+# Cola durable + pool de workers (el webhook responde sin esperar al procesamiento)
+update_queue = UpdateQueue() if Config.WEBHOOK_QUEUE_ENABLED else None
+update_workers = UpdateWorkerPool(update_queue, _process_payload) if update_queue else None
+
+if update_queue is not None and Config.METRICS_ENABLED:
+    get_metrics().register_collector(lambda: [("gauge", "bot_update_queue_depth", {}, update_queue.depth())])
+
+def _ensure_update_workers():
+    if not update_workers.running:
+        bot_loop.run(update_workers.start())
+
+async def _shutdown_bot_instance():
+    from bot.openai_client import close_openai_client
+    from bot.conversation_memory import close_conversation_memory
+    from bot.telegram_bot import close_shared_requests
+
+    if update_workers:
+        await update_workers.stop()
+    await bot_registry.shutdown()
+    await close_conversation_memory()
+    await close_openai_client()
+    await close_shared_requests()
+
+@atexit.register
+def _stop_bot_loop():
+    # Si ningún bot se construyó no hay nada que cerrar
+    if bot_registry.built:
+        bot_loop.stop(_shutdown_bot_instance())
+    else:
+        bot_loop.stop()
 
 @app.route("/")
 def index():
     """Página principal."""
     return redirect(url_for("config_view"))
 
+def _bot_config_url(config, **params):
+    """URL de /config para un bot (el bot por defecto no necesita parámetro)."""
+    if config is not None and config.token:
+        params["bot"] = config.id
+    return url_for("config_view", **params)
+
 @app.route("/config", methods=["GET", "POST"])
 def config_view():
-    """Vista de configuración del bot."""
-    config = BotConfig.query.first()
-    # ... (resto de la función)
+    """Vista de configuración de un bot (?bot=<id>; sin parámetro, el bot por defecto)."""
+    bot_id = request.args.get("bot", type=int)
+    creating = request.args.get("new") == "1"
+    if creating:
+        config = None
+    elif bot_id:
+        config = db.session.get(BotConfig, bot_id)
+        if config is None:
+            return redirect(url_for("config_view"))
+    else:
+        config = BotConfig.get_default()
 
     if request.method == "POST":
         name = request.form.get("name", "Grooming Bot").strip()
@@ -45,10 +123,20 @@ def config_view():
         greeting = request.form.get("greeting", "").strip()
         tone = request.form.get("tone", "amigable")
         topic = request.form.get("topic", "estética canina").strip()
+        token = request.form.get("token", "").strip() or None
 
         if not greeting:
             greeting = "¡Hola! ¿En qué puedo ayudarte?"
 
+        # Un token no puede repetirse y solo hay un bot por defecto (sin token)
+        others = BotConfig.query.filter(BotConfig.id != config.id) if config else BotConfig.query
+        if token and others.filter_by(token=token).first():
+            flash("Ese token ya lo usa otro bot", "error")
+            return redirect(request.full_path)
+        if not token and others.filter(BotConfig.token.is_(None)).first():
+            flash("Ya existe el bot por defecto (el que usa TELEGRAM_BOT_TOKEN): indica un token", "error")
+            return redirect(request.full_path)
+
         if config:
             config.name = name
             config.use_emojis = use_emojis
@@ -64,60 +152,201 @@ def config_view():
                 topic=topic
             )
             db.session.add(config)
+        config.token = token
+        if token and not config.webhook_secret:
+            # Con él el webhook sabe a qué bot va cada actualización
+            config.webhook_secret = secrets.token_urlsafe(32)
+
+        db.session.commit()
+        # Avisar a los workers y al proceso de polling que la configuración cambió
+        bump_config_version()
+        return redirect(_bot_config_url(config))
+
+    bots = BotConfig.query.order_by(BotConfig.id).all()
+    rules = FaqRule.query.filter_by(bot_id=config.id).order_by(FaqRule.priority, FaqRule.id).all() if config else []
+    editing = db.session.get(FaqRule, request.args.get("edit", type=int)) if request.args.get("edit") else None
+    return render_template("config.html", config=config, bots=bots, creating=creating, rules=rules,
+                           editing=editing)
 
+@app.route("/config/<int:bot_id>/delete", methods=["POST"])
+def delete_bot(bot_id):
+    """Elimina un bot con token propio y sus reglas."""
+    config = db.session.get(BotConfig, bot_id)
+    if config and config.token:
+        FaqRule.query.filter_by(bot_id=config.id).delete()
+        db.session.delete(config)
         db.session.commit()
+        bump_config_version()
+    return redirect(url_for("config_view"))
+
+@app.route("/config/rules", methods=["POST"])
+def save_faq_rule():
+    """Crea o actualiza una regla de preguntas frecuentes de un bot."""
+    config = db.session.get(BotConfig, request.form.get("bot_id", type=int) or 0)
+    if config is None:
+        return redirect(url_for("config_view"))
+    rule_id = request.form.get("rule_id", type=int)
+    pattern = request.form.get("pattern", "").strip()
+    is_regex = request.form.get("is_regex") == "on"
+    answer = request.form.get("answer", "").strip()
+    image_query = request.form.get("image_query", "").strip() or None
+    enabled = request.form.get("enabled") == "on"
+    priority = request.form.get("priority", 100, type=int)
+
+    error = validate_pattern(pattern, is_regex) or (None if answer else "La respuesta no puede estar vacía")
+    if error:
+        flash(error, "error")
+        return redirect(_bot_config_url(config, edit=rule_id) if rule_id else _bot_config_url(config))
+
+    rule = db.session.get(FaqRule, rule_id) if rule_id else None
+    if rule is None:
+        rule = FaqRule()
+        db.session.add(rule)
+    rule.bot_id = config.id
+    rule.pattern = pattern
+    rule.is_regex = is_regex
+    rule.answer = answer
+    rule.image_query = image_query
+    rule.enabled = enabled
+    rule.priority = priority
+    db.session.commit()
+    # Las reglas forman parte del snapshot de configuración
+    bump_config_version()
+    flash("Regla guardada", "info")
+    return redirect(_bot_config_url(config))
+
+@app.route("/config/rules/<int:rule_id>/delete", methods=["POST"])
+def delete_faq_rule(rule_id):
+    """Elimina una regla de preguntas frecuentes."""
+    rule = db.session.get(FaqRule, rule_id)
+    if rule is None:
         return redirect(url_for("config_view"))
+    config = db.session.get(BotConfig, rule.bot_id) if rule.bot_id else None
+    db.session.delete(rule)
+    db.session.commit()
+    bump_config_version()
+    return redirect(_bot_config_url(config))
 
-    return render_template("config.html", config=config)
+@app.route("/analytics")
+def analytics_view():
+    """Mezcla de intenciones y percentiles de latencia de las últimas horas (agregados por hora)."""
+    interaction_log = get_interaction_log()
+    if interaction_log is None:
+        return "Registro de interacciones desactivado", 404
+    hours = min(max(request.args.get("hours", 24, type=int), 1), 24 * 90)
+    bot_id = request.args.get("bot", type=int)
+    summary = interaction_log.store.summary(time.time() - hours * 3600, bot_id)
+    for item in summary["hourly"]:
+        item["label"] = time.strftime("%Y-%m-%d %H:00", time.gmtime(item["hour"]))
+    bots = BotConfig.query.order_by(BotConfig.id).all()
+    return render_template("analytics.html", summary=summary, hours=hours, bot_id=bot_id, bots=bots,
+                           pending=interaction_log.pending, dropped=interaction_log.dropped)
+
+@app.route("/metrics")
+def metrics_view():
+    """Métricas del bot en formato de texto de Prometheus (todos los workers)."""
+    if not Config.METRICS_ENABLED:
+        return "Métricas desactivadas", 404
+    return Response(get_metrics().render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/webhook", methods=["POST"])
-def webhook():
-    """Endpoint para recibir actualizaciones de Telegram."""
+@app.route("/webhook/<int:bot_id>", methods=["POST"])
+def webhook(bot_id=None):
+    """Endpoint para recibir actualizaciones de Telegram.
+
+    Cada bot alojado se enruta por su ruta (/webhook/<id>) o por el
+    secret_token que Telegram envía en la cabecera; /webhook sin secreto
+    es el bot por defecto.
+    """
     if request.method == "POST":
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
         try:
-            # Asegurar inicialización
-            loop.run_until_complete(_init_bot_instance())
-            
-            update = Update.de_json(request.get_json(force=True), telegram_app.bot)
-            loop.run_until_complete(telegram_app.process_update(update))
-        finally:
-            loop.close()
-            
+            bot_key = bot_registry.routes().resolve(bot_id, request.headers.get("X-Telegram-Bot-Api-Secret-Token"))
+        except LookupError:
+            return "Not Found", 404
+        except PermissionError:
+            return "Forbidden", 403
+
+        data = request.get_json(force=True)
+        update_capture = get_update_capture()
+        if update_capture is not None:
+            update_capture.record(data)
+        # Construir el bot aquí y no en el loop compartido, donde bloquearía a los workers
+        if get_telegram_app(bot_key) is None:
+            return "Not Found", 404
+        if update_queue is not None:
+            # Respuesta inmediata: la actualización se persiste y la procesa el pool de workers
+            _ensure_update_workers()
+            if data.get("update_id") is None:
+                return "Bad Request", 400
+            queue_key = UpdateQueue.key(data["update_id"], bot_key)
+            chat_key = UpdateQueue.chat_key(data, bot_key)
+            if bot_key is not None:
+                data["_bot_id"] = bot_key
+            if update_queue.enqueue(queue_key, json.dumps(data), chat_key):
+                update_workers.notify()
+            return "OK", 200
+
+        # Varias peticiones concurrentes comparten el mismo loop y las mismas Applications
+        bot_loop.run(_process_update(data, bot_key))
         return "OK", 200
     return "Forbidden", 403
 
 @app.route("/set_webhook")
 def set_webhook():
-    """Ruta para registrar el webhook en Telegram."""
+    """Ruta para registrar en Telegram el webhook de todos los bots alojados."""
     webhook_url = Config.WEBHOOK_URL
     if not webhook_url:
         return "Error: WEBHOOK_URL no está configurado en .env. Debe ser https://TU_USUARIO.pythonanywhere.com", 400
     
-    # Asegurar que termina en /webhook
-    actual_webhook_url = webhook_url if webhook_url.endswith("/webhook") else f"{webhook_url.rstrip('/')}/webhook"
-
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        # Asegurar inicialización
-        loop.run_until_complete(_init_bot_instance())
-        success = loop.run_until_complete(telegram_app.bot.set_webhook(url=actual_webhook_url))
-    finally:
-        loop.close()
-
-    if success:
-        return f"Webhook configurado correctamente en: {actual_webhook_url}", 200
-    else:
-        return "Fallo al configurar el Webhook", 500
+    # Base sin el /webhook final: cada bot extra tiene su propia ruta
+    base_url = webhook_url.rstrip("/")
+    if base_url.endswith("/webhook"):
+        base_url = base_url[:-len("/webhook")]
+
+    routes = bot_registry.routes()
+    telegram_apps = {key: get_telegram_app(key) for key in routes.keys()}
+    telegram_apps = {key: telegram_app for key, telegram_app in telegram_apps.items() if telegram_app is not None}
+    if not telegram_apps:
+        return "Error: TELEGRAM_BOT_TOKEN no está configurado en .env", 400
+
+    async def _set_webhooks():
+        results = []
+        for key in telegram_apps:
+            url = f"{base_url}/webhook" if key is None else f"{base_url}/webhook/{key}"
+            try:
+                # Asegurar inicialización
+                telegram_app = await bot_registry.initialize(key)
+                ok = await telegram_app.bot.set_webhook(url=url, secret_token=routes.secrets.get(key))
+            except Exception as e:
+                logger.error(f"Error configurando el webhook {url}: {e}")
+                ok = False
+            results.append((url, ok))
+        return results
+
+    results = bot_loop.run(_set_webhooks())
+    lines = [f"{'Webhook configurado correctamente en' if ok else 'Fallo al configurar el Webhook'}: {url}"
+             for url, ok in results]
+    status = 200 if all(ok for _, ok in results) else 500
+    return Response("\n".join(lines), status=status, mimetype="text/plain")
 
 def init_db():
-    """Inicializa la base de datos."""
+    """Crea las tablas y columnas que falten (paso explícito: ya no se ejecuta al importar la app)."""
     with app.app_context():
         db.create_all()
+        upgrade_schema()
+        # Historial y reglas de antes de alojar varios bots pertenecen al bot por defecto
+        default = BotConfig.get_default()
+        if default is not None:
+            ChatMessage.query.filter(ChatMessage.bot_id.is_(None)).update({"bot_id": default.id})
+            FaqRule.query.filter(FaqRule.bot_id.is_(None)).update({"bot_id": default.id})
+            db.session.commit()
 
-init_db()
+@app.cli.command("init-db")
+def init_db_command():
+    """Crea las tablas de la base de datos: flask --app app init-db"""
+    init_db()
+    print("✅ Tablas creadas.")
 
 if __name__ == "__main__":
+    init_db()
     app.run(host="0.0.0.0", port=80, debug=False)
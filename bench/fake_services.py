@@ -0,0 +1,374 @@
+"""Servicios simulados para los benchmarks: Bot API de Telegram, OpenAI y Bing.
+
+La Bot API y OpenAI se sirven por HTTP desde un proceso aparte (para no
+competir por el GIL con el bot medido) con una latencia configurable; el
+bot se apunta a ellos con TELEGRAM_API_BASE_URL y OPENAI_BASE_URL. La
+búsqueda en Bing se reemplaza por una función bloqueante que solo espera,
+y corre en el mismo pool de hilos que el crawler real.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import multiprocessing
+from urllib.parse import parse_qs, quote, urlsplit
+from urllib.request import Request, urlopen
+
+IMAGE_WORDS = ("ver", "foto", "imagen", "muéstrame", "muestrame", "enséñame", "pásame")
+
+
+def jittered(latency: float, jitter: float) -> float:
+    """Latencia con una variación uniforme de ±jitter (fracción)."""
+    if latency <= 0:
+        return 0.0
+    return max(0.0, latency * random.uniform(1 - jitter, 1 + jitter))
+
+
+# --- HTTP mínimo (HTTP/1.1 con keep-alive) ---
+
+async def _write_response(writer, status: int, body: bytes, content_type: str = "application/json"):
+    writer.write(
+        f"HTTP/1.1 {status} OK\r\nContent-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+
+
+async def _write_json(writer, payload, status: int = 200):
+    await _write_response(writer, status, json.dumps(payload).encode())
+
+
+async def _write_event_stream(writer, events: list, delay: float):
+    """Respuesta SSE en chunks, con una pausa entre eventos."""
+    writer.write(
+        b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+        b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n"
+    )
+    for event in events:
+        data = f"data: {event}\n\n".encode()
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        await writer.drain()
+        if delay:
+            await asyncio.sleep(delay)
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+def _parse_body(headers: dict, body: bytes) -> dict:
+    content_type = headers.get("content-type", "")
+    if not body:
+        return {}
+    if "json" in content_type:
+        return json.loads(body)
+    if "x-www-form-urlencoded" in content_type:
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+    return {}
+
+
+async def _serve_connection(reader, writer, handler):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, _ = request_line.decode().split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, value = line.decode().split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            await handler(method, urlsplit(target).path, _parse_body(headers, body), writer)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+# --- Bot API de Telegram ---
+
+class FakeTelegram:
+    """Responde a los métodos de la Bot API que usa el bot y registra las respuestas por chat."""
+
+    def __init__(self, latency: float, jitter: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.message_id = 0
+        # Actualizaciones para getUpdates (polling), agregadas con /_bench/updates
+        self.updates = []
+        self.update_id = 0
+        self._new_updates = None
+        self.reset()
+
+    def reset(self):
+        self.requests = {}
+        self.first_reply = {}
+        self.replies = {}
+        self.errors = 0
+
+    def _message(self, chat_id, text: str = None, photo: bool = False) -> dict:
+        self.message_id += 1
+        message = {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+        }
+        if text is not None:
+            message["text"] = text
+        if photo:
+            file_id = f"bench-photo-{self.message_id}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480}]
+        return message
+
+    async def handle(self, method_name: str, path: str, data: dict, writer):
+        if path == "/_bench/stats":
+            await _write_json(writer, {
+                "requests": self.requests,
+                "first_reply": self.first_reply,
+                "replies": self.replies,
+                "errors": self.errors,
+            })
+            return
+        if path == "/_bench/reset":
+            self.reset()
+            await _write_json(writer, {"ok": True})
+            return
+        if path == "/_bench/updates":
+            for update in data.get("updates", []):
+                self.update_id += 1
+                self.updates.append(dict(update, update_id=self.update_id))
+            self._notify_updates()
+            await _write_json(writer, {"ok": True})
+            return
+
+        api_method = path.rsplit("/", 1)[-1]
+        self.requests[api_method] = self.requests.get(api_method, 0) + 1
+        if api_method == "getUpdates":
+            await _write_json(writer, {"ok": True, "result": await self._get_updates(data)})
+            return
+        await asyncio.sleep(jittered(self.latency, self.jitter))
+
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif api_method in ("sendMessage", "sendPhoto", "editMessageText"):
+            chat_id = int(data.get("chat_id", 0))
+            text = data.get("text") or data.get("caption")
+            if text and text.startswith("❌"):
+                self.errors += 1
+            self.first_reply.setdefault(str(chat_id), time.time())
+            if api_method != "editMessageText":
+                self.replies.setdefault(str(chat_id), []).append(text)
+            result = self._message(chat_id, text, photo=api_method == "sendPhoto")
+        else:
+            result = True
+        await _write_json(writer, {"ok": True, "result": result})
+
+    def _notify_updates(self):
+        if self._new_updates is not None:
+            self._new_updates.set()
+
+    async def _get_updates(self, data: dict) -> list:
+        """Long polling como el de Telegram: el offset confirma todo lo anterior."""
+        offset = int(data.get("offset") or 0)
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and float(data.get("timeout") or 0) > 0:
+            self._new_updates = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(data["timeout"]))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(data.get("limit") or 100)]
+
+
+# --- OpenAI ---
+
+class FakeOpenAI:
+    """Chat completions con respuestas sintéticas (texto, tool call o streaming)."""
+
+    def __init__(self, latency: float, jitter: float, stream_chunks: int = 8):
+        self.latency = latency
+        self.jitter = jitter
+        self.stream_chunks = stream_chunks
+
+    @staticmethod
+    def _answer(request: dict) -> str:
+        user_message = request["messages"][-1]["content"]
+        text = ("¡Claro! Tenemos varias opciones disponibles con diferentes precios y tamaños. "
+                "Cuéntame qué necesitas y te ayudo a elegir la mejor para ti.")
+        lowered = user_message.lower()
+        if any(word in lowered for word in IMAGE_WORDS):
+            subject = lowered.rsplit(" de ", 1)[-1].strip(" ?!.") or "producto"
+            text += f" [[IMAGE: {subject}]]"
+        return text
+
+    def _completion(self, request: dict, message: dict, finish_reason: str) -> dict:
+        prompt_tokens = sum(len(m.get("content") or "") for m in request["messages"]) // 4
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-3.5-turbo"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 40, "total_tokens": prompt_tokens + 40},
+        }
+
+    async def handle(self, method_name: str, path: str, request: dict, writer):
+        if not path.endswith("/chat/completions"):
+            await _write_json(writer, {"error": {"message": "not found"}}, status=404)
+            return
+
+        latency = jittered(self.latency, self.jitter)
+        if request.get("max_tokens") == 10:
+            # Clasificación de intención
+            await asyncio.sleep(latency)
+            await _write_json(writer, self._completion(
+                request, {"role": "assistant", "content": "consulta"}, "stop"))
+            return
+
+        answer = self._answer(request)
+        if request.get("stream"):
+            words = answer.split(" ")
+            size = max(1, len(words) // self.stream_chunks)
+            pieces = [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+            base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": request.get("model", "gpt-3.5-turbo")}
+            events = [json.dumps(dict(base, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}]))
+                      for piece in pieces]
+            events.append(json.dumps(dict(base, choices=[], usage={
+                "prompt_tokens": 100, "completion_tokens": 40, "total_tokens": 140})))
+            events.append("[DONE]")
+            # La mitad de la latencia hasta el primer token y el resto repartido entre los chunks
+            await asyncio.sleep(latency / 2)
+            await _write_event_stream(writer, events, latency / 2 / len(events))
+            return
+
+        await asyncio.sleep(latency)
+        if request.get("tools"):
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": "call_bench",
+                    "type": "function",
+                    "function": {"name": "responder", "arguments": json.dumps({"intent": "consulta", "answer": answer})},
+                }],
+            }
+            await _write_json(writer, self._completion(request, message, "tool_calls"))
+        else:
+            await _write_json(writer, self._completion(request, {"role": "assistant", "content": answer}, "stop"))
+
+
+# --- Proceso de los servicios ---
+
+def _run_services(ports, telegram_latency: float, openai_latency: float, jitter: float):
+    async def main():
+        telegram = FakeTelegram(telegram_latency, jitter)
+        openai = FakeOpenAI(openai_latency, jitter)
+        servers = []
+        for service in (telegram, openai):
+            server = await asyncio.start_server(
+                lambda r, w, s=service: _serve_connection(r, w, s.handle), "127.0.0.1", 0, backlog=1024
+            )
+            servers.append(server)
+        ports.put([server.sockets[0].getsockname()[1] for server in servers])
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    asyncio.run(main())
+
+
+class FakeServices:
+    """Arranca la Bot API y OpenAI simuladas en un proceso hijo."""
+
+    def __init__(self, telegram_latency: float = 0.05, openai_latency: float = 0.8,
+                 bing_latency: float = 1.5, jitter: float = 0.2):
+        self.telegram_latency = telegram_latency
+        self.openai_latency = openai_latency
+        self.bing_latency = bing_latency
+        self.jitter = jitter
+        self.telegram_port = None
+        self.openai_port = None
+        self._process = None
+
+    def start(self):
+        ports = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_run_services, args=(ports, self.telegram_latency, self.openai_latency, self.jitter), daemon=True
+        )
+        self._process.start()
+        self.telegram_port, self.openai_port = ports.get(timeout=10)
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(5)
+            self._process = None
+
+    @property
+    def telegram_base_url(self) -> str:
+        return f"http://127.0.0.1:{self.telegram_port}/bot"
+
+    @property
+    def openai_base_url(self) -> str:
+        return f"http://127.0.0.1:{self.openai_port}/v1"
+
+    def configure_environment(self, workdir: str, real_limits: bool = False):
+        """Apunta el bot a los servicios simulados y aísla sus bases de datos en workdir.
+
+        Debe llamarse antes de importar la app, porque Config lee el entorno al importarse.
+        """
+        os.environ["TELEGRAM_BOT_TOKEN"] = "123456:bench"
+        os.environ["TELEGRAM_API_BASE_URL"] = self.telegram_base_url
+        os.environ["OPENAI_API_KEY"] = "bench"
+        os.environ["OPENAI_BASE_URL"] = self.openai_base_url
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        for name, filename in (
+            ("UPDATE_QUEUE_DB", "update_queue.db"),
+            ("IMAGE_CACHE_DB", "image_cache.db"),
+            ("FILE_ID_CACHE_DB", "file_ids.db"),
+            ("CONFIG_VERSION_FILE", "config.version"),
+            ("METRICS_DIR", "metrics"),
+            ("INTERACTION_LOG_DB", "interactions.db"),
+        ):
+            os.environ[name] = os.path.join(workdir, filename)
+        os.environ.setdefault("INTENT_LOG_PATH", "")
+        os.environ["UPDATE_CAPTURE_ENABLED"] = "false"
+        if not real_limits:
+            # Se mide el bot, no los límites de las APIs
+            for name, value in (
+                ("TELEGRAM_GLOBAL_RATE", "100000"),
+                ("TELEGRAM_CHAT_RATE", "100000"),
+                ("TELEGRAM_CHAT_BURST", "100000"),
+                ("TELEGRAM_GROUP_RATE_PER_MIN", "1000000"),
+                ("OPENAI_RPM", "1000000"),
+                ("OPENAI_TPM", "100000000"),
+            ):
+                os.environ.setdefault(name, value)
+
+    def _call(self, path: str) -> dict:
+        request = Request(f"http://127.0.0.1:{self.telegram_port}{path}", method="POST", data=b"")
+        with urlopen(request, timeout=10) as response:
+            return json.loads(response.read())
+
+    def reset(self):
+        """Limpia los contadores de la Bot API simulada."""
+        self._call("/_bench/reset")
+
+    def push_updates(self, updates: list):
+        """Agrega actualizaciones para getUpdates (update_id lo asigna la Bot API simulada)."""
+        request = Request(f"http://127.0.0.1:{self.telegram_port}/_bench/updates", method="POST",
+                          data=json.dumps({"updates": updates}).encode(), headers={"Content-Type": "application/json"})
+        with urlopen(request, timeout=10) as response:
+            return json.loads(response.read())
+
+    def stats(self) -> dict:
+        """Peticiones por método, respuestas por chat y errores enviados."""
+        return self._call("/_bench/stats")
+
+    def crawl_image(self, query: str) -> str:
+        """Sustituto bloqueante de _crawl_image (Bing)."""
+        time.sleep(jittered(self.bing_latency, self.jitter))
+        return f"https://images.bench.invalid/{quote(query)}.jpg"
@@ -0,0 +1,69 @@
+"""Mide cuánto tarda FaqMatcher.match según el número de reglas regex.
+
+Uso:
+    python -m bench.faq_scaling --rules 1,10,100,500 --output faq_scaling.json
+
+Las reglas imitan respuestas rápidas reales (palabras con \\b y alguna
+alternancia). Se mide un mensaje que no coincide con ninguna regla (el caso
+más común y el más caro) y uno que coincide con la regla de menor prioridad.
+No usa la base de datos ni la red.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.faq_rules import FaqMatcher
+
+MISS = "hola, quería saber si atienden perros grandes el fin de semana y cuánto demora el turno"
+WORDS = ["precio", "envio", "horario", "corte", "baño", "turno", "pago", "tarjeta", "domicilio", "vacuna"]
+
+
+def build_rules(count: int) -> list:
+    rules = []
+    for i in range(count):
+        word = WORDS[i % len(WORDS)]
+        pattern = rf"\b{word}{i}\b" if i % 5 else rf"\b(?:{word}|{word}s){i}\b"
+        rules.append({"id": i + 1, "pattern": pattern, "is_regex": True, "priority": i, "answer": "ok"})
+    return rules
+
+
+def per_call_us(matcher, message: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        matcher.match(message)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", default="1,10,100,500", help="Números de reglas, separados por coma")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--output", default="faq_scaling.json")
+    args = parser.parse_args()
+
+    results = []
+    for count in [int(value) for value in args.rules.split(",")]:
+        rules = build_rules(count)
+        matcher = FaqMatcher(rules)
+        last = rules[-1]["pattern"].replace(r"\b", "").replace("(?:", "").split("|")[0]
+        result = {
+            "rules": count,
+            "miss_us": per_call_us(matcher, MISS, args.repeat),
+            "hit_us": per_call_us(matcher, f"{MISS} {last}", args.repeat),
+        }
+        results.append(result)
+        print(f"{count:>5} reglas  sin coincidencia={result['miss_us']:8.1f} µs  "
+              f"con coincidencia={result['hit_us']:8.1f} µs")
+
+    with open(args.output, "w") as f:
+        json.dump({"date": datetime.now(timezone.utc).isoformat(), "results": results}, f, indent=2)
+    print(f"✅ Resultados guardados en: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Mide el tiempo de arranque en frío (import de app.py) y de la primera construcción del bot.
+
+Uso:
+    python -m bench.import_time --runs 5 --baseline HEAD~1 --output import_time.json
+
+Cada medición es un intérprete nuevo. Con --baseline se extrae esa revisión
+con git archive y se mide igual, para registrar la ganancia.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+from datetime import datetime, timezone
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    # Lo que paga cada worker WSGI al arrancar (y /config en frío)
+    "import_app": "import app",
+    # Lo que paga la primera actualización: construir la Application del bot
+    "first_update": "import app; getattr(app, 'get_telegram_app', lambda: None)()",
+}
+
+_PROBE = "import time; _t = time.perf_counter(); {statement}; print('ELAPSED', time.perf_counter() - _t)"
+
+
+def parse_importtime(stderr: str, limit: int = 10) -> list:
+    """Módulos con más tiempo acumulado según -X importtime (los de app.py y los del bot)."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Sangría de 1 espacio: import directo; de 3: importado por un módulo de primer nivel (app)
+        depth = len(name) - len(name.lstrip(" "))
+        if depth <= 3 and name.strip() != "app":
+            modules.append((name.strip(), int(cumulative) / 1e6))
+    modules.sort(key=lambda item: item[1], reverse=True)
+    return [{"module": name, "seconds": round(seconds, 4)} for name, seconds in modules[:limit]]
+
+
+def measure(repo_dir: str, statement: str, runs: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bot-import-")
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bot.db')}",
+        TELEGRAM_BOT_TOKEN=os.environ.get("TELEGRAM_BOT_TOKEN") or "123456:import-time",
+        UPDATE_QUEUE_DB=os.path.join(workdir, "update_queue.db"),
+        METRICS_DIR=os.path.join(workdir, "metrics"),
+    )
+    timings, top_modules = [], []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _PROBE.format(statement=statement)],
+            cwd=repo_dir, env=env, capture_output=True, text=True, timeout=120
+        )
+        elapsed = [line.split()[1] for line in result.stdout.splitlines() if line.startswith("ELAPSED")]
+        if result.returncode != 0 or not elapsed:
+            raise RuntimeError(f"Falló la medición en {repo_dir}:\n{result.stderr[-2000:]}")
+        timings.append(float(elapsed[0]))
+        top_modules = parse_importtime(result.stderr)
+    return {
+        "runs": [round(t, 4) for t in timings],
+        "first": round(timings[0], 4),
+        "median": round(statistics.median(timings), 4),
+        "min": round(min(timings), 4),
+        "top_modules": top_modules,
+    }
+
+
+def export_revision(revision: str) -> str:
+    """Extrae una revisión del repositorio en un directorio temporal."""
+    target = tempfile.mkdtemp(prefix="bot-baseline-")
+    archive = subprocess.run(["git", "archive", revision], cwd=REPO_DIR, capture_output=True, check=True)
+    subprocess.run(["tar", "-x", "-C", target], input=archive.stdout, check=True)
+    os.makedirs(os.path.join(target, "instance"), exist_ok=True)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del tiempo de import/arranque del bot.")
+    parser.add_argument("--runs", type=int, default=5, help="Intérpretes nuevos por escenario")
+    parser.add_argument("--baseline", help="Revisión de git con la que comparar (p. ej. HEAD~1)")
+    parser.add_argument("--output", default="import_time.json", help="Archivo JSON de resultados")
+    args = parser.parse_args()
+
+    revisions = {"current": REPO_DIR}
+    if args.baseline:
+        revisions["baseline"] = export_revision(args.baseline)
+
+    report = {"created_at": datetime.now(timezone.utc).isoformat(), "python": sys.version.split()[0],
+              "baseline": args.baseline, "results": {}}
+    for label, repo_dir in revisions.items():
+        report["results"][label] = {}
+        for scenario, statement in SCENARIOS.items():
+            result = measure(repo_dir, statement, args.runs)
+            report["results"][label][scenario] = result
+            print(f"{label:9} {scenario:13} mediana={result['median']:.3f}s  primera={result['first']:.3f}s")
+
+    if args.baseline:
+        report["gain"] = {
+            scenario: round(report["results"]["baseline"][scenario]["median"]
+                            - report["results"]["current"][scenario]["median"], 4)
+            for scenario in SCENARIOS
+        }
+        for scenario, gain in report["gain"].items():
+            print(f"   {scenario}: {gain:+.3f}s respecto a {args.baseline}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Resultados guardados en: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Mide la memoria que agrega cada bot alojado en el mismo proceso.
+
+Uso:
+    python -m bench.multi_bot_memory --bots 50 --output multi_bot_memory.json
+
+Cada modo corre en un intérprete nuevo: "shared" construye los bots con
+setup_bot (planificador y clientes HTTP compartidos) y carga su snapshot de
+configuración; "isolated" construye cada Application con sus propios
+clientes, como antes de alojar varios bots. No hace llamadas de red.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rss_kib() -> float:
+    """Memoria residente del proceso (Linux)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024
+
+
+def measure(mode: str, bots: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bot-memory-")
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bot.db')}",
+        TELEGRAM_BOT_TOKEN="100000:memory",
+        CONFIG_VERSION_FILE=os.path.join(workdir, "config.version"),
+        METRICS_DIR=os.path.join(workdir, "metrics"),
+    )
+    from app import app, init_db, bot_registry
+    from models import db, BotConfig
+    from telegram.ext import Application
+    from bot.telegram_bot import get_config_snapshot, setup_bot
+    from bot.scheduler import ChatUpdateScheduler
+    from bot.rate_limiter import TelegramRateLimiter
+
+    init_db()
+    with app.app_context():
+        db.session.add(BotConfig())
+        db.session.add_all(BotConfig(name=f"Bot {i}", token=f"{200000 + i}:memory") for i in range(bots + 1))
+        db.session.commit()
+        ids = [row.id for row in BotConfig.query.filter(BotConfig.token.isnot(None)).order_by(BotConfig.id)]
+
+    def build(bot_id):
+        if mode == "shared":
+            get_config_snapshot(app, bot_id)
+            return bot_registry.get(bot_id)
+        return (Application.builder().token(f"{bot_id}:isolated")
+                .concurrent_updates(ChatUpdateScheduler(8)).rate_limiter(TelegramRateLimiter()).build())
+
+    # El primer bot paga los imports y los recursos compartidos
+    setup_bot(app)
+    build(ids[0])
+    applications = []
+    tracemalloc.start()
+    rss_before = rss_kib()
+    heap_before = tracemalloc.get_traced_memory()[0]
+    for bot_id in ids[1:]:
+        applications.append(build(bot_id))
+    heap_after = tracemalloc.get_traced_memory()[0]
+    rss_after = rss_kib()
+    return {
+        "mode": mode,
+        "bots": bots,
+        "rss_per_bot_kib": round((rss_after - rss_before) / bots, 1),
+        "heap_per_bot_kib": round((heap_after - heap_before) / bots / 1024, 1),
+        "rss_total_mib": round(rss_after / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria por bot al alojar varios bots en un proceso.")
+    parser.add_argument("--bots", type=int, default=50, help="Bots a construir por modo")
+    parser.add_argument("--output", default="multi_bot_memory.json", help="Archivo JSON de resultados")
+    parser.add_argument("--mode", choices=["shared", "isolated"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Proceso hijo: una sola medición, resultado en stdout
+        print(json.dumps(measure(args.mode, args.bots)))
+        return
+
+    results = []
+    for mode in ("shared", "isolated"):
+        output = subprocess.run(
+            [sys.executable, "-m", "bench.multi_bot_memory", "--mode", mode, "--bots", str(args.bots)],
+            cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{mode:9} {result['rss_per_bot_kib']:8.1f} KiB/bot (RSS)  "
+              f"{result['heap_per_bot_kib']:6.1f} KiB/bot (heap Python)  total={result['rss_total_mib']} MiB")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"created_at": datetime.now(timezone.utc).isoformat(), "results": results}, f,
+                  ensure_ascii=False, indent=2)
+    print(f"✅ Resultados guardados en: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import asyncio
+import tempfile
+import argparse
+import itertools
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.fake_services import FakeServices
+
+TEXT_MESSAGES = [
+    "¿Qué precio tiene el producto {n}?",
+    "¿Tienen disponible el modelo {n} en otro tamaño?",
+    "Necesito una recomendación para el caso {n}",
+    "¿Cuánto tarda el envío del pedido {n}?",
+]
+IMAGE_SUBJECTS = [
+    "collar de cuero", "cepillo de cerdas", "champú neutro", "cortaúñas", "cama acolchada",
+    "secador profesional", "tijeras curvas", "arnés ajustable", "perfume suave", "toalla de microfibra",
+]
+
+_update_ids = itertools.count(1)
+_chat_ids = itertools.count(10_000_000)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark del bot contra una Bot API, OpenAI y Bing simulados (sin tokens reales)."
+    )
+    parser.add_argument("--modes", default="handler,webhook",
+                        help="handler: dispatch_update directo; webhook: POST /webhook de Flask")
+    parser.add_argument("--flows", default="text,image", help="Flujos a medir (text, image)")
+    parser.add_argument("--concurrency", default="1,8,32", help="Niveles de concurrencia separados por comas")
+    parser.add_argument("--messages", type=int, default=100, help="Mensajes por nivel")
+    parser.add_argument("--warmup", type=int, default=5, help="Mensajes de calentamiento (no se miden)")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Segundos por llamada a la Bot API")
+    parser.add_argument("--openai-latency", type=float, default=0.8, help="Segundos por completion")
+    parser.add_argument("--bing-latency", type=float, default=1.5, help="Segundos por búsqueda de imagen")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Variación de las latencias (fracción)")
+    parser.add_argument("--image-subjects", type=int, default=len(IMAGE_SUBJECTS),
+                        help="Temas de imagen distintos (menos temas = más aciertos de caché)")
+    parser.add_argument("--real-limits", action="store_true",
+                        help="Mantener los límites reales de Telegram y OpenAI en lugar de desactivarlos")
+    parser.add_argument("--timeout", type=float, default=120, help="Espera máxima por nivel en modo webhook")
+    parser.add_argument("--output", default="benchmark_results.json", help="Archivo JSON de resultados")
+    return parser.parse_args()
+
+
+def build_payload(flow: str, chat_id: int, n: int, image_subjects: int) -> dict:
+    """Actualización sintética de Telegram con un mensaje de texto."""
+    if flow == "image":
+        text = f"muéstrame una foto de {IMAGE_SUBJECTS[n % image_subjects]}"
+    else:
+        text = TEXT_MESSAGES[n % len(TEXT_MESSAGES)].format(n=n)
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        },
+    }
+
+
+def percentile(values: list, pct: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies: list, duration: float, messages: int, errors: int, **extra) -> dict:
+    result = {
+        "messages": messages,
+        "completed": len(latencies),
+        "errors": errors,
+        "duration": round(duration, 3),
+        "msgs_per_s": round(len(latencies) / duration, 2) if duration > 0 else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+    result.update(extra)
+    return result
+
+
+def run_handler(telegram_app, bot_loop, flow: str, concurrency: int, messages: int, image_subjects: int) -> tuple:
+    """Envía las actualizaciones directo a la Application (planificador + handle_message)."""
+    from telegram import Update
+    from bot.scheduler import dispatch_update
+
+    async def drive():
+        latencies = []
+        counter = itertools.count()
+
+        async def sender():
+            while True:
+                n = next(counter)
+                if n >= messages:
+                    return
+                payload = build_payload(flow, next(_chat_ids), n, image_subjects)
+                start = time.perf_counter()
+                await dispatch_update(telegram_app, Update.de_json(payload, telegram_app.bot))
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(sender() for _ in range(concurrency)))
+        return latencies, time.perf_counter() - start
+
+    return bot_loop.run(drive())
+
+
+def run_webhook(app, services: FakeServices, flow: str, concurrency: int, messages: int,
+                image_subjects: int, timeout: float) -> tuple:
+    """POST /webhook desde varios hilos; la latencia es hasta la primera respuesta al chat."""
+    local = threading.local()
+    submitted = {}
+    ack_latencies = []
+
+    def post(n):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        chat_id = next(_chat_ids)
+        payload = build_payload(flow, chat_id, n, image_subjects)
+        submitted[str(chat_id)] = time.time()
+        start = time.perf_counter()
+        response = client.post("/webhook", json=payload)
+        ack_latencies.append(time.perf_counter() - start)
+        return response.status_code
+
+    start = time.time()
+    with ThreadPoolExecutor(concurrency) as executor:
+        statuses = list(executor.map(post, range(messages)))
+
+    # Con la cola durable el webhook responde antes de procesar: se espera a las respuestas
+    replies = {}
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        replies = services.stats()["first_reply"]
+        if all(chat_id in replies for chat_id in submitted):
+            break
+        time.sleep(0.2)
+
+    latencies = [replies[chat_id] - sent for chat_id, sent in submitted.items() if chat_id in replies]
+    last_reply = max((replies[chat_id] for chat_id in submitted if chat_id in replies), default=time.time())
+    extra = {
+        "http_errors": sum(status != 200 for status in statuses),
+        "ack_p50": percentile(ack_latencies, 50),
+        "ack_p99": percentile(ack_latencies, 99),
+    }
+    return latencies, last_reply - start, extra
+
+
+def main():
+    args = parse_args()
+    services = FakeServices(args.telegram_latency, args.openai_latency, args.bing_latency, args.jitter).start()
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    services.configure_environment(workdir, real_limits=args.real_limits)
+
+    # Importar después de configurar el entorno
+    from app import app, bot_loop, get_telegram_app, _init_bot_instance
+    from models import db, BotConfig
+    import bot.telegram_bot as telegram_bot
+
+    telegram_app = get_telegram_app()
+    telegram_bot._crawl_image = services.crawl_image
+    with app.app_context():
+        db.create_all()
+        if not BotConfig.query.first():
+            db.session.add(BotConfig())
+            db.session.commit()
+    bot_loop.run(_init_bot_instance())
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    flows = [f.strip() for f in args.flows.split(",") if f.strip()]
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    image_subjects = max(1, min(args.image_subjects, len(IMAGE_SUBJECTS)))
+
+    results = []
+    try:
+        for mode, flow in itertools.product(modes, flows):
+            if args.warmup:
+                run_handler(telegram_app, bot_loop, flow, 1, args.warmup, image_subjects)
+            for concurrency in levels:
+                services.reset()
+                if mode == "webhook":
+                    latencies, duration, extra = run_webhook(
+                        app, services, flow, concurrency, args.messages, image_subjects, args.timeout
+                    )
+                else:
+                    latencies, duration = run_handler(
+                        telegram_app, bot_loop, flow, concurrency, args.messages, image_subjects
+                    )
+                    extra = {}
+                stats = services.stats()
+                result = summarize(latencies, duration, args.messages, stats["errors"],
+                                   mode=mode, flow=flow, concurrency=concurrency,
+                                   telegram_requests=stats["requests"], **extra)
+                results.append(result)
+                print(f"{mode:8} {flow:6} c={concurrency:<4} {result['msgs_per_s'] or 0:8.2f} msg/s  "
+                      f"p50={result['p50'] or 0:.3f}s p95={result['p95'] or 0:.3f}s p99={result['p99'] or 0:.3f}s  "
+                      f"errores={result['errors']}")
+    finally:
+        services.stop()
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "settings": {
+            "messages": args.messages,
+            "telegram_latency": args.telegram_latency,
+            "openai_latency": args.openai_latency,
+            "bing_latency": args.bing_latency,
+            "jitter": args.jitter,
+            "image_subjects": image_subjects,
+            "real_limits": args.real_limits,
+            "intent_mode": os.environ.get("INTENT_MODE", "two_call"),
+            "stream_replies": os.environ.get("STREAM_REPLIES", "false"),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Resultados guardados en: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
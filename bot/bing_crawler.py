@@ -0,0 +1,35 @@
+import os
+import logging
+
+# icrawler arrastra bs4, lxml y Pillow: este módulo solo se importa en la primera búsqueda real
+from icrawler import ImageDownloader
+from icrawler.builtin import BingImageCrawler
+
+
+class UrlDownloader(ImageDownloader):
+    """Custom downloader to just capture the URL instead of downloading."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.captured_url = None
+
+    def download(self, task, default_ext, timeout=5, max_retry=3, **kwargs):
+        self.captured_url = task['file_url']
+        # We don't return anything to stop the actual download
+        return
+
+
+def crawl_image_url(query: str, tmp_dir: str) -> str:
+    """Busca una imagen en Bing usando icrawler y retorna el URL (bloqueante)."""
+    if not os.path.exists(tmp_dir):
+        os.makedirs(tmp_dir, exist_ok=True)
+
+    crawler = BingImageCrawler(
+        downloader_cls=UrlDownloader,
+        downloader_threads=1,
+        storage={'root_dir': tmp_dir},
+        log_level=logging.ERROR
+    )
+    crawler.crawl(keyword=query, max_num=1)
+
+    # Access the captured URL from the downloader instance
+    return crawler.downloader.captured_url
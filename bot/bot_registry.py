@@ -0,0 +1,214 @@
+import hmac
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+
+from models import BotConfig
+from bot.config_cache import ConfigCache
+
+logger = logging.getLogger(__name__)
+
+
+class BotRoutes:
+    """Tokens y secretos de webhook de los bots alojados, leídos de BotConfig.
+
+    La clave de cada bot es el id de su fila; el bot por defecto (la
+    primera fila sin token, que usa TELEGRAM_BOT_TOKEN) tiene clave None.
+    """
+
+    def __init__(self, rows: list, version: int):
+        self.version = version
+        self.default_id = None
+        self.tokens = {}
+        self.secrets = {}
+        self.by_secret = {}
+        for row in rows:
+            if row.token:
+                key = row.id
+                self.tokens[key] = row.token
+            elif self.default_id is None:
+                self.default_id = row.id
+                key = None
+            else:
+                continue
+            if row.webhook_secret:
+                self.secrets[key] = row.webhook_secret
+                self.by_secret[row.webhook_secret] = key
+
+    def keys(self) -> list:
+        """Claves de todos los bots que se pueden construir."""
+        return [None] + list(self.tokens)
+
+    def resolve(self, bot_id: int = None, secret: str = None):
+        """Clave del bot al que va una actualización del webhook.
+
+        Lanza LookupError si el bot no existe y PermissionError si el
+        secreto no coincide.
+        """
+        if bot_id is not None:
+            key = None if bot_id == self.default_id else bot_id
+            if key is not None and key not in self.tokens:
+                raise LookupError(bot_id)
+        elif secret:
+            if secret not in self.by_secret:
+                raise PermissionError("secreto desconocido")
+            return self.by_secret[secret]
+        else:
+            key = None
+        expected = self.secrets.get(key)
+        if expected and not hmac.compare_digest(expected, secret or ""):
+            raise PermissionError("secreto incorrecto")
+        return key
+
+
+def _load_routes(app, version: int) -> BotRoutes:
+    with app.app_context():
+        return BotRoutes(BotConfig.query.order_by(BotConfig.id).all(), version)
+
+
+class BotRegistry:
+    """Applications de los bots alojados en el proceso, construidas en su primer uso.
+
+    Todas comparten el loop, OpenAI, las cachés y los clientes HTTP (ver
+    setup_bot). Las rutas se recargan cuando cambia la versión de la
+    configuración; si el token de un bot cambia, su Application se
+    reconstruye, y si el bot se borra, se retira. Una Application retirada
+    se detiene (sin cerrar los clientes compartidos) cuando terminan sus
+    actualizaciones en curso (ver in_flight).
+
+    En el loop compartido, initialize solo usa lo ya construido: recargar
+    las rutas o construir una Application consulta la base, así que se hace
+    en un hilo y el resultado se publica bajo el lock del registro.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.routes_cache = ConfigCache(_load_routes)
+        self._apps = {}
+        self._initialized = set()
+        self._retired = []
+        self._routes_version = None
+        # Application -> actualizaciones en curso
+        self._in_flight = {}
+        self._shutdowns = set()
+        self._lock = threading.Lock()
+        self._init_lock = None
+
+    def routes(self) -> BotRoutes:
+        routes = self.routes_cache.get(self.flask_app)
+        if routes.version != self._routes_version:
+            self._prune(routes)
+        return routes
+
+    def _prune(self, routes: BotRoutes):
+        """Retira las Applications de bots borrados o cuyo token cambió."""
+        with self._lock:
+            self._routes_version = routes.version
+            for key, application in list(self._apps.items()):
+                # El bot por defecto usa TELEGRAM_BOT_TOKEN: no cambia con la configuración
+                if key is not None and routes.tokens.get(key) != application.bot.token:
+                    self._retire(key)
+
+    def _retire(self, key):
+        from bot.telegram_bot import release_bot
+
+        application = self._apps.pop(key)
+        release_bot(application)
+        self._retired.append(application)
+
+    def _ready(self, key):
+        """La Application del bot si ya está construida y las rutas vigentes (no bloquea), o None."""
+        routes = self.routes_cache.peek()
+        if routes is None or routes.version != self._routes_version:
+            return None
+        application = self._apps.get(key)
+        if application is None or (key is not None and routes.tokens.get(key) != application.bot.token):
+            return None
+        return application
+
+    @property
+    def built(self) -> bool:
+        return bool(self._apps)
+
+    def get(self, key=None):
+        """Retorna la Application del bot (None si no tiene token)."""
+        token = None if key is None else self.routes().tokens.get(key)
+        if key is not None and token is None:
+            return None
+        application = self._apps.get(key)
+        if application is not None and (token is None or application.bot.token == token):
+            return application
+        with self._lock:
+            application = self._apps.get(key)
+            if application is None or (token is not None and application.bot.token != token):
+                if application is not None:
+                    self._retire(key)
+                # Import diferido: telegram, openai, etc. no se cargan al arrancar el worker
+                from bot.telegram_bot import setup_bot
+                application = setup_bot(self.flask_app, token=token, bot_id=key)
+                if application is not None:
+                    self._apps[key] = application
+        return application
+
+    async def initialize(self, key=None):
+        """Retorna la Application del bot inicializada (getMe una sola vez por bot)."""
+        application = self._ready(key)
+        if application is None:
+            application = await asyncio.to_thread(self.get, key)
+        if self._retired:
+            await self._shutdown_retired()
+        if application is None or application in self._initialized:
+            return application
+        # El lock se crea dentro del loop compartido; todas las corrutinas corren en él
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if application not in self._initialized:
+                await application.initialize()
+                self._initialized.add(application)
+        return application
+
+    @contextmanager
+    def in_flight(self, application):
+        """Marca una actualización en curso de la Application: si se retira, se detiene al terminar."""
+        self._in_flight[application] = self._in_flight.get(application, 0) + 1
+        try:
+            yield application
+        finally:
+            self._in_flight[application] -= 1
+            if not self._in_flight[application]:
+                del self._in_flight[application]
+                if application in self._retired:
+                    task = asyncio.get_running_loop().create_task(self._shutdown_retired())
+                    self._shutdowns.add(task)
+                    task.add_done_callback(self._shutdowns.discard)
+
+    async def _shutdown_retired(self):
+        """Detiene las Applications retiradas sin actualizaciones en curso.
+
+        Su shutdown no cierra los clientes compartidos (ver SharedHTTPXRequest).
+        """
+        # Sin el lock del registro: un hilo puede tenerlo mientras construye una Application
+        for application in list(self._retired):
+            # Otra llamada pudo detenerla mientras se esperaba el shutdown anterior
+            if application in self._in_flight or application not in self._retired:
+                continue
+            self._retired.remove(application)
+            if application not in self._initialized:
+                continue
+            self._initialized.discard(application)
+            try:
+                await application.shutdown()
+            except Exception as e:
+                logger.error(f"Error deteniendo un bot retirado: {e}")
+
+    async def shutdown(self):
+        """Detiene las Applications inicializadas."""
+        self._retired.clear()
+        for application in list(self._initialized):
+            try:
+                await application.shutdown()
+            except Exception as e:
+                logger.error(f"Error deteniendo un bot: {e}")
+        self._initialized.clear()
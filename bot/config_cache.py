@@ -0,0 +1,116 @@
+import os
+import time
+import logging
+import threading
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def read_config_version(path: str = None) -> int:
+    """Lee el número de versión de la configuración (0 si aún no existe)."""
+    path = path or Config.CONFIG_VERSION_FILE
+    try:
+        with open(path, "r") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_config_version(path: str = None) -> int:
+    """Incrementa la versión de la configuración para invalidar las cachés de todos los procesos."""
+    path = path or Config.CONFIG_VERSION_FILE
+    version = read_config_version(path) + 1
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(version))
+    # Reemplazo atómico: los lectores nunca ven un archivo a medio escribir
+    os.replace(tmp_path, path)
+    return version
+
+
+class ConfigSnapshot:
+    """Copia en memoria de BotConfig junto con los datos derivados de ella."""
+
+    def __init__(self, data: dict, version: int):
+        self.version = version
+        self.id = data.get("id")
+        self.name = data["name"]
+        self.use_emojis = data["use_emojis"]
+        self.greeting = data["greeting"]
+        self.tone = data["tone"]
+        self.topic = data["topic"]
+        # Las cachés compartidas entre bots separan sus entradas por bot y versión
+        self.cache_version = f"{self.id}:{version}"
+
+    def to_dict(self):
+        """Convierte el snapshot a diccionario."""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "use_emojis": self.use_emojis,
+            "greeting": self.greeting,
+            "tone": self.tone,
+            "topic": self.topic,
+        }
+
+
+class ConfigCache:
+    """Snapshot de la configuración por proceso, invalidado por número de versión.
+
+    El archivo de versión se revisa con os.stat (como mucho cada
+    CONFIG_CHECK_INTERVAL segundos); la base de datos solo se consulta cuando
+    la versión cambia.
+    """
+
+    def __init__(self, loader, version_file: str = None, check_interval: float = None):
+        self.loader = loader
+        self.version_file = version_file or Config.CONFIG_VERSION_FILE
+        self.check_interval = Config.CONFIG_CHECK_INTERVAL if check_interval is None else check_interval
+        self._snapshot = None
+        self._stamp = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.version_file)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def peek(self):
+        """Retorna el snapshot vigente si no hace falta recargarlo (sin consultar la base), o None."""
+        if self._snapshot is None:
+            return None
+        now = time.monotonic()
+        if now < self._next_check:
+            return self._snapshot
+        if self._file_stamp() == self._stamp:
+            self._next_check = now + self.check_interval
+            return self._snapshot
+        return None
+
+    def get(self, app):
+        """Retorna el snapshot vigente, recargándolo solo si la versión cambió."""
+        snapshot = self.peek()
+        if snapshot is not None:
+            return snapshot
+
+        now = time.monotonic()
+        stamp = self._file_stamp()
+        with self._lock:
+            version = read_config_version(self.version_file)
+            snapshot = self.loader(app, version)
+            if snapshot is not None:
+                logger.info(f"Configuración del bot cargada (versión {version})")
+                self._snapshot = snapshot
+                self._stamp = stamp
+                self._next_check = now + self.check_interval
+            return snapshot
+
+    def invalidate(self):
+        """Fuerza la recarga en el próximo acceso."""
+        self._snapshot = None
+        self._stamp = None
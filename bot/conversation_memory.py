@@ -0,0 +1,321 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from sqlalchemy import func, select, and_, or_
+
+from config import Config
+from models import db, ChatMessage
+from bot.llm_governor import get_llm_governor, PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+
+def count_tokens(text: str) -> int:
+    """Estimación barata de tokens (~4 caracteres por token)."""
+    return len(text) // 4 + 1
+
+
+class ChatHistory:
+    """Historial en memoria de un chat: resumen de lo antiguo + ring buffer de turnos."""
+
+    def __init__(self, max_turns: int, summary: str = ""):
+        self.summary = summary
+        self.turns = deque(maxlen=max_turns)
+        self.summarizing = False
+        # Fila más reciente del chat en la base al cargarlo, y cuándo se comprobó por última vez
+        self.last_row_id = 0
+        self.checked_at = time.monotonic()
+
+    def tokens(self) -> int:
+        return count_tokens(self.summary) + sum(count_tokens(t["content"]) for t in self.turns)
+
+
+class ConversationMemory:
+    """Memoria de conversación por bot y chat_id.
+
+    Delante de la tabla chat_messages hay un LRU de historiales en memoria;
+    las escrituras se acumulan y se guardan en lotes (por tamaño o intervalo)
+    fuera del loop de eventos. Al armar el prompt se incluyen los turnos más
+    recientes que caben en el presupuesto de tokens; opcionalmente los turnos
+    antiguos se resumen con el LLM en lugar de descartarse.
+
+    Si otro proceso atiende el mismo chat, un historial en caché con más de
+    reload_after segundos se compara con la fila más reciente del chat en la
+    base y se recarga si hay filas nuevas (los turnos aún sin guardar de
+    este proceso se conservan). Lo que otro proceso no guardó todavía
+    (hasta HISTORY_FLUSH_INTERVAL segundos) no se ve.
+
+    La tabla guarda por chat solo los max_turns turnos más recientes y el
+    último resumen: lo demás ya no se carga y se borra al guardar cada lote.
+    """
+
+    def __init__(self, app, max_turns: int = None, token_budget: int = None, max_chats: int = None,
+                 flush_interval: float = None, flush_size: int = None, summarize: bool = None,
+                 reload_after: float = None, followup_window: float = None):
+        self.app = app
+        self.max_turns = Config.HISTORY_MAX_TURNS if max_turns is None else max_turns
+        self.token_budget = Config.HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+        self.max_chats = Config.HISTORY_MAX_CHATS if max_chats is None else max_chats
+        self.flush_interval = Config.HISTORY_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.flush_size = Config.HISTORY_FLUSH_SIZE if flush_size is None else flush_size
+        self.summarize = Config.HISTORY_SUMMARIZE if summarize is None else summarize
+        self.reload_after = Config.HISTORY_RELOAD_AFTER if reload_after is None else reload_after
+        self.followup_window = Config.HISTORY_FOLLOWUP_WINDOW if followup_window is None else followup_window
+        self._chats = OrderedDict()
+        self._pending = []
+        # Lote que se está escribiendo: ya no está en _pending y quizá aún no en la base
+        self._writing = []
+        self._flush_task = None
+        self._flush_lock = None
+        # Guardados y resúmenes en segundo plano: se guarda la referencia para que no los recolecte el GC
+        self._flushes = set()
+        self._summaries = set()
+
+    # --- Lectura ---
+
+    def _load(self, bot_id, chat_id, unsaved: list = ()) -> ChatHistory:
+        """Carga los turnos recientes desde la base de datos (se ejecuta en un hilo).
+
+        unsaved son los turnos de este proceso que aún no se guardaron.
+        """
+        newest_first = (ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        with self.app.app_context():
+            chat = ChatMessage.query.filter_by(bot_id=bot_id, chat_id=chat_id)
+            # El resumen se consulta aparte: siempre se carga, aunque lo sigan más de max_turns turnos
+            summary = chat.filter(ChatMessage.role == "summary").order_by(*newest_first).first()
+            turns = chat.filter(ChatMessage.role != "summary")
+            if summary is not None:
+                turns = turns.filter(ChatMessage.created_at > summary.created_at)
+            rows = turns.order_by(*newest_first).limit(self.max_turns).all()
+            if summary is not None:
+                rows.append(summary)
+            last_row_id = self._last_row_id(bot_id, chat_id)
+        # En orden cronológico; un turno que se estaba guardando puede venir ya en las filas
+        entries = dict.fromkeys((row.role, row.content, row.created_at) for row in reversed(rows))
+        entries.update(dict.fromkeys((turn["role"], turn["content"], turn["created_at"]) for turn in unsaved))
+        # sorted es estable: el usuario y el bot de un intercambio comparten created_at
+        entries = sorted(entries, key=lambda entry: entry[2])
+        history = ChatHistory(self.max_turns)
+        history.last_row_id = last_row_id
+        # Lo anterior al último resumen ya está contenido en él
+        for role, content, created_at in reversed(entries):
+            if role == "summary":
+                history.summary = content
+                break
+            history.turns.appendleft({"role": role, "content": content, "created_at": created_at})
+        return history
+
+    def _last_row_id(self, bot_id, chat_id) -> int:
+        return db.session.query(func.max(ChatMessage.id)).filter_by(bot_id=bot_id, chat_id=chat_id).scalar() or 0
+
+    def _has_new_rows(self, bot_id, chat_id, last_row_id: int) -> bool:
+        with self.app.app_context():
+            return self._last_row_id(bot_id, chat_id) > last_row_id
+
+    def _unsaved(self, bot_id, chat_id) -> list:
+        """Turnos (y resúmenes) de este proceso que aún no están en la base."""
+        return [
+            {"role": row["role"], "content": row["content"], "created_at": row["created_at"]}
+            for row in self._writing + self._pending if row["bot_id"] == bot_id and row["chat_id"] == chat_id
+        ]
+
+    async def _get(self, bot_id, chat_id) -> ChatHistory:
+        # Un mismo usuario tiene el mismo chat_id con todos los bots
+        key = (bot_id, chat_id)
+        history = self._chats.get(key)
+        if history is None:
+            history = await asyncio.to_thread(self._load, bot_id, chat_id)
+            # Otro mensaje del mismo chat pudo cargarlo mientras tanto
+            history = self._chats.setdefault(key, history)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        elif (self.reload_after and not history.summarizing
+              and time.monotonic() - history.checked_at > self.reload_after):
+            history.checked_at = time.monotonic()
+            # Filas nuevas: las escribió otro proceso (o este, al guardar su lote); se recarga
+            if await asyncio.to_thread(self._has_new_rows, bot_id, chat_id, history.last_row_id):
+                history = await asyncio.to_thread(self._load, bot_id, chat_id, self._unsaved(bot_id, chat_id))
+                self._chats[key] = history
+        self._chats.move_to_end(key)
+        return history
+
+    async def get_messages(self, chat_id, bot_id=None) -> list:
+        """Mensajes de historial para el prompt, recortados al presupuesto de tokens."""
+        history = await self._get(bot_id, chat_id)
+        budget = self.token_budget
+        messages = []
+        if history.summary:
+            budget -= count_tokens(history.summary)
+        for turn in reversed(history.turns):
+            cost = count_tokens(turn["content"])
+            if cost > budget:
+                break
+            budget -= cost
+            messages.append({"role": turn["role"], "content": turn["content"]})
+        messages.reverse()
+        # Se recorta por intercambios completos: el historial no empieza con una respuesta suelta
+        if messages and messages[0]["role"] == "assistant":
+            messages.pop(0)
+        if history.summary:
+            messages.insert(0, {"role": "system", "content": f"RESUMEN DE LA CONVERSACIÓN PREVIA: {history.summary}"})
+        return messages
+
+    def is_follow_up(self, chat_id, bot_id=None) -> bool:
+        """True si el último turno del chat (ya cargado) tiene menos de followup_window segundos."""
+        history = self._chats.get((bot_id, chat_id))
+        if history is None or not history.turns:
+            return False
+        return time.time() - history.turns[-1]["created_at"] < self.followup_window
+
+    # --- Escritura ---
+
+    async def append(self, chat_id, user_message: str, bot_response: str, bot_id=None):
+        """Registra un intercambio; la escritura en la base de datos se hace en lote."""
+        history = await self._get(bot_id, chat_id)
+        now = time.time()
+        for role, content in (("user", user_message), ("assistant", bot_response)):
+            history.turns.append({"role": role, "content": content, "created_at": now})
+            self._pending.append({
+                "bot_id": bot_id, "chat_id": chat_id, "role": role, "content": content, "created_at": now
+            })
+
+        self._ensure_flusher()
+        if len(self._pending) >= self.flush_size:
+            self._spawn(self.flush(), self._flushes)
+        if self.summarize and not history.summarizing and history.tokens() > self.token_budget:
+            # Se marca aquí: otro append antes de que arranque la tarea no lanza un segundo resumen
+            history.summarizing = True
+            self._spawn(self._summarize(bot_id, chat_id, history), self._summaries)
+
+    @staticmethod
+    def _spawn(coroutine, tasks: set):
+        task = asyncio.create_task(coroutine)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    def _ensure_flusher(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _write(self, rows: list):
+        with self.app.app_context():
+            db.session.bulk_insert_mappings(ChatMessage, rows)
+            self._prune({row["chat_id"] for row in rows})
+            db.session.commit()
+
+    def _prune(self, chat_ids: set):
+        """Borra de esos chats lo que _load ya no carga: turnos fuera de los max_turns más recientes y resúmenes viejos."""
+        is_summary = ChatMessage.role == "summary"
+        ranked = (
+            db.session.query(
+                ChatMessage.id,
+                is_summary.label("is_summary"),
+                func.row_number().over(
+                    partition_by=(ChatMessage.bot_id, ChatMessage.chat_id, is_summary),
+                    order_by=(ChatMessage.created_at.desc(), ChatMessage.id.desc()),
+                ).label("position"),
+            )
+            .filter(ChatMessage.chat_id.in_(chat_ids))
+            .subquery()
+        )
+        stale = select(ranked.c.id).where(or_(
+            and_(ranked.c.is_summary, ranked.c.position > 1),
+            and_(~ranked.c.is_summary, ranked.c.position > self.max_turns),
+        ))
+        ChatMessage.query.filter(ChatMessage.id.in_(stale)).delete(synchronize_session=False)
+
+    async def flush(self):
+        """Guarda en un solo lote los turnos pendientes."""
+        if not self._pending:
+            return
+        # Se crea dentro del loop compartido, una sola vez: todos los guardados pasan por él
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return
+            self._writing = rows
+            try:
+                try:
+                    await asyncio.to_thread(self._write, rows)
+                except RuntimeError:
+                    # Al terminar el intérprete el pool de hilos ya no acepta tareas
+                    self._write(rows)
+            except Exception as e:
+                logger.error(f"Error guardando el historial ({len(rows)} turnos): {e}")
+                # Se reintentan en el próximo lote
+                self._pending = rows + self._pending
+            finally:
+                self._writing = []
+
+    async def close(self):
+        """Detiene el guardado periódico y los resúmenes en curso, y vacía lo pendiente."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        for task in self._summaries:
+            task.cancel()
+        # Los guardados en curso terminan: cancelarlos podría perder su lote
+        await asyncio.gather(*self._summaries, *self._flushes, return_exceptions=True)
+        await self.flush()
+
+    # --- Resumen ---
+
+    async def _summarize(self, bot_id, chat_id, history: ChatHistory):
+        """Condensa la mitad más antigua de los turnos en el resumen del chat."""
+        try:
+            # Intercambios completos (pares usuario/bot) de la mitad más antigua
+            old_turns = list(history.turns)[: max(2, len(history.turns) // 4 * 2)]
+            transcript = "\n".join(f"{t['role']}: {t['content']}" for t in old_turns)
+            response = await get_llm_governor().create(
+                priority=PRIORITY_BACKGROUND,
+                label="summary",
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "Resume en máximo 3 frases los datos relevantes de esta conversación (productos, cantidades, preferencias del cliente). Responde solo con el resumen."},
+                    {"role": "user", "content": f"Resumen previo: {history.summary or '(ninguno)'}\n\n{transcript}"}
+                ],
+                max_tokens=150,
+                temperature=0
+            )
+            summary = (response.choices[0].message.content or "").strip()
+            if not summary:
+                return
+            summarized = {id(turn) for turn in old_turns}
+            while history.turns and id(history.turns[0]) in summarized:
+                history.turns.popleft()
+            history.summary = summary
+            # Fechado justo después del último turno resumido: al recargar, lo anterior se omite
+            self._pending.append({
+                "bot_id": bot_id, "chat_id": chat_id, "role": "summary", "content": summary,
+                "created_at": old_turns[-1]["created_at"] + 1e-6
+            })
+        except Exception as e:
+            logger.error(f"Error resumiendo la conversación de {chat_id}: {e}")
+        finally:
+            history.summarizing = False
+
+
+_memory = None
+
+
+def get_conversation_memory(app):
+    """Retorna la memoria de conversación del proceso (None si está desactivada)."""
+    global _memory
+    if _memory is None and Config.HISTORY_ENABLED and app is not None:
+        _memory = ConversationMemory(app)
+    return _memory
+
+
+async def close_conversation_memory():
+    """Guarda los turnos pendientes (se llama al detener el bot)."""
+    if _memory is not None:
+        await _memory.close()
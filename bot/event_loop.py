@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundLoop:
+    """Loop de eventos persistente que vive en un hilo propio del proceso.
+
+    Las vistas de Flask (síncronas) programan corrutinas en este loop en lugar
+    de crear y cerrar uno por cada petición, de modo que los pools de conexión
+    del bot y del cliente HTTP se reutilizan entre actualizaciones.
+    """
+
+    def __init__(self, name: str = "bot-event-loop"):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Retorna el loop, arrancándolo si aún no existe."""
+        self.start()
+        return self._loop
+
+    def start(self):
+        """Arranca el hilo del loop (idempotente)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            ready = threading.Event()
+            self._loop = asyncio.new_event_loop()
+
+            def _run():
+                asyncio.set_event_loop(self._loop)
+                self._loop.call_soon(ready.set)
+                self._loop.run_forever()
+
+            self._thread = threading.Thread(target=_run, name=self.name, daemon=True)
+            self._thread.start()
+            ready.wait()
+            logger.info(f"Loop de eventos '{self.name}' iniciado")
+
+    def submit(self, coro):
+        """Programa una corrutina en el loop y retorna un concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: float = None):
+        """Ejecuta una corrutina en el loop y espera su resultado desde otro hilo."""
+        return self.submit(coro).result(timeout)
+
+    def stop(self, shutdown_coro=None, timeout: float = 10):
+        """Ejecuta una corrutina de cierre opcional y detiene el loop."""
+        if self._thread is None or not self._thread.is_alive():
+            if shutdown_coro is not None:
+                shutdown_coro.close()
+            return
+        try:
+            if shutdown_coro is not None:
+                self.run(shutdown_coro, timeout)
+        except Exception as e:
+            logger.error(f"Error cerrando el loop de eventos: {e}")
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            self._loop.close()
+            self._thread = None
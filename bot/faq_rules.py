@@ -0,0 +1,191 @@
+import re
+import string
+import logging
+
+try:
+    from re import _parser as _sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+
+from bot.intent_classifier import normalize_text
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Caracteres que re.IGNORECASE también iguala a una letra ASCII y que str.lower() no pliega
+_FOLD = str.maketrans({"ſ": "s", "ı": "i", "İ": "i"})
+# Caracteres de los literales que se usan para el prefiltro: su plegado es el de fold()
+_LITERAL_CHARS = set(string.ascii_letters + string.digits + " -'¿?¡!.,:;áéíóúüñÁÉÍÓÚÜÑ")
+# Largo del fragmento (n-grama de caracteres) con el que se indexa cada regla regex
+_GRAM = 3
+
+
+def split_keywords(pattern: str) -> list:
+    """Frases de una regla de palabras clave, normalizadas (sin acentos ni mayúsculas)."""
+    phrases = []
+    for phrase in pattern.split(","):
+        words = _WORD_RE.findall(normalize_text(phrase))
+        if words:
+            phrases.append(" ".join(words))
+    return phrases
+
+
+def validate_pattern(pattern: str, is_regex: bool):
+    """Retorna un mensaje de error si el patrón no sirve para una regla (None si es válido)."""
+    if not pattern.strip():
+        return "El patrón no puede estar vacío"
+    if not is_regex:
+        return None if split_keywords(pattern) else "Las palabras clave deben contener letras o números"
+    try:
+        # Se compila igual que en FaqMatcher: cada regla por separado (grupos y \1 son los propios)
+        compiled = re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        return f"Expresión regular inválida: {e}"
+    if compiled.search(""):
+        return "La expresión regular coincide con cualquier mensaje"
+    return None
+
+
+def fold(text: str) -> str:
+    """Minúsculas con el mismo plegado que re.IGNORECASE para los caracteres de _LITERAL_CHARS."""
+    return text.translate(_FOLD).lower()
+
+
+def _literal_runs(items, runs: list):
+    """Agrega a runs las secuencias de caracteres literales que toda coincidencia contiene."""
+    current = []
+    for op, av in items:
+        name = op.name
+        if name == "LITERAL" and chr(av) in _LITERAL_CHARS:
+            current.append(chr(av))
+            continue
+        if name == "AT":
+            # Anclas (\b, ^, $) de ancho cero: no separan los literales
+            continue
+        runs.append(fold("".join(current)))
+        current = []
+        if name == "SUBPATTERN":
+            _literal_runs(av[-1], runs)
+        elif name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") and av[0] >= 1:
+            _literal_runs(av[2], runs)
+        elif name == "ATOMIC_GROUP":
+            _literal_runs(av, runs)
+        # Alternativas, clases, lookarounds y referencias: nada obligatorio que extraer
+    runs.append(fold("".join(current)))
+
+
+def required_literals(pattern: str) -> tuple:
+    """Textos (plegados con fold) que aparecen en todo mensaje que coincide con el patrón.
+
+    Vacío si no se pudo analizar el patrón o si no hay ninguno (p. ej. es
+    una alternancia de palabras).
+    """
+    runs = []
+    try:
+        _literal_runs(_sre_parse.parse(pattern, re.IGNORECASE), runs)
+    except Exception:
+        return ()
+    return tuple(sorted({run for run in runs if run}, key=len, reverse=True))
+
+
+class FaqMatcher:
+    """Encuentra la regla de preguntas frecuentes que corresponde a un mensaje.
+
+    Las palabras clave se buscan en un diccionario con los n-gramas de
+    palabras del mensaje, así el costo depende del largo del mensaje y no del
+    número de reglas. Cada regla regex se indexa por un n-grama de los textos
+    que toda coincidencia contiene (required_literals): solo se prueban las
+    reglas cuyos textos aparecen todos en el mensaje, por orden de prioridad,
+    más las que no tienen un texto obligatorio de al menos _GRAM caracteres,
+    que se prueban siempre. Si coinciden varias, gana la de menor prioridad.
+    """
+
+    def __init__(self, rules: list):
+        self.rules = {}
+        self._keywords = {}
+        self._max_words = 0
+        # n-grama -> [(rango, id, textos obligatorios, regex)]; sin n-grama: [(rango, id, regex)]
+        self._by_gram = {}
+        self._unindexed = []
+        indexed = []
+        for rule in sorted(rules, key=lambda r: (r["priority"], r["id"])):
+            if not rule.get("enabled", True):
+                continue
+            if validate_pattern(rule["pattern"], rule["is_regex"]):
+                logger.warning(f"Regla de FAQ {rule['id']} ignorada: patrón inválido")
+                continue
+            self.rules[rule["id"]] = rule
+            if rule["is_regex"]:
+                rank = (rule["priority"], rule["id"])
+                compiled = re.compile(rule["pattern"], re.IGNORECASE)
+                literals = required_literals(rule["pattern"])
+                if literals and len(literals[0]) >= _GRAM:
+                    indexed.append((rank, rule["id"], literals, compiled))
+                else:
+                    self._unindexed.append((rank, rule["id"], compiled))
+                continue
+            for phrase in split_keywords(rule["pattern"]):
+                # Con la misma frase en dos reglas se queda la de mayor prioridad (la primera)
+                self._keywords.setdefault(phrase, rule["id"])
+                self._max_words = max(self._max_words, phrase.count(" ") + 1)
+        # Cada regla va al n-grama de sus textos que menos reglas comparten
+        counts = {}
+        for *_, literals, _ in indexed:
+            for gram in self._rule_grams(literals):
+                counts[gram] = counts.get(gram, 0) + 1
+        for entry in indexed:
+            gram = min(self._rule_grams(entry[2]), key=lambda g: (counts[g], g))
+            self._by_gram.setdefault(gram, []).append(entry)
+        if self._unindexed:
+            logger.info(f"{len(self._unindexed)} reglas regex sin texto obligatorio: se prueban en cada mensaje")
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _rank(self, rule_id: int) -> tuple:
+        rule = self.rules[rule_id]
+        return rule["priority"], rule_id
+
+    @staticmethod
+    def _grams(text: str) -> set:
+        return {text[i:i + _GRAM] for i in range(len(text) - _GRAM + 1)}
+
+    @classmethod
+    def _rule_grams(cls, literals: tuple) -> set:
+        return set().union(*(cls._grams(literal) for literal in literals))
+
+    def candidates(self, message: str) -> list:
+        """Reglas regex que pueden coincidir con el mensaje: [(rango, id, regex)] por prioridad."""
+        folded = fold(message)
+        found = list(self._unindexed)
+        # Se recorre lo más corto: los n-gramas indexados o los del mensaje
+        if len(self._by_gram) < len(folded):
+            grams = [gram for gram in self._by_gram if gram in folded]
+        else:
+            grams = self._grams(folded)
+        for gram in grams:
+            for rank, rule_id, literals, compiled in self._by_gram.get(gram, ()):
+                if all(literal in folded for literal in literals):
+                    found.append((rank, rule_id, compiled))
+        found.sort(key=lambda candidate: candidate[0])
+        return found
+
+    def match(self, message: str):
+        """Retorna la regla (dict) que coincide con el mensaje, o None."""
+        best = None
+        if self._keywords:
+            words = _WORD_RE.findall(normalize_text(message))
+            for i in range(len(words)):
+                for n in range(1, min(self._max_words, len(words) - i) + 1):
+                    rule_id = self._keywords.get(" ".join(words[i:i + n]))
+                    if rule_id is not None and (best is None or self._rank(rule_id) < self._rank(best)):
+                        best = rule_id
+        if self._by_gram or self._unindexed:
+            for rank, rule_id, compiled in self.candidates(message):
+                if best is not None and rank >= self._rank(best):
+                    break
+                if compiled.search(message):
+                    best = rule_id
+                    break
+        return self.rules[best] if best is not None else None
@@ -0,0 +1,70 @@
+import time
+import logging
+
+from config import Config
+from bot.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache(SQLiteStore):
+    """Caché persistente de file_id de Telegram para fotos ya enviadas.
+
+    Se indexa por búsqueda ("q:...") y por URL ("u:..."); al reenviar el
+    file_id Telegram no vuelve a descargar la imagen. Los file_id solo
+    valen para el bot que subió la foto, así que las claves llevan el id
+    del bot delante. Tamaño acotado con desalojo LRU según la última vez
+    que se usó cada entrada.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS photo_file_ids (
+        key TEXT PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        last_used REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ix_photo_file_ids_last_used ON photo_file_ids (last_used);
+    """
+
+    def __init__(self, path: str = None, max_size: int = None):
+        super().__init__(path or Config.FILE_ID_CACHE_DB)
+        self.max_size = Config.FILE_ID_CACHE_SIZE if max_size is None else max_size
+
+    @staticmethod
+    def bot_scope(bot) -> str:
+        """Id numérico del bot (la parte del token antes de ':'), sin llamar a getMe."""
+        return bot.token.partition(":")[0]
+
+    @staticmethod
+    def query_key(query: str, scope: str = "") -> str:
+        return f"{scope}:q:" + " ".join(query.lower().split())
+
+    @staticmethod
+    def url_key(url: str, scope: str = "") -> str:
+        return f"{scope}:u:" + url
+
+    def get(self, key: str):
+        """Retorna el file_id guardado (o None) y marca la entrada como usada."""
+        row = self.execute("SELECT file_id FROM photo_file_ids WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.execute("UPDATE photo_file_ids SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def set(self, file_id: str, *keys):
+        """Asocia el file_id a una o más claves y aplica el límite de tamaño."""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO photo_file_ids (key, file_id, last_used) VALUES (?, ?, ?)",
+            [(key, file_id, now) for key in keys if key]
+        )
+        self.execute(
+            """DELETE FROM photo_file_ids WHERE key IN (
+                SELECT key FROM photo_file_ids ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_size,)
+        )
+
+    def invalidate(self, file_id: str):
+        """Elimina todas las claves que apuntan a un file_id rechazado por Telegram."""
+        self.execute("DELETE FROM photo_file_ids WHERE file_id = ?", (file_id,))
@@ -0,0 +1,54 @@
+import time
+import logging
+
+from config import Config
+from bot.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache(SQLiteStore):
+    """Caché persistente búsqueda → URL de imagen, con resultados negativos.
+
+    Un URL NULL indica que la búsqueda falló; se guarda con un TTL más corto
+    para no repetir el crawl en cada mensaje.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS image_cache (
+        query TEXT PRIMARY KEY,
+        url TEXT,
+        expires_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path: str = None, ttl: float = None, negative_ttl: float = None):
+        super().__init__(path or Config.IMAGE_CACHE_DB)
+        self.ttl = Config.IMAGE_CACHE_TTL if ttl is None else ttl
+        self.negative_ttl = Config.IMAGE_NEGATIVE_TTL if negative_ttl is None else negative_ttl
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def get(self, query: str) -> tuple:
+        """Retorna (encontrado, url). url es None en un resultado negativo cacheado."""
+        row = self.execute(
+            "SELECT url FROM image_cache WHERE query = ? AND expires_at > ?",
+            (self.normalize(query), time.time())
+        ).fetchone()
+        if row is None:
+            return False, None
+        return True, row[0]
+
+    def set(self, query: str, url: str = None):
+        """Guarda el resultado (url=None para un resultado negativo)."""
+        ttl = self.ttl if url else self.negative_ttl
+        self.execute(
+            "INSERT OR REPLACE INTO image_cache (query, url, expires_at) VALUES (?, ?, ?)",
+            (self.normalize(query), url, time.time() + ttl)
+        )
+
+    def prune(self):
+        """Elimina las entradas vencidas."""
+        self.execute("DELETE FROM image_cache WHERE expires_at <= ?", (time.time(),))
@@ -0,0 +1,262 @@
+import os
+import json
+import math
+import time
+import atexit
+import random
+import logging
+import threading
+import unicodedata
+from collections import Counter, deque
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin acentos y con espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.split())
+
+
+def char_ngrams(text: str, ngram_range=(2, 4)) -> Counter:
+    """Cuenta los n-gramas de caracteres de cada palabra (con bordes marcados)."""
+    low, high = ngram_range
+    grams = []
+    for word in normalize_text(text).split():
+        padded = f" {word} "
+        size = len(padded)
+        for n in range(low, high + 1):
+            grams.extend([padded[i:i + n] for i in range(size - n + 1)])
+    return Counter(grams)
+
+
+class IntentClassifier:
+    """Clasificador lineal (regresión logística multinomial) sobre n-gramas TF-IDF.
+
+    Implementado en Python puro para no añadir dependencias pesadas; con el
+    tamaño de estos mensajes predice en una fracción de milisegundo.
+    """
+
+    def __init__(self, labels, idf, weights, bias, ngram_range=(2, 4)):
+        self.labels = list(labels)
+        self.idf = idf
+        self.weights = weights
+        self.bias = list(bias)
+        self.ngram_range = tuple(ngram_range)
+
+    def vectorize(self, text: str) -> dict:
+        """Vector TF-IDF normalizado (L2) restringido al vocabulario del modelo."""
+        idf = self.idf
+        log = math.log
+        vector = {
+            gram: (1.0 + log(count)) * idf[gram]
+            for gram, count in char_ngrams(text, self.ngram_range).items() if gram in idf
+        }
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        if norm:
+            vector = {gram: v / norm for gram, v in vector.items()}
+        return vector
+
+    def _scores(self, vector: dict) -> list:
+        scores = list(self.bias)
+        weights = self.weights
+        n_labels = len(scores)
+        for gram, value in vector.items():
+            row = weights.get(gram)
+            if row is not None:
+                for k in range(n_labels):
+                    scores[k] += row[k] * value
+        return scores
+
+    @staticmethod
+    def _softmax(scores: list) -> list:
+        top = max(scores)
+        exps = [math.exp(s - top) for s in scores]
+        total = sum(exps)
+        return [e / total for e in exps]
+
+    def predict_proba(self, text: str) -> dict:
+        """Probabilidad de cada intención."""
+        probs = self._softmax(self._scores(self.vectorize(text)))
+        return dict(zip(self.labels, probs))
+
+    def predict(self, text: str) -> tuple:
+        """Retorna (intención, confianza)."""
+        probs = self._softmax(self._scores(self.vectorize(text)))
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.labels[best], probs[best]
+
+    @classmethod
+    def train(cls, texts, labels, epochs=30, learning_rate=0.5, l2=1e-4,
+              ngram_range=(2, 4), min_df=1, seed=13):
+        """Entrena el modelo con descenso de gradiente estocástico."""
+        label_names = sorted(set(labels))
+        label_index = {name: i for i, name in enumerate(label_names)}
+
+        # Vocabulario e IDF
+        doc_freq = Counter()
+        for text in texts:
+            doc_freq.update(char_ngrams(text, ngram_range).keys())
+        n_docs = len(texts)
+        idf = {
+            gram: math.log((1 + n_docs) / (1 + df)) + 1.0
+            for gram, df in doc_freq.items() if df >= min_df
+        }
+
+        model = cls(label_names, idf, {}, [0.0] * len(label_names), ngram_range)
+        samples = [(model.vectorize(t), label_index[l]) for t, l in zip(texts, labels)]
+        rng = random.Random(seed)
+        n_labels = len(label_names)
+
+        for epoch in range(epochs):
+            rng.shuffle(samples)
+            rate = learning_rate / (1.0 + 0.1 * epoch)
+            for vector, target in samples:
+                probs = cls._softmax(model._scores(vector))
+                for k in range(n_labels):
+                    grad = probs[k] - (1.0 if k == target else 0.0)
+                    model.bias[k] -= rate * grad
+                    if not grad:
+                        continue
+                    for gram, value in vector.items():
+                        row = model.weights.get(gram)
+                        if row is None:
+                            row = model.weights[gram] = [0.0] * n_labels
+                        row[k] -= rate * (grad * value + l2 * row[k])
+        return model
+
+    def to_dict(self) -> dict:
+        """Convierte el modelo a diccionario serializable."""
+        return {
+            "labels": self.labels,
+            "ngram_range": list(self.ngram_range),
+            "idf": self.idf,
+            "weights": {gram: [round(w, 6) for w in row] for gram, row in self.weights.items()},
+            "bias": self.bias,
+        }
+
+    def save(self, path: str):
+        """Guarda el modelo como JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        """Carga un modelo guardado con save()."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["labels"], data["idf"], data["weights"], data["bias"], data.get("ngram_range", (2, 4)))
+
+
+# Modelo cargado una sola vez por proceso
+_classifier = None
+_classifier_loaded = False
+
+
+def get_intent_classifier():
+    """Retorna el clasificador local o None si no hay modelo entrenado."""
+    global _classifier, _classifier_loaded
+    if not _classifier_loaded:
+        _classifier_loaded = True
+        path = Config.INTENT_MODEL_PATH
+        if path and os.path.exists(path):
+            try:
+                _classifier = IntentClassifier.load(path)
+                logger.info(f"Clasificador de intenciones local cargado desde {path}")
+            except Exception as e:
+                logger.error(f"No se pudo cargar el clasificador de intenciones: {e}")
+    return _classifier
+
+
+class LabelLog:
+    """Log JSONL de mensajes etiquetados con escritura diferida.
+
+    record() solo agrega la línea a un buffer acotado; un hilo propio la
+    escribe en el archivo cada flush_interval segundos, fuera del loop de
+    eventos (igual que el registro de interacciones).
+    """
+
+    def __init__(self, path: str, flush_interval: float = 2.0, max_pending: int = 10000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._pending = deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def record(self, text: str, intent: str):
+        """Agrega un mensaje etiquetado al buffer (no bloquea)."""
+        line = json.dumps({"text": text, "intent": intent}, ensure_ascii=False) + "\n"
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(line)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, name="label-log", daemon=True)
+                self._flusher.start()
+
+    def _reset_after_fork(self):
+        """El hilo de volcado no sobrevive a un fork: el hijo empieza con el buffer vacío."""
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending.clear()
+        self._flusher = None
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Escribe en el archivo las líneas pendientes."""
+        with self._flush_lock:
+            with self._lock:
+                lines = list(self._pending)
+                self._pending.clear()
+            if not lines:
+                return
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+            except OSError as e:
+                logger.error(f"No se pudo registrar {len(lines)} mensajes etiquetados: {e}")
+
+
+_label_log = None
+
+
+def get_label_log():
+    """Retorna el log de mensajes etiquetados del proceso (None si INTENT_LOG_PATH está vacío)."""
+    global _label_log
+    if _label_log is None and Config.INTENT_LOG_PATH:
+        _label_log = LabelLog(Config.INTENT_LOG_PATH)
+        atexit.register(_label_log.flush)
+    return _label_log
+
+
+def log_labeled_message(text: str, intent: str):
+    """Agrega un mensaje etiquetado por el LLM al log de entrenamiento (si está activo)."""
+    label_log = get_label_log()
+    if label_log:
+        label_log.record(text, intent)
+
+
+def load_labeled_messages(path: str) -> tuple:
+    """Lee un JSONL con campos 'text' e 'intent' y retorna (textos, etiquetas)."""
+    texts, labels = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("text") and record.get("intent"):
+                texts.append(record["text"])
+                labels.append(record["intent"])
+    return texts, labels
@@ -0,0 +1,280 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from bisect import bisect_left
+from collections import deque, Counter
+
+from config import Config
+from bot.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (segundos) de los buckets de latencia: crecen un 20% cada uno,
+# así los percentiles agregados tienen como mucho ~20% de error
+LATENCY_BUCKETS = tuple(round(0.01 * 1.2 ** i, 4) for i in range(52))
+
+
+class InteractionStore(SQLiteStore):
+    """Historial de interacciones y sus agregados por hora en una base SQLite (WAL) propia.
+
+    Cada lote inserta los registros individuales y, en la misma
+    transacción, suma sus conteos, latencias y tokens a las tablas por
+    hora. La página de analítica solo lee esos agregados (unas filas por
+    hora, bot e intención), nunca recorre la tabla de interacciones.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS interactions (
+        id INTEGER PRIMARY KEY,
+        ts REAL NOT NULL,
+        bot_id INTEGER,
+        chat_id INTEGER,
+        route TEXT NOT NULL,
+        intent TEXT NOT NULL,
+        latency REAL NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        error TEXT,
+        message_chars INTEGER NOT NULL,
+        message TEXT
+    );
+    CREATE INDEX IF NOT EXISTS ix_interactions_ts ON interactions (ts);
+    CREATE TABLE IF NOT EXISTS interactions_hourly (
+        hour INTEGER NOT NULL,
+        bot_id INTEGER NOT NULL,
+        route TEXT NOT NULL,
+        intent TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        errors INTEGER NOT NULL,
+        latency_sum REAL NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        PRIMARY KEY (hour, bot_id, route, intent)
+    );
+    CREATE TABLE IF NOT EXISTS latency_hourly (
+        hour INTEGER NOT NULL,
+        bot_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (hour, bot_id, bucket)
+    );
+    """
+
+    def __init__(self, path: str = None):
+        super().__init__(path or Config.INTERACTION_LOG_DB)
+
+    def write(self, records: list):
+        """Inserta un lote de registros y actualiza los agregados por hora."""
+        totals = {}
+        latencies = Counter()
+        for record in records:
+            hour = int(record["ts"] // 3600)
+            # En las claves primarias NULL no se agrupa: 0 es "sin bot"
+            bot_id = record["bot_id"] or 0
+            key = (hour, bot_id, record["route"], record["intent"])
+            total = totals.setdefault(key, [0, 0, 0.0, 0, 0])
+            total[0] += 1
+            total[1] += record["error"] is not None
+            total[2] += record["latency"]
+            total[3] += record["prompt_tokens"]
+            total[4] += record["completion_tokens"]
+            latencies[(hour, bot_id, bisect_left(LATENCY_BUCKETS, record["latency"]))] += 1
+
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                """INSERT INTO interactions (ts, bot_id, chat_id, route, intent, latency, prompt_tokens,
+                       completion_tokens, error, message_chars, message)
+                   VALUES (:ts, :bot_id, :chat_id, :route, :intent, :latency, :prompt_tokens,
+                       :completion_tokens, :error, :message_chars, :message)""",
+                records
+            )
+            conn.executemany(
+                """INSERT INTO interactions_hourly VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (hour, bot_id, route, intent) DO UPDATE SET
+                       count = count + excluded.count,
+                       errors = errors + excluded.errors,
+                       latency_sum = latency_sum + excluded.latency_sum,
+                       prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                       completion_tokens = completion_tokens + excluded.completion_tokens""",
+                [key + tuple(total) for key, total in totals.items()]
+            )
+            conn.executemany(
+                """INSERT INTO latency_hourly VALUES (?, ?, ?, ?)
+                   ON CONFLICT (hour, bot_id, bucket) DO UPDATE SET count = count + excluded.count""",
+                [key + (count,) for key, count in latencies.items()]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def prune(self, retention_days: float):
+        """Elimina los registros individuales antiguos (los agregados se conservan)."""
+        self.execute("DELETE FROM interactions WHERE ts < ?", (time.time() - retention_days * 86400,))
+
+    def summary(self, since: float, bot_id: int = None) -> dict:
+        """Mezcla de intenciones, percentiles de latencia y serie por hora desde since."""
+        where, params = "hour >= ?", [int(since // 3600)]
+        if bot_id is not None:
+            where += " AND bot_id = ?"
+            params.append(bot_id)
+
+        mix = [
+            {"route": row[0], "intent": row[1], "count": row[2], "errors": row[3],
+             "avg_latency": row[4] / row[2] if row[2] else None, "prompt_tokens": row[5], "completion_tokens": row[6]}
+            for row in self.execute(
+                f"""SELECT route, intent, SUM(count), SUM(errors), SUM(latency_sum), SUM(prompt_tokens),
+                        SUM(completion_tokens)
+                    FROM interactions_hourly WHERE {where} GROUP BY route, intent ORDER BY SUM(count) DESC""",
+                params
+            )
+        ]
+        hourly = [
+            {"hour": row[0] * 3600, "count": row[1], "errors": row[2], "tokens": row[3]}
+            for row in self.execute(
+                f"""SELECT hour, SUM(count), SUM(errors), SUM(prompt_tokens + completion_tokens)
+                    FROM interactions_hourly WHERE {where} GROUP BY hour ORDER BY hour""",
+                params
+            )
+        ]
+        histogram = dict(self.execute(
+            f"SELECT bucket, SUM(count) FROM latency_hourly WHERE {where} GROUP BY bucket", params
+        ).fetchall())
+        return {
+            "count": sum(item["count"] for item in mix),
+            "errors": sum(item["errors"] for item in mix),
+            "prompt_tokens": sum(item["prompt_tokens"] for item in mix),
+            "completion_tokens": sum(item["completion_tokens"] for item in mix),
+            "mix": mix,
+            "hourly": hourly,
+            "p50": histogram_percentile(histogram, 50),
+            "p95": histogram_percentile(histogram, 95),
+            "p99": histogram_percentile(histogram, 99),
+        }
+
+
+def histogram_percentile(histogram: dict, pct: float):
+    """Percentil aproximado (límite superior del bucket) de {bucket: conteo}."""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    target = total * pct / 100
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= target:
+            return LATENCY_BUCKETS[bucket] if bucket < len(LATENCY_BUCKETS) else float("inf")
+    return None
+
+
+class InteractionLog:
+    """Registro de interacciones con escritura diferida (write-behind).
+
+    record() solo agrega el registro a un buffer en memoria, sin E/S en el
+    loop de eventos; un hilo propio lo vuelca en lotes cada flush_interval
+    segundos o al juntar flush_size registros. El buffer está acotado: si la
+    base no responde se descartan los registros más antiguos.
+    """
+
+    def __init__(self, store: InteractionStore = None, flush_interval: float = None, flush_size: int = None,
+                 max_pending: int = None, store_text: bool = None):
+        self.store = store or InteractionStore()
+        self.flush_interval = Config.INTERACTION_LOG_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.flush_size = Config.INTERACTION_LOG_FLUSH_SIZE if flush_size is None else flush_size
+        self.max_pending = Config.INTERACTION_LOG_MAX_PENDING if max_pending is None else max_pending
+        self.store_text = Config.INTERACTION_LOG_TEXT if store_text is None else store_text
+        self.dropped = 0
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flusher = None
+        self._last_prune = 0.0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    @property
+    def pending(self) -> int:
+        """Registros en memoria que aún no se escribieron."""
+        return len(self._pending)
+
+    def record(self, bot_id, chat_id, route: str, intent: str, latency: float, message: str = "",
+               prompt_tokens: int = 0, completion_tokens: int = 0, error: str = None):
+        """Agrega una interacción al buffer (no bloquea)."""
+        record = {
+            "ts": time.time(), "bot_id": bot_id, "chat_id": chat_id, "route": route, "intent": intent or "",
+            "latency": latency, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "error": error, "message_chars": len(message), "message": message if self.store_text else None,
+        }
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self._pending.popleft()
+                self.dropped += 1
+            self._pending.append(record)
+            full = len(self._pending) >= self.flush_size
+        self._ensure_flusher()
+        if full:
+            self._wakeup.set()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, name="interaction-log", daemon=True)
+                self._flusher.start()
+
+    def _reset_after_fork(self):
+        """El hilo de volcado no sobrevive a un fork: el hijo empieza con el buffer vacío."""
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending.clear()
+        self._flusher = None
+
+    def _flush_periodically(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if time.monotonic() - self._last_prune > 3600:
+                self._last_prune = time.monotonic()
+                try:
+                    self.store.prune(Config.INTERACTION_LOG_RETENTION_DAYS)
+                except Exception as e:
+                    logger.error(f"Error limpiando el registro de interacciones: {e}")
+
+    def flush(self):
+        """Escribe en un solo lote los registros pendientes."""
+        with self._flush_lock:
+            with self._lock:
+                records = list(self._pending)
+                self._pending.clear()
+            if not records:
+                return
+            try:
+                self.store.write(records)
+            except Exception as e:
+                logger.error(f"Error guardando el registro de interacciones ({len(records)} registros): {e}")
+                # Se reintentan en el próximo lote, sin pasar del límite del buffer
+                with self._lock:
+                    self._pending.extendleft(reversed(records))
+                    while len(self._pending) > self.max_pending:
+                        self._pending.popleft()
+                        self.dropped += 1
+
+
+_interaction_log = None
+
+
+def get_interaction_log():
+    """Retorna el registro de interacciones del proceso (None si está desactivado)."""
+    global _interaction_log
+    if _interaction_log is None and Config.INTERACTION_LOG_ENABLED:
+        _interaction_log = InteractionLog()
+        atexit.register(_interaction_log.flush)
+    return _interaction_log
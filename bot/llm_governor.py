@@ -0,0 +1,428 @@
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+import contextvars
+from collections import deque
+
+import openai
+
+from config import Config
+from bot.openai_client import get_openai_client
+
+logger = logging.getLogger(__name__)
+
+# Clases de prioridad (menor = primero)
+PRIORITY_ANSWER = 0
+PRIORITY_INTENT = 1
+PRIORITY_BACKGROUND = 2
+
+# Errores transitorios que vale la pena reintentar
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class LLMUnavailable(Exception):
+    """OpenAI no está disponible (circuito abierto o reintentos agotados)."""
+
+
+def estimate_tokens(messages, max_tokens: int) -> int:
+    """Estimación barata de tokens de una petición (~4 caracteres por token)."""
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return prompt_chars // 4 + (max_tokens or 0)
+
+
+class RateBudget:
+    """Presupuesto de peticiones y tokens por minuto (token buckets con recarga continua)."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = rpm
+        self._tokens = tpm
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def wait_time(self, tokens: int) -> float:
+        """Segundos hasta que haya presupuesto para una petición de `tokens`."""
+        self._refill()
+        tokens = min(tokens, self.tpm)
+        request_wait = max(0.0, (1 - self._requests) * 60 / self.rpm)
+        token_wait = max(0.0, (tokens - self._tokens) * 60 / self.tpm)
+        return max(request_wait, token_wait)
+
+    def consume(self, tokens: int):
+        self._refill()
+        self._requests -= 1
+        self._tokens -= tokens
+
+    def adjust(self, delta_tokens: int):
+        """Corrige la estimación con el uso real informado por la API."""
+        self._tokens -= delta_tokens
+
+
+class CircuitBreaker:
+    """Abre el circuito tras varios fallos seguidos; tras el enfriamiento deja pasar una prueba."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def is_probe(self) -> bool:
+        """True si la próxima llamada permitida sería la prueba de half-open."""
+        return self.state == "half_open" and not self._probing
+
+    def release_probe(self):
+        """Libera la prueba si terminó sin registrar éxito ni fallo (p. ej. la tarea se canceló)."""
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning("Circuito de OpenAI abierto por fallos consecutivos")
+            self.opened_at = time.monotonic()
+
+
+# Tokens del mensaje que se está procesando en la tarea actual (ver UsageTracker)
+_current_usage = contextvars.ContextVar("llm_usage", default=None)
+
+
+class UsageTracker:
+    """Suma los tokens de las llamadas a OpenAI hechas dentro del bloque with.
+
+    Usa una ContextVar, así que solo cuenta las llamadas de la tarea actual
+    (y de las tareas que esta cree), no las de otros mensajes concurrentes.
+    """
+
+    __slots__ = ("prompt_tokens", "completion_tokens", "_token")
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_usage.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _current_usage.reset(self._token)
+        return False
+
+
+class CallStats:
+    """Métricas por tipo de llamada: latencias, tokens, errores, reintentos, hedges."""
+
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.hedges = 0
+        self.fallbacks = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def percentile(self, pct: float):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "fallbacks": self.fallbacks,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+        }
+
+
+class LLMGovernor:
+    """Capa por la que pasan todas las completions de OpenAI.
+
+    - Presupuesto RPM/TPM con colas por prioridad (respuestas antes que intenciones).
+    - Timeout por intento y reintentos con backoff exponencial y jitter.
+    - Hedging opcional: si una petición supera el p95 observado se lanza una
+      segunda y se usa la primera que responda.
+    - Circuit breaker: con el circuito abierto se usa el modelo de respaldo o
+      se lanza LLMUnavailable para que el handler responda un mensaje fijo.
+    """
+
+    def __init__(self, rpm: float = None, tpm: float = None, timeout: float = None, max_retries: int = None,
+                 hedge: bool = None, hedge_min_delay: float = None, fallback_model: str = None,
+                 breaker_threshold: int = None, breaker_cooldown: float = None):
+        self.budget = RateBudget(
+            Config.OPENAI_RPM if rpm is None else rpm,
+            Config.OPENAI_TPM if tpm is None else tpm,
+        )
+        self.timeout = Config.LLM_TIMEOUT if timeout is None else timeout
+        self.max_retries = Config.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.hedge = Config.LLM_HEDGE_ENABLED if hedge is None else hedge
+        self.hedge_min_delay = Config.LLM_HEDGE_MIN_DELAY if hedge_min_delay is None else hedge_min_delay
+        self.fallback_model = Config.OPENAI_FALLBACK_MODEL if fallback_model is None else fallback_model
+        self.breaker = CircuitBreaker(
+            Config.LLM_BREAKER_THRESHOLD if breaker_threshold is None else breaker_threshold,
+            Config.LLM_BREAKER_COOLDOWN if breaker_cooldown is None else breaker_cooldown,
+        )
+        self.stats = {}
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._pump_task = None
+
+    # --- Admisión por prioridad ---
+
+    async def _admit(self, priority: int, tokens: int):
+        if not self._waiters and self.budget.wait_time(tokens) <= 0:
+            self.budget.consume(tokens)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), tokens, future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        """Libera a los que esperan, siempre el de mayor prioridad primero."""
+        while self._waiters:
+            priority, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            wait = self.budget.wait_time(tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self._waiters)
+            self.budget.consume(tokens)
+            future.set_result(None)
+
+    @property
+    def waiting(self) -> int:
+        """Llamadas esperando presupuesto RPM/TPM."""
+        return len(self._waiters)
+
+    def _try_admit_now(self, tokens: int) -> bool:
+        if self._waiters or self.budget.wait_time(tokens) > 0:
+            return False
+        self.budget.consume(tokens)
+        return True
+
+    # --- Llamadas ---
+
+    def _stats_for(self, label: str) -> CallStats:
+        stats = self.stats.get(label)
+        if stats is None:
+            stats = self.stats[label] = CallStats()
+        return stats
+
+    async def _attempt(self, kwargs: dict):
+        # El cliente se crea con max_retries=0: los reintentos los maneja el governor (LLM_MAX_RETRIES)
+        return await asyncio.wait_for(get_openai_client().chat.completions.create(**kwargs), timeout=self.timeout)
+
+    async def _hedged_attempt(self, kwargs: dict, stats: CallStats, tokens: int):
+        p95 = stats.percentile(95)
+        if not self.hedge or p95 is None or len(stats.latencies) < 20:
+            return await self._attempt(kwargs)
+
+        first = asyncio.create_task(self._attempt(kwargs))
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=max(p95, self.hedge_min_delay))
+            if done or not self._try_admit_now(tokens):
+                return await first
+
+            stats.hedges += 1
+            pending.add(asyncio.create_task(self._attempt(kwargs)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # La petición que perdió, o ambas si se canceló a quien llama
+            for task in pending:
+                task.cancel()
+
+    def _record_usage(self, stats: CallStats, response, estimated: int):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        stats.prompt_tokens += usage.prompt_tokens or 0
+        stats.completion_tokens += usage.completion_tokens or 0
+        tracker = _current_usage.get()
+        if tracker is not None:
+            tracker.prompt_tokens += usage.prompt_tokens or 0
+            tracker.completion_tokens += usage.completion_tokens or 0
+        self.budget.adjust((usage.total_tokens or 0) - estimated)
+
+    async def create(self, priority: int = PRIORITY_ANSWER, label: str = "completion", **kwargs):
+        """Equivalente gobernado de client.chat.completions.create (sin streaming)."""
+        stats = self._stats_for(label)
+        tokens = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+
+        probe = self.breaker.is_probe()
+        if not self.breaker.allow():
+            return await self._fallback(priority, label, tokens, kwargs)
+        try:
+            return await self._create_with_retries(stats, priority, label, tokens, kwargs)
+        finally:
+            if probe:
+                self.breaker.release_probe()
+
+    async def _create_with_retries(self, stats: CallStats, priority: int, label: str, tokens: int, kwargs: dict):
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                stats.retries += 1
+                # Backoff exponencial con jitter completo
+                await asyncio.sleep(random.uniform(0, min(8.0, 0.5 * 2 ** attempt)))
+            await self._admit(priority, tokens)
+            start = time.monotonic()
+            stats.calls += 1
+            try:
+                response = await self._hedged_attempt(kwargs, stats, tokens)
+            except RETRYABLE_ERRORS as e:
+                stats.errors += 1
+                last_error = e
+                logger.warning(f"OpenAI ({label}) falló en el intento {attempt + 1}: {type(e).__name__}")
+                continue
+            except Exception as e:
+                # Errores de la petición (4xx): no indican una caída del servicio, sino que responde
+                stats.errors += 1
+                if isinstance(e, openai.APIStatusError):
+                    self.breaker.record_success()
+                raise
+            stats.latencies.append(time.monotonic() - start)
+            self._record_usage(stats, response, tokens)
+            self.breaker.record_success()
+            return response
+
+        self.breaker.record_failure()
+        if self.fallback_model and kwargs.get("model") != self.fallback_model:
+            return await self._fallback(priority, label, tokens, kwargs)
+        raise LLMUnavailable(f"OpenAI no respondió tras {self.max_retries + 1} intentos: {last_error}")
+
+    async def _fallback(self, priority: int, label: str, tokens: int, kwargs: dict):
+        """Llamada única al modelo de respaldo (si está configurado)."""
+        if not self.fallback_model:
+            raise LLMUnavailable("Circuito de OpenAI abierto")
+        stats = self._stats_for(label)
+        stats.fallbacks += 1
+        await self._admit(priority, tokens)
+        start = time.monotonic()
+        try:
+            response = await self._attempt(dict(kwargs, model=self.fallback_model))
+        except Exception as e:
+            stats.errors += 1
+            raise LLMUnavailable(f"Modelo de respaldo no disponible: {e}") from e
+        stats.latencies.append(time.monotonic() - start)
+        self._record_usage(stats, response, tokens)
+        return response
+
+    async def stream(self, priority: int = PRIORITY_ANSWER, label: str = "completion", **kwargs):
+        """Abre una completion en streaming (sin hedging); retorna un iterador asíncrono de chunks."""
+        stats = self._stats_for(label)
+        tokens = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+        probe = self.breaker.is_probe()
+        if not self.breaker.allow():
+            if not self.fallback_model:
+                raise LLMUnavailable("Circuito de OpenAI abierto")
+            stats.fallbacks += 1
+            kwargs = dict(kwargs, model=self.fallback_model)
+
+        kwargs = dict(kwargs, stream=True, stream_options={"include_usage": True})
+        try:
+            await self._admit(priority, tokens)
+            start = time.monotonic()
+            stats.calls += 1
+            try:
+                stream = await self._attempt(kwargs)
+            except RETRYABLE_ERRORS as e:
+                stats.errors += 1
+                self.breaker.record_failure()
+                raise LLMUnavailable(f"OpenAI no respondió: {e}") from e
+            except Exception as e:
+                stats.errors += 1
+                if isinstance(e, openai.APIStatusError):
+                    self.breaker.record_success()
+                raise
+        finally:
+            if probe:
+                self.breaker.release_probe()
+        self.breaker.record_success()
+        return self._metered_stream(stream, stats, start, tokens)
+
+    async def _metered_stream(self, stream, stats: CallStats, start: float, estimated: int):
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                self._record_usage(stats, chunk, estimated)
+            yield chunk
+        stats.latencies.append(time.monotonic() - start)
+
+    def snapshot(self) -> dict:
+        """Estado y métricas del governor."""
+        return {
+            "breaker": self.breaker.state,
+            "waiting": self.waiting,
+            "calls": {label: stats.to_dict() for label, stats in self.stats.items()},
+        }
+
+
+_governor = None
+
+
+def get_llm_governor() -> LLMGovernor:
+    """Retorna el governor del proceso."""
+    global _governor
+    if _governor is None:
+        _governor = LLMGovernor()
+    return _governor
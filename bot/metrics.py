@@ -0,0 +1,390 @@
+import os
+import re
+import glob
+import json
+import time
+import atexit
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext
+
+from config import Config
+from bot.sqlite_store import pid_alive
+
+try:
+    import fcntl
+except ImportError:  # Windows: los archivos de procesos terminados no se compactan
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (segundos) de los buckets de latencia
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "bot_stage_seconds": "Duración de cada etapa de handle_message",
+    "bot_messages_total": "Mensajes procesados por handle_message",
+    "bot_intents_total": "Intenciones detectadas",
+    "bot_intent_source_total": "Origen de la intención (clasificador local o LLM)",
+    "bot_cache_requests_total": "Consultas a las cachés por resultado",
+    "bot_errors_total": "Errores de handle_message por tipo",
+    "bot_telegram_request_seconds": "Duración de las peticiones a la Bot API (sin la espera del limitador)",
+    "bot_llm_calls_total": "Llamadas al governor de OpenAI",
+    "bot_llm_errors_total": "Llamadas al governor de OpenAI que fallaron",
+    "bot_llm_tokens_total": "Tokens consumidos en OpenAI",
+    "bot_llm_breaker_open": "1 si el circuit breaker de OpenAI no está cerrado",
+    "bot_llm_waiting": "Llamadas esperando presupuesto RPM/TPM",
+    "bot_scheduler_active": "Actualizaciones en ejecución",
+    "bot_scheduler_pending": "Actualizaciones en espera o en ejecución",
+    "bot_telegram_retries_total": "Reintentos tras un flood wait de Telegram",
+    "bot_telegram_flood_waits_total": "Respuestas RetryAfter de Telegram",
+    "bot_response_cache_size": "Entradas en la caché de respuestas en memoria",
+    "bot_update_queue_depth": "Actualizaciones pendientes en la cola del webhook",
+    "bot_hosted_bots": "Bots (Applications) construidos en el proceso",
+    "bot_polling_updates_total": "Actualizaciones repartidas por el fetcher de polling, por worker",
+    "bot_polling_worker_restarts_total": "Workers de polling reiniciados tras terminar inesperadamente",
+}
+
+
+# Volcado acumulado de los procesos ya terminados
+ARCHIVE_NAME = "archive.json"
+# Archivo de un proceso: "<pid>-<ms>.json" (o su temporal)
+_PROCESS_FILE_RE = re.compile(r"(\d+)-\d+\.json(\.tmp)?")
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+def _read_snapshot(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Span:
+    """Context manager que registra la duración del bloque en un histograma."""
+
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Metrics:
+    """Contadores e histogramas en memoria del proceso.
+
+    Cada proceso (worker WSGI, polling) vuelca periódicamente su estado a
+    un archivo propio en directory; /metrics suma los archivos de todos los
+    procesos, así que los valores son correctos con varios workers sin
+    coordinación en el camino caliente. Registrar una observación cuesta
+    un lock sin contención y un bisect. Los archivos de procesos terminados
+    se suman a archive.json y se borran (como el modo multiproceso del
+    cliente de Prometheus), así el directorio no crece con cada reinicio.
+    """
+
+    def __init__(self, directory: str = None, flush_interval: float = None, buckets: tuple = DEFAULT_BUCKETS):
+        self.directory = directory or Config.METRICS_DIR
+        self.flush_interval = Config.METRICS_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._path = None
+        self._flusher = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    # --- Registro ---
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._ensure_flusher()
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # [conteo por bucket..., +Inf] + suma
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[bisect_left(self.buckets, seconds)] += 1
+            histogram[-1] += seconds
+        self._ensure_flusher()
+
+    def span(self, stage: str, name: str = "bot_stage_seconds", **labels) -> "Span":
+        """Mide la duración del bloque with (también a través de awaits)."""
+        return Span(self, name, dict(labels, stage=stage))
+
+    def register_collector(self, collector):
+        """Agrega una función que retorna [(tipo, nombre, labels, valor)] al volcar.
+
+        tipo es "counter" o "gauge"; se usa para exponer contadores que ya
+        llevan otros componentes (governor, cachés, planificador).
+        """
+        self._collectors.append(collector)
+
+    # --- Volcado por proceso ---
+
+    def _ensure_flusher(self):
+        if self._path is not None:
+            return
+        # Primer uso en este proceso: archivo y hilo de volcado propios
+        with self._lock:
+            if self._path is not None:
+                return
+            pid = os.getpid()
+            self._path = os.path.join(self.directory, f"{pid}-{int(time.time() * 1000)}.json")
+            self._flusher = threading.Thread(target=self._flush_periodically, name="metrics-flush", daemon=True)
+            self._flusher.start()
+
+    def _reset_after_fork(self):
+        """En el hijo de un fork (workers preforked) se empieza de cero con otro archivo."""
+        self._lock = threading.Lock()
+        self._counters.clear()
+        self._histograms.clear()
+        self._path = None
+        self._flusher = None
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _collect(self) -> list:
+        samples = []
+        for collector in self._collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                logger.error(f"Error en un colector de métricas: {e}")
+        return samples
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = [[name, dict(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, dict(labels), list(values)] for (name, labels), values in self._histograms.items()]
+        gauges = []
+        for kind, name, labels, value in self._collect():
+            if kind == "counter":
+                counters.append([name, labels, value])
+            else:
+                gauges.append([name, labels, value])
+        return {
+            "pid": os.getpid(),
+            "buckets": list(self.buckets),
+            "counters": counters,
+            "histograms": histograms,
+            "gauges": gauges,
+        }
+
+    def flush(self):
+        """Escribe el estado del proceso en su archivo (reemplazo atómico)."""
+        if self._path is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self._path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, self._path)
+        except Exception as e:
+            logger.error(f"Error guardando las métricas: {e}")
+
+    def compact(self):
+        """Suma los archivos de procesos terminados a archive.json y los borra.
+
+        Corre bajo un flock para que dos procesos no sumen el mismo archivo.
+        El archivo acumulado anota qué archivos ya contiene: si el borrado se
+        interrumpe, no se vuelven a sumar y se borran en la siguiente pasada.
+        """
+        if fcntl is None:
+            return
+        archive_path = os.path.join(self.directory, ARCHIVE_NAME)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, "archive.lock"), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                archive = _read_snapshot(archive_path) or {}
+                merged = set(archive.get("merged", []))
+                dead, stale = [], []
+                for name in os.listdir(self.directory):
+                    match = _PROCESS_FILE_RE.fullmatch(name)
+                    if not match or name in merged or pid_alive(int(match[1])):
+                        continue
+                    snapshot = None if match[2] else _read_snapshot(os.path.join(self.directory, name))
+                    if snapshot is None:
+                        stale.append(name)
+                    else:
+                        dead.append((name, snapshot))
+                if dead:
+                    counters, histograms, _ = merge_snapshots([archive, *(snapshot for _, snapshot in dead)])
+                    leftovers = [name for name in merged if os.path.exists(os.path.join(self.directory, name))]
+                    archive = {
+                        "pid": None,
+                        "buckets": list(DEFAULT_BUCKETS),
+                        "counters": [[name, dict(labels), value] for (name, labels), value in counters.items()],
+                        "histograms": [[name, dict(labels), values] for (name, labels), values in histograms.items()],
+                        "gauges": [],
+                        "merged": leftovers + [name for name, _ in dead],
+                    }
+                    tmp_path = f"{archive_path}.tmp"
+                    with open(tmp_path, "w") as f:
+                        json.dump(archive, f)
+                    os.replace(tmp_path, archive_path)
+                for name in archive.get("merged", []) + stale:
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+        except Exception as e:
+            logger.error(f"Error compactando las métricas: {e}")
+
+    # --- Exposición ---
+
+    def render(self) -> str:
+        """Texto en formato Prometheus con lo acumulado por todos los procesos."""
+        self._ensure_flusher()
+        self.flush()
+        self.compact()
+        snapshots = {}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            snapshot = _read_snapshot(path)
+            if snapshot is not None:
+                snapshots[os.path.basename(path)] = snapshot
+        # Lo que ya está sumado en el archivo acumulado no se cuenta dos veces
+        for name in snapshots.get(ARCHIVE_NAME, {}).get("merged", []):
+            snapshots.pop(name, None)
+        return render_prometheus(list(snapshots.values()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in sorted(labels.items())) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def merge_snapshots(snapshots: list) -> tuple:
+    """Suma contadores e histogramas de varios volcados; retorna (counters, histograms, gauges).
+
+    Los histogramas con otros buckets se omiten. Los gauges solo se toman de
+    procesos vivos y se etiquetan con su pid.
+    """
+    counters, histograms, gauges = {}, {}, {}
+    buckets = DEFAULT_BUCKETS
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get("counters", []):
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        snapshot_buckets = tuple(snapshot.get("buckets", DEFAULT_BUCKETS))
+        if snapshot_buckets != buckets:
+            continue
+        for name, labels, values in snapshot.get("histograms", []):
+            key = _key(name, labels)
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = list(values)
+            else:
+                histograms[key] = [a + b for a, b in zip(merged, values)]
+        if snapshot.get("pid") and pid_alive(snapshot["pid"]):
+            for name, labels, value in snapshot.get("gauges", []):
+                gauges[_key(name, dict(labels, pid=snapshot["pid"]))] = value
+    return counters, histograms, gauges
+
+
+def render_prometheus(snapshots: list) -> str:
+    """Combina los volcados de varios procesos en el formato de texto de Prometheus.
+
+    Contadores e histogramas se suman (también los de procesos ya terminados,
+    para que no retrocedan); los gauges solo se toman de procesos vivos y se
+    etiquetan con su pid.
+    """
+    buckets = DEFAULT_BUCKETS
+    counters, histograms, gauges = merge_snapshots(snapshots)
+
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name in seen:
+            return
+        seen.add(name)
+        if name in HELP:
+            lines.append(f"# HELP {name} {HELP[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_format_labels(dict(labels))} {_format_value(value)}")
+
+    for (name, labels), values in sorted(histograms.items()):
+        header(name, "histogram")
+        labels = dict(labels)
+        cumulative = 0
+        for bound, count in zip(list(buckets) + ["+Inf"], values[:-1]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(dict(labels, le=bound))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(values[-1])}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, "gauge")
+        lines.append(f"{name}{_format_labels(dict(labels))} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+_metrics = None
+
+
+def get_metrics() -> Metrics:
+    """Retorna el registro de métricas del proceso."""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+        atexit.register(_metrics.flush)
+    return _metrics
+
+
+def span(stage: str, **labels):
+    """Atajo para medir una etapa de handle_message (no hace nada si las métricas están desactivadas)."""
+    if not Config.METRICS_ENABLED:
+        return nullcontext()
+    return get_metrics().span(stage, **labels)
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Atajo para incrementar un contador del proceso."""
+    if Config.METRICS_ENABLED:
+        get_metrics().inc(name, value, **labels)
+
+
+def observe(name: str, seconds: float, **labels):
+    """Atajo para registrar una duración en un histograma del proceso."""
+    if Config.METRICS_ENABLED:
+        get_metrics().observe(name, seconds, **labels)
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+
+import httpx
+from openai import AsyncOpenAI
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Cliente único por proceso (y por loop de eventos, ya que httpx se liga al loop)
+_client = None
+_client_loop = None
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    """Crea el cliente HTTP con pool de conexiones, keep-alive y timeouts."""
+    limits = httpx.Limits(
+        max_connections=Config.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=Config.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=Config.OPENAI_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(Config.OPENAI_TIMEOUT, connect=Config.OPENAI_CONNECT_TIMEOUT)
+    http2 = Config.OPENAI_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("Paquete 'h2' no disponible; el cliente de OpenAI usará HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """Retorna el cliente AsyncOpenAI compartido, creándolo en el primer uso."""
+    global _client, _client_loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    if _client is None or (loop is not None and _client_loop is not loop):
+        if _client is not None:
+            logger.info("Loop de eventos distinto detectado; se crea un nuevo cliente de OpenAI")
+        _client = AsyncOpenAI(
+            api_key=Config.OPENAI_API_KEY,
+            base_url=Config.OPENAI_BASE_URL or None,
+            # Los reintentos con backoff los hace el governor (LLM_MAX_RETRIES)
+            max_retries=0,
+            http_client=_build_http_client(),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def close_openai_client():
+    """Cierra el cliente compartido y libera sus conexiones."""
+    global _client, _client_loop
+    if _client is not None:
+        try:
+            await _client.close()
+        except Exception as e:
+            logger.error(f"Error cerrando el cliente de OpenAI: {e}")
+        _client = None
+        _client_loop = None
@@ -0,0 +1,148 @@
+import time
+import asyncio
+import logging
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import Config
+from bot import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Segundos de espera de un RetryAfter (int o timedelta según la versión de PTB)."""
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+class TokenBucket:
+    """Token bucket por reservas: cada acquire() reserva un turno y espera hasta él.
+
+    Las reservas se atienden en orden de llegada sin necesidad de locks.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Consume un token (aunque quede en negativo) y retorna cuánto esperar."""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    @property
+    def idle(self) -> bool:
+        """True si el bucket está lleno (se puede descartar sin perder información)."""
+        now = time.monotonic()
+        return self._tokens + (now - self._updated) * self.rate >= self.capacity
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """Limitador de salida para la Bot API (se registra con ApplicationBuilder.rate_limiter).
+
+    Aplica un token bucket global (~30 msg/s) y otro por chat (~1 msg/s, 20/min
+    en grupos), respeta retry_after pausando los envíos y reintentando, y limita
+    la cantidad de envíos en espera para aplicar backpressure a los handlers.
+    """
+
+    def __init__(self, global_rate: float = None, chat_rate: float = None, chat_burst: float = None,
+                 group_rate_per_minute: float = None, max_retries: int = None, max_pending: int = None):
+        self.global_rate = Config.TELEGRAM_GLOBAL_RATE if global_rate is None else global_rate
+        self.chat_rate = Config.TELEGRAM_CHAT_RATE if chat_rate is None else chat_rate
+        self.chat_burst = Config.TELEGRAM_CHAT_BURST if chat_burst is None else chat_burst
+        self.group_rate = (Config.TELEGRAM_GROUP_RATE_PER_MIN if group_rate_per_minute is None
+                           else group_rate_per_minute) / 60
+        self.max_retries = Config.TELEGRAM_MAX_RETRIES if max_retries is None else max_retries
+        self.max_pending = Config.TELEGRAM_MAX_PENDING_SENDS if max_pending is None else max_pending
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+        self._chats = {}
+        self._pending = None
+        self._paused_until = 0.0
+        self._last_prune = time.monotonic()
+        self.retries = 0
+        self.flood_waits = 0
+
+    async def initialize(self) -> None:
+        self._pending = asyncio.Semaphore(self.max_pending)
+
+    async def shutdown(self) -> None:
+        self._chats.clear()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            is_group = (isinstance(chat_id, int) and chat_id < 0) or isinstance(chat_id, str)
+            if is_group:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        now = time.monotonic()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for chat_id in [c for c, bucket in self._chats.items() if bucket.idle]:
+            del self._chats[chat_id]
+
+    async def _wait_flood(self):
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            # Llamadas sin chat (getMe, setWebhook, ...) no cuentan para los límites de envío
+            return await callback(*args, **kwargs)
+
+        if self._pending is None:
+            await self.initialize()
+        self._prune()
+
+        async with self._pending:
+            attempt = 0
+            while True:
+                await self._wait_flood()
+                await self._chat_bucket(chat_id).acquire()
+                await self._global.acquire()
+                start = time.perf_counter()
+                try:
+                    return await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    self.flood_waits += 1
+                    attempt += 1
+                    delay = retry_after_seconds(e)
+                    if attempt > self.max_retries:
+                        logger.error(f"{endpoint} para {chat_id}: flood wait persistente ({delay}s), se desiste")
+                        raise
+                    logger.warning(f"Flood wait de Telegram en {endpoint}: reintento en {delay}s")
+                    self.retries += 1
+                    # Pausa todos los envíos: Telegram aplica el límite al bot completo
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                finally:
+                    metrics.observe("bot_telegram_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+
+    def stats(self) -> dict:
+        """Contadores del limitador."""
+        return {
+            "retries": self.retries,
+            "flood_waits": self.flood_waits,
+            "tracked_chats": len(self._chats),
+        }
@@ -0,0 +1,229 @@
+import re
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from config import Config
+from bot.intent_classifier import normalize_text
+from bot.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_message(text: str) -> str:
+    """Normaliza el mensaje para usarlo como clave (sin acentos, signos ni mayúsculas)."""
+    return " ".join(_PUNCTUATION.sub(" ", normalize_text(text)).split())
+
+
+def token_set(normalized: str) -> frozenset:
+    """Conjunto de palabras significativas para la comparación aproximada."""
+    return frozenset(word for word in normalized.split() if len(word) > 2)
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class SQLiteResponseStore(SQLiteStore):
+    """Segundo nivel de la caché, compartido entre los workers WSGI."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS response_cache (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ix_response_cache_expires ON response_cache (expires_at);
+    """
+
+    def __init__(self, path: str, max_rows: int):
+        super().__init__(path)
+        self.max_rows = max_rows
+        self._writes = 0
+
+    def get(self, key: str):
+        row = self.execute(
+            "SELECT response, expires_at FROM response_cache WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        return row
+
+    def set(self, key: str, response: str, expires_at: float):
+        self.execute(
+            "INSERT OR REPLACE INTO response_cache (key, response, expires_at) VALUES (?, ?, ?)",
+            (key, response, expires_at)
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def prune(self):
+        """Elimina entradas vencidas y recorta la tabla a max_rows."""
+        self.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+        self.execute(
+            """DELETE FROM response_cache WHERE key IN (
+                SELECT key FROM response_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_rows,)
+        )
+
+
+class ResponseCache:
+    """Caché de respuestas con LRU en memoria, TTL y nivel SQLite opcional.
+
+    La clave combina el mensaje normalizado, la intención y la versión de la
+    configuración, por lo que cualquier cambio en /config la invalida.
+    """
+
+    def __init__(self, max_size: int = 512, ttl: float = 3600, sqlite_path: str = None,
+                 similarity: float = 0.0, near_scan: int = 256):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.near_scan = near_scan
+        self.store = SQLiteResponseStore(sqlite_path, max_size * 10) if sqlite_path else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.near_hits = 0
+        self.sqlite_hits = 0
+
+    @staticmethod
+    def make_key(normalized: str, intent: str, version: int) -> str:
+        return f"{version}|{intent}|{normalized}"
+
+    def _get_memory(self, key: str, normalized: str, intent: str, version: int):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return entry[1], False
+                del self._entries[key]
+
+            if self.similarity <= 0:
+                return None, False
+
+            # Coincidencia aproximada: entradas recientes de la misma intención y versión
+            tokens = token_set(normalized)
+            prefix = self.make_key("", intent, version)
+            best, best_score = None, self.similarity
+            for scanned, (entry_key, entry) in enumerate(reversed(self._entries.items())):
+                if scanned >= self.near_scan:
+                    break
+                if entry[0] <= now or not entry_key.startswith(prefix):
+                    continue
+                score = jaccard(tokens, entry[2])
+                if score >= best_score:
+                    best, best_score = entry_key, score
+            if best is not None:
+                self._entries.move_to_end(best)
+                return self._entries[best][1], True
+        return None, False
+
+    def _set_memory(self, key: str, normalized: str, response: str, expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, response, token_set(normalized))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, message: str, intent: str, version: int):
+        """Retorna la respuesta cacheada o None."""
+        normalized = normalize_message(message)
+        key = self.make_key(normalized, intent, version)
+        response, near = self._get_memory(key, normalized, intent, version)
+        if response is None and self.store is not None:
+            response = self._get_sqlite(key, normalized)
+        self._count(response, near)
+        return response
+
+    async def aget(self, message: str, intent: str, version: int):
+        """Como get(), pero consulta el nivel SQLite fuera del loop de eventos."""
+        normalized = normalize_message(message)
+        key = self.make_key(normalized, intent, version)
+        response, near = self._get_memory(key, normalized, intent, version)
+        if response is None and self.store is not None:
+            response = await asyncio.to_thread(self._get_sqlite, key, normalized)
+        self._count(response, near)
+        return response
+
+    def _get_sqlite(self, key: str, normalized: str):
+        try:
+            row = self.store.get(hashlib.sha1(key.encode("utf-8")).hexdigest())
+        except Exception as e:
+            logger.error(f"Error leyendo la caché de respuestas: {e}")
+            return None
+        if row is None:
+            return None
+        self.sqlite_hits += 1
+        self._set_memory(key, normalized, row[0], row[1])
+        return row[0]
+
+    def _count(self, response, near: bool):
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.near_hits += near
+
+    def set(self, message: str, intent: str, version: int, response: str):
+        """Guarda una respuesta en memoria y, si está activo, en SQLite."""
+        normalized = normalize_message(message)
+        key = self.make_key(normalized, intent, version)
+        expires_at = time.time() + self.ttl
+        self._set_memory(key, normalized, response, expires_at)
+        if self.store is not None:
+            self._set_sqlite(key, response, expires_at)
+
+    async def aset(self, message: str, intent: str, version: int, response: str):
+        """Como set(), pero escribe en SQLite fuera del loop de eventos."""
+        normalized = normalize_message(message)
+        key = self.make_key(normalized, intent, version)
+        expires_at = time.time() + self.ttl
+        self._set_memory(key, normalized, response, expires_at)
+        if self.store is not None:
+            await asyncio.to_thread(self._set_sqlite, key, response, expires_at)
+
+    def _set_sqlite(self, key: str, response: str, expires_at: float):
+        try:
+            self.store.set(hashlib.sha1(key.encode("utf-8")).hexdigest(), response, expires_at)
+        except Exception as e:
+            logger.error(f"Error escribiendo la caché de respuestas: {e}")
+
+    def stats(self) -> dict:
+        """Contadores de aciertos y fallos."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "near_hits": self.near_hits,
+            "sqlite_hits": self.sqlite_hits,
+            "size": len(self._entries),
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+_response_cache = None
+
+
+def get_response_cache():
+    """Retorna la caché de respuestas del proceso (None si está desactivada)."""
+    global _response_cache
+    if _response_cache is None and Config.RESPONSE_CACHE_ENABLED:
+        _response_cache = ResponseCache(
+            max_size=Config.RESPONSE_CACHE_SIZE,
+            ttl=Config.RESPONSE_CACHE_TTL,
+            sqlite_path=Config.RESPONSE_CACHE_DB or None,
+            similarity=Config.RESPONSE_CACHE_SIMILARITY,
+        )
+    return _response_cache
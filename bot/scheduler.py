@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class ChatUpdateScheduler(BaseUpdateProcessor):
+    """Procesa en orden las actualizaciones de un mismo chat y en paralelo las de chats distintos.
+
+    max_concurrent_chats limita cuántas actualizaciones se ejecutan a la vez;
+    max_pending (el semáforo de BaseUpdateProcessor) limita cuántas pueden
+    estar en espera en total. La espera por el turno del chat no ocupa un
+    cupo de ejecución, así que un chat con ráfagas no bloquea al resto.
+    """
+
+    def __init__(self, max_concurrent_chats: int, max_pending: int = 1024):
+        super().__init__(max(max_pending, max_concurrent_chats))
+        self.max_concurrent_chats = max_concurrent_chats
+        self._running = asyncio.BoundedSemaphore(max_concurrent_chats)
+        self._chat_locks = {}
+        self._depths = {}
+        self.active = 0
+
+    @staticmethod
+    def chat_key(update: object):
+        """chat_id de la actualización (None si no pertenece a un chat)."""
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        chat_id = self.chat_key(update)
+        if chat_id is None:
+            async with self._running:
+                await self._run(coroutine)
+            return
+
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = self._chat_locks[chat_id] = asyncio.Lock()
+        self._depths[chat_id] = self._depths.get(chat_id, 0) + 1
+        try:
+            # asyncio.Lock es FIFO: se respeta el orden de llegada dentro del chat
+            async with lock:
+                async with self._running:
+                    await self._run(coroutine)
+        finally:
+            self._depths[chat_id] -= 1
+            if not self._depths[chat_id]:
+                del self._depths[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def _run(self, coroutine):
+        self.active += 1
+        try:
+            await coroutine
+        finally:
+            self.active -= 1
+
+    def queue_depths(self) -> dict:
+        """Actualizaciones pendientes (en espera + en ejecución) por chat_id."""
+        return dict(self._depths)
+
+    def stats(self) -> dict:
+        """Resumen del estado del planificador."""
+        return {
+            "active": self.active,
+            "pending": sum(self._depths.values()),
+            "chats": len(self._depths),
+            "max_depth": max(self._depths.values(), default=0),
+            "max_concurrent_chats": self.max_concurrent_chats,
+        }
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+async def dispatch_update(application, update: Update):
+    """Procesa una actualización pasando por el update processor de la Application.
+
+    Application.process_update por sí solo no usa el planificador; el webhook
+    debe entrar por aquí para respetar el orden por chat.
+    """
+    await application.update_processor.process_update(update, application.process_update(update))
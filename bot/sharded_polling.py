@@ -0,0 +1,226 @@
+import os
+import queue
+import signal
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import wait
+
+from config import Config
+from bot import metrics
+from bot.update_queue import update_chat_id
+
+logger = logging.getLogger(__name__)
+
+# Límites que Telegram y OpenAI aplican por token/cuenta: cada worker recibe una parte
+_SCALED_LIMITS = ("TELEGRAM_GLOBAL_RATE", "OPENAI_RPM", "OPENAI_TPM")
+
+
+def shard_for(update: dict, shards: int) -> int:
+    """Worker al que va la actualización: siempre el mismo para un chat."""
+    return update_chat_id(update) % shards
+
+
+class TelegramAPIError(Exception):
+    """Respuesta con ok=false de la Bot API."""
+
+    def __init__(self, description: str, retry_after: float = None):
+        super().__init__(description)
+        self.retry_after = retry_after
+
+
+class ShardedPoller:
+    """Un fetcher de getUpdates que reparte las actualizaciones entre N procesos worker.
+
+    Telegram admite un solo consumidor de getUpdates por token, así que este
+    proceso solo hace long polling (httpx, sin Application ni OpenAI) y pasa
+    cada actualización cruda a la cola del worker que le toca según su
+    chat_id: el orden dentro de un chat y su historial en memoria quedan en
+    un solo proceso. La configuración, las cachés de respuestas, imágenes y
+    file_id y las métricas se comparten entre procesos a través de SQLite y
+    archivos (la de respuestas, en RESPONSE_CACHE_DB si no se indicó otra
+    base). Al recibir SIGINT/SIGTERM deja de pedir actualizaciones,
+    confirma el offset y espera a que los workers vacíen sus colas.
+    """
+
+    def __init__(self, workers: int, token: str = None, base_url: str = None, poll_timeout: int = None,
+                 queue_size: int = None, drain_timeout: float = None):
+        self.workers = workers
+        self.token = token or Config.TELEGRAM_BOT_TOKEN
+        self.base_url = base_url or Config.TELEGRAM_API_BASE_URL
+        self.poll_timeout = Config.POLLING_TIMEOUT if poll_timeout is None else poll_timeout
+        self.queue_size = Config.POLLING_WORKER_QUEUE if queue_size is None else queue_size
+        self.drain_timeout = Config.POLLING_DRAIN_TIMEOUT if drain_timeout is None else drain_timeout
+        # spawn: los workers no heredan los hilos del fetcher y cierran con atexit al terminar
+        self._context = multiprocessing.get_context("spawn")
+        self._shards = [None] * workers
+
+    def run(self):
+        """Arranca los workers, hace polling hasta recibir una señal y los drena."""
+        for name in _SCALED_LIMITS:
+            os.environ[name] = str(getattr(Config, name) / self.workers)
+        # Cada chat va siempre al mismo worker: su historial en memoria no necesita revalidarse
+        os.environ.setdefault("HISTORY_RELOAD_AFTER", "0")
+        # Sin base propia la caché de respuestas sería privada de cada worker
+        if not Config.RESPONSE_CACHE_DB:
+            os.environ["RESPONSE_CACHE_DB"] = os.path.join(os.path.dirname(Config.IMAGE_CACHE_DB), "response_cache.db")
+        for index in range(self.workers):
+            self._start_worker(index)
+        try:
+            asyncio.run(self._poll())
+        finally:
+            self._drain()
+
+    def _start_worker(self, index: int):
+        updates = self._context.Queue(self.queue_size)
+        process = self._context.Process(
+            target=worker_main, args=(index, updates, os.getpid()), name=f"bot-worker-{index}"
+        )
+        process.start()
+        self._shards[index] = (process, updates)
+        logger.info(f"Worker {index} iniciado (pid {process.pid})")
+
+    def _check_workers(self):
+        """Reinicia los workers que terminaron inesperadamente (lo que tenían en cola se pierde)."""
+        for index, (process, updates) in enumerate(self._shards):
+            if process.exitcode is not None:
+                logger.error(f"Worker {index} terminó con código {process.exitcode}; reiniciándolo")
+                metrics.inc("bot_polling_worker_restarts_total")
+                updates.close()
+                self._start_worker(index)
+
+    async def _call(self, client, method: str, **params):
+        response = await client.post(f"{self.base_url}{self.token}/{method}", json=params)
+        data = response.json()
+        if not data.get("ok"):
+            raise TelegramAPIError(
+                data.get("description", f"HTTP {response.status_code}"),
+                (data.get("parameters") or {}).get("retry_after")
+            )
+        return data["result"]
+
+    async def _poll(self):
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+
+        offset, failures = None, 0
+        timeout = httpx.Timeout(self.poll_timeout + 10, connect=10)
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            # getUpdates falla mientras haya un webhook registrado
+            await self._call(client, "deleteWebhook")
+            logger.info(f"🤖 Fetcher de polling iniciado con {self.workers} workers")
+            stopping = asyncio.ensure_future(stop.wait())
+            try:
+                while not stop.is_set():
+                    self._check_workers()
+                    fetch = asyncio.ensure_future(self._call(client, "getUpdates", offset=offset, timeout=self.poll_timeout))
+                    await asyncio.wait({fetch, stopping}, return_when=asyncio.FIRST_COMPLETED)
+                    if not fetch.done():
+                        # Lo que traía esta petición no se confirmó: Telegram lo volverá a entregar
+                        fetch.cancel()
+                        break
+                    try:
+                        updates = fetch.result()
+                        failures = 0
+                    except Exception as e:
+                        failures += 1
+                        delay = getattr(e, "retry_after", None) or min(2 ** failures, 30)
+                        logger.error(f"Error en getUpdates: {e}; reintento en {delay}s")
+                        await asyncio.wait({stopping}, timeout=delay)
+                        continue
+                    for update in updates:
+                        await self._dispatch(update)
+                        offset = update["update_id"] + 1
+            finally:
+                stopping.cancel()
+
+            if offset is not None:
+                # Confirma lo ya repartido para que no se entregue de nuevo al reiniciar
+                try:
+                    await self._call(client, "getUpdates", offset=offset, timeout=0, limit=1)
+                except Exception as e:
+                    logger.error(f"No se pudo confirmar el offset {offset}: {e}")
+
+    async def _dispatch(self, update: dict):
+        index = shard_for(update, self.workers)
+        metrics.inc("bot_polling_updates_total", shard=str(index))
+        while True:
+            process, updates = self._shards[index]
+            try:
+                updates.put_nowait(update)
+                return
+            except queue.Full:
+                pass
+            # Cola llena: el fetcher espera al worker (backpressure hacia Telegram)
+            try:
+                await asyncio.to_thread(updates.put, update, True, 1)
+                return
+            except queue.Full:
+                self._check_workers()
+
+    def _drain(self):
+        """Pide a cada worker que termine lo pendiente y espera hasta drain_timeout."""
+        for index, (process, updates) in enumerate(self._shards):
+            if process.is_alive():
+                try:
+                    updates.put(None, timeout=self.drain_timeout)
+                except queue.Full:
+                    logger.error(f"Worker {index} no acepta más actualizaciones")
+        for index, (process, updates) in enumerate(self._shards):
+            process.join(self.drain_timeout)
+            if process.is_alive():
+                logger.error(f"Worker {index} no terminó en {self.drain_timeout}s; se detiene a la fuerza")
+                process.terminate()
+                process.join()
+        logger.info("Workers detenidos")
+
+
+def worker_main(index: int, updates, parent_pid: int):
+    """Proceso worker: procesa las actualizaciones de su cola en el loop del bot."""
+    # El fetcher coordina el cierre: un Ctrl+C llega a todo el grupo de procesos
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    from app import bot_loop, bot_registry, _process_update
+
+    bot_loop.run(bot_registry.initialize())
+    logger.info(f"Worker {index} listo")
+    # Mismo tope de actualizaciones en espera que el planificador por chat
+    slots = threading.BoundedSemaphore(Config.MAX_PENDING_UPDATES)
+    in_flight = set()
+    lock = threading.Lock()
+
+    def _done(future):
+        with lock:
+            in_flight.discard(future)
+        slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Worker {index}: error procesando una actualización: {future.exception()}")
+
+    while True:
+        try:
+            update = updates.get(timeout=1)
+        except queue.Empty:
+            if os.getppid() != parent_pid:
+                logger.error(f"Worker {index}: el fetcher ya no existe; drenando")
+                break
+            continue
+        if update is None:
+            break
+        slots.acquire()
+        # Se envían en orden de llegada: el planificador respeta ese orden dentro de cada chat
+        future = bot_loop.submit(_process_update(update))
+        with lock:
+            in_flight.add(future)
+        future.add_done_callback(_done)
+
+    with lock:
+        pending = list(in_flight)
+    logger.info(f"Worker {index}: drenando {len(pending)} actualizaciones en curso")
+    wait(pending)
+    # El cierre del bot (historial pendiente, clientes HTTP) corre en el atexit de app.py
@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import threading
+
+
+def pid_alive(pid: int) -> bool:
+    """True si existe un proceso con ese pid en esta máquina."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Abre una conexión SQLite en modo WAL, apta para varios procesos."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class SQLiteStore:
+    """Base para los almacenes auxiliares en SQLite (una conexión por hilo)."""
+
+    SCHEMA = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+            if not self._schema_ready:
+                with self._schema_lock:
+                    if not self._schema_ready:
+                        conn.executescript(self.SCHEMA)
+                        self.upgrade_schema(conn)
+                        self._schema_ready = True
+        return conn
+
+    def upgrade_schema(self, conn: sqlite3.Connection):
+        """Ajusta bases creadas con una versión anterior de SCHEMA (por defecto, nada)."""
+
+    def execute(self, sql: str, params=()):
+        return self.conn.execute(sql, params)
+
+    def close(self):
+        """Cierra la conexión del hilo actual."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
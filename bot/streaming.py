@@ -0,0 +1,113 @@
+import re
+import time
+import asyncio
+import logging
+
+from telegram.error import BadRequest, RetryAfter
+
+from bot.rate_limiter import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+IMAGE_TAG_RE = re.compile(r'\[\[IMAGE:.*?\]\]', re.IGNORECASE)
+_TAG_OPENING = "[[image:"
+_SENTENCE_END = re.compile(r'[.!?…:]\s|\n')
+
+
+def visible_text(buffer: str) -> str:
+    """Texto que se puede mostrar mientras llega la respuesta.
+
+    Quita los tags [[IMAGE: ...]] completos y oculta un tag abierto o un
+    posible inicio de tag al final (p. ej. "[[IMA") hasta que se complete.
+    """
+    text = IMAGE_TAG_RE.sub('', buffer)
+    lower = text.lower()
+    start = lower.rfind(_TAG_OPENING)
+    if start != -1:
+        return text[:start].rstrip()
+    for size in range(min(len(_TAG_OPENING) - 1, len(text)), 0, -1):
+        if _TAG_OPENING.startswith(lower[-size:]):
+            return text[:-size].rstrip()
+    return text.rstrip()
+
+
+class StreamingReply:
+    """Muestra una respuesta a medida que se genera, editando un único mensaje.
+
+    El primer mensaje se envía al completar la primera frase (o al llegar a
+    min_chars); luego se edita como mucho una vez cada edit_interval segundos
+    para respetar los límites de edición de Telegram.
+    """
+
+    def __init__(self, bot, chat_id, reply_markup=None, edit_interval: float = 1.0, min_chars: int = 80):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_markup = reply_markup
+        self.edit_interval = edit_interval
+        self.min_chars = min_chars
+        self.buffer = ""
+        self.message = None
+        self.shown = ""
+        self.started_at = time.monotonic()
+        self.first_visible_at = None
+        self._next_edit = 0.0
+
+    @property
+    def time_to_first_text(self):
+        """Segundos hasta que el usuario vio el primer texto (None si aún no)."""
+        if self.first_visible_at is None:
+            return None
+        return self.first_visible_at - self.started_at
+
+    async def feed(self, delta: str):
+        """Agrega un fragmento de la respuesta y actualiza el mensaje si corresponde."""
+        if not delta:
+            return
+        self.buffer += delta
+        text = visible_text(self.buffer)
+        if not text:
+            return
+
+        if self.message is None:
+            if len(text) >= self.min_chars or _SENTENCE_END.search(text):
+                await self._send(text)
+        elif time.monotonic() >= self._next_edit and text != self.shown:
+            await self._edit(text)
+
+    async def finish(self) -> str:
+        """Muestra el texto final y retorna la respuesta completa (con tags)."""
+        text = visible_text(self.buffer)
+        if text:
+            if self.message is None:
+                await self._send(text)
+            elif text != self.shown:
+                await self._edit(text, final=True)
+        return self.buffer
+
+    async def _send(self, text: str):
+        self.message = await self.bot.send_message(
+            chat_id=self.chat_id, text=text, reply_markup=self.reply_markup
+        )
+        self.shown = text
+        self.first_visible_at = time.monotonic()
+        self._next_edit = self.first_visible_at + self.edit_interval
+        logger.info(f"Primer texto visible en {self.time_to_first_text:.2f}s")
+
+    async def _edit(self, text: str, final: bool = False):
+        try:
+            await self.bot.edit_message_text(
+                chat_id=self.chat_id, message_id=self.message.message_id, text=text
+            )
+            self.shown = text
+        except RetryAfter as e:
+            # Límite de ediciones: se omite esta edición; la final se reintenta tras esperar
+            retry_after = retry_after_seconds(e)
+            self._next_edit = time.monotonic() + retry_after
+            if final:
+                await asyncio.sleep(retry_after)
+                await self._edit(text, final=True)
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self._next_edit = time.monotonic() + self.edit_interval
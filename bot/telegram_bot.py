@@ -1,36 +1,51 @@
 import os
 import logging
 import re
-from openai import OpenAI
+import json
+import time
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import Application, ContextTypes, MessageHandler, filters
-from icrawler.builtin import BingImageCrawler
-from icrawler import ImageDownloader
+from telegram.request import HTTPXRequest
 
 # Importar configuración
 import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import Config
-from models import db, BotConfig
+from models import db, BotConfig, FaqRule
+from bot.openai_client import close_openai_client
+from bot.llm_governor import get_llm_governor, LLMUnavailable, UsageTracker, PRIORITY_ANSWER, PRIORITY_INTENT
+from bot.intent_classifier import get_intent_classifier, log_labeled_message
+from bot.config_cache import ConfigCache, ConfigSnapshot
+from bot.faq_rules import FaqMatcher
+from bot.interaction_log import get_interaction_log
+from bot.response_cache import get_response_cache
+from bot.conversation_memory import get_conversation_memory, close_conversation_memory
+from bot.image_cache import ImageCache
+from bot.file_id_cache import FileIdCache
+from bot.streaming import StreamingReply
+from bot.scheduler import ChatUpdateScheduler
+from bot.rate_limiter import TelegramRateLimiter
+from bot import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# El cliente se inicializará dentro de las funciones para asegurar que use la Config actualizada
-def get_openai_client():
-    return OpenAI(api_key=Config.OPENAI_API_KEY)
+# Límite de Telegram para el caption de una foto
+CAPTION_LIMIT = 1024
 
+VALID_INTENTS = ['compra', 'cotizacion', 'inventario', 'consulta']
 
-class UrlDownloader(ImageDownloader):
-    """Custom downloader to just capture the URL instead of downloading."""
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.captured_url = None
-
-    def download(self, task, default_ext, timeout=5, max_retry=3, **kwargs):
-        self.captured_url = task['file_url']
-        # We don't return anything to stop the actual download
-        return
+# Contexto adicional por intención (en orden de prioridad) y palabra clave que lo fuerza
+INTENT_CONTEXTS = [
+    ("compra", "compra", "El usuario tiene intención de COMPRA. Proporciona opciones de compra relacionadas con {topic}."),
+    ("cotizacion", "cotiza", "El usuario pide una COTIZACIÓN. Ofrece estimaciones o solicita detalles para cotizar servicios de {topic}."),
+    ("inventario", "inventario", "El usuario consulta el INVENTARIO. Informa sobre la disponibilidad de productos o stock de {topic}."),
+]
 
 
 def build_system_prompt(config: BotConfig) -> str:
@@ -68,36 +83,234 @@ Responde con autoridad sobre {config.topic}. Sé experto pero entretenido."""
     return prompt
 
 
+# Pool acotado para los crawls de icrawler (bloqueantes y con hilos propios). Un crawl que agota
+# el tiempo no se puede interrumpir y sigue ocupando su hilo: el pool reserva hilos para esos
+# crawls abandonados y IMAGE_SEARCH_WORKERS limita solo los crawls que alguien espera
+_image_executor = ThreadPoolExecutor(
+    max_workers=Config.IMAGE_SEARCH_WORKERS + Config.IMAGE_SEARCH_MAX_ABANDONED,
+    thread_name_prefix="image-search"
+)
+_image_search_slots = weakref.WeakKeyDictionary()
+_abandoned_crawls = 0
+_abandoned_lock = threading.Lock()
+_image_cache = None
+_file_id_cache = None
+# Búsquedas en curso, para que consultas idénticas simultáneas compartan el crawl
+_image_searches_in_flight = {}
+
+
+def get_image_cache() -> ImageCache:
+    """Retorna la caché persistente de imágenes del proceso."""
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = ImageCache()
+        try:
+            _image_cache.prune()
+        except Exception as e:
+            logger.error(f"Error limpiando la caché de imágenes: {e}")
+    return _image_cache
+
+
+def get_file_id_cache() -> FileIdCache:
+    """Retorna la caché persistente de file_id del proceso."""
+    global _file_id_cache
+    if _file_id_cache is None:
+        _file_id_cache = FileIdCache()
+    return _file_id_cache
+
+
+def _crawl_image(query: str) -> str:
+    """Busca una imagen en Bing usando icrawler y retorna el URL (bloqueante)."""
+    from bot.bing_crawler import crawl_image_url
+
+    # Usar ruta absoluta para el directorio temporal
+    tmp_dir = os.path.join(Config.BASE_DIR if hasattr(Config, 'BASE_DIR') else os.getcwd(), 'tmp_icrawler')
+    return crawl_image_url(query, tmp_dir)
+
+
+def _search_slots() -> asyncio.Semaphore:
+    """Semáforo de crawls esperados del loop actual."""
+    loop = asyncio.get_running_loop()
+    slots = _image_search_slots.get(loop)
+    if slots is None:
+        slots = _image_search_slots[loop] = asyncio.Semaphore(Config.IMAGE_SEARCH_WORKERS)
+    return slots
+
+
+def _abandon_crawl(future):
+    """Cuenta un crawl que agotó el tiempo hasta que su hilo termine."""
+    global _abandoned_crawls
+    with _abandoned_lock:
+        _abandoned_crawls += 1
+    future.add_done_callback(_abandoned_crawl_finished)
+
+
+def _abandoned_crawl_finished(future):
+    global _abandoned_crawls
+    with _abandoned_lock:
+        _abandoned_crawls -= 1
+
+
+async def _crawl_in_pool(query: str) -> str:
+    async with _search_slots():
+        future = _image_executor.submit(_crawl_image, query)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if not future.cancel():
+                _abandon_crawl(future)
+            raise
+
+
+async def _search_image_uncached(query: str) -> tuple:
+    """Retorna (url, cacheable); un tiempo agotado es transitorio y no se cachea."""
+    if _abandoned_crawls >= Config.IMAGE_SEARCH_MAX_ABANDONED:
+        # Todos los hilos de reserva siguen ocupados: no se encola detrás de ellos
+        logger.error(f"Búsqueda de imagen omitida, {_abandoned_crawls} crawls colgados: {query}")
+        return None, False
+    try:
+        url = await asyncio.wait_for(_crawl_in_pool(query), timeout=Config.IMAGE_SEARCH_TIMEOUT)
+        return url, True
+    except asyncio.TimeoutError:
+        logger.error(f"Búsqueda de imagen agotó el tiempo ({Config.IMAGE_SEARCH_TIMEOUT}s): {query}")
+        return None, False
+    except Exception as e:
+        logger.error(f"Error en búsqueda de imagen icrawler: {e}")
+        return None, True
+
+
 async def search_image(query: str) -> str:
-    """Busca una imagen en Bing usando icrawler y retorna el URL."""
+    """Busca una imagen en Bing sin bloquear el loop, usando la caché persistente."""
+    query = ImageCache.normalize(query)
+    cache = get_image_cache()
     try:
-        # Usar ruta absoluta para el directorio temporal
-        tmp_dir = os.path.join(Config.BASE_DIR if hasattr(Config, 'BASE_DIR') else os.getcwd(), 'tmp_icrawler')
-        
-        if not os.path.exists(tmp_dir):
-            os.makedirs(tmp_dir)
-            
-        crawler = BingImageCrawler(
-            downloader_cls=UrlDownloader,
-            downloader_threads=1,
-            storage={'root_dir': tmp_dir},
-            log_level=logging.ERROR
-        )
-        crawler.crawl(keyword=query, max_num=1)
-        
-        # Access the captured URL from the downloader instance
-        url = crawler.downloader.captured_url
+        found, url = await asyncio.to_thread(cache.get, query)
+        metrics.inc("bot_cache_requests_total", cache="image", result="hit" if found else "miss")
+        if found:
+            return url
+    except Exception as e:
+        logger.error(f"Error leyendo la caché de imágenes: {e}")
+
+    pending = _image_searches_in_flight.get(query)
+    if pending is not None:
+        url, _ = await asyncio.shield(pending)
         return url
+
+    task = asyncio.ensure_future(_search_image_uncached(query))
+    _image_searches_in_flight[query] = task
+    try:
+        url, cacheable = await asyncio.shield(task)
+    finally:
+        _image_searches_in_flight.pop(query, None)
+
+    if cacheable:
+        try:
+            # También se cachean los fallos (TTL negativo) para no repetir el crawl
+            await asyncio.to_thread(cache.set, query, url)
+        except Exception as e:
+            logger.error(f"Error escribiendo la caché de imágenes: {e}")
+    return url
+
+
+async def _send_photo_by_file_id(bot, chat_id, file_id: str, reply_markup, caption: str = None) -> bool:
+    """Intenta enviar una foto ya subida; invalida el file_id si Telegram lo rechaza."""
+    try:
+        await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, reply_markup=reply_markup)
+        return True
+    except BadRequest as e:
+        logger.warning(f"file_id rechazado por Telegram, se invalida: {e}")
+        try:
+            await asyncio.to_thread(get_file_id_cache().invalidate, file_id)
+        except Exception as inner_e:
+            logger.error(f"Error invalidando file_id: {inner_e}")
+        return False
+
+
+async def _cached_file_id(key: str):
+    try:
+        return await asyncio.to_thread(get_file_id_cache().get, key)
     except Exception as e:
-        logger.error(f"Error en búsqueda de imagen icrawler: {e}")
+        logger.error(f"Error leyendo la caché de file_id: {e}")
+        return None
+
+
+async def _send_text_with_notice(bot, chat_id, caption: str, notice: str, reply_markup):
+    """Envía el aviso de fallo, junto al texto que iba como caption (si lo había)."""
+    text = f"{caption}\n\n{notice}" if caption else notice
+    await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+
+
+async def send_image(bot, chat_id, search_query: str, reply_markup, caption: str = None):
+    """Envía la imagen de una búsqueda, reutilizando el file_id de envíos anteriores.
+
+    Si se indica caption, el texto de la respuesta viaja en el mismo mensaje que la foto.
+    """
+    scope = FileIdCache.bot_scope(bot)
+    query_key = FileIdCache.query_key(search_query, scope)
+    file_id = await _cached_file_id(query_key)
+    metrics.inc("bot_cache_requests_total", cache="file_id", result="hit" if file_id else "miss")
+    if file_id and await _send_photo_by_file_id(bot, chat_id, file_id, reply_markup, caption):
+        return
+
+    with metrics.span("image_search"):
+        image_url = await search_image(search_query)
+    if not image_url:
+        await _send_text_with_notice(bot, chat_id, caption, "No encontré una foto de eso. 🍔", reply_markup)
+        return
+
+    url_key = FileIdCache.url_key(image_url, scope)
+    file_id = await _cached_file_id(url_key)
+    if file_id and await _send_photo_by_file_id(bot, chat_id, file_id, reply_markup, caption):
+        try:
+            await asyncio.to_thread(get_file_id_cache().set, file_id, query_key)
+        except Exception as e:
+            logger.error(f"Error guardando file_id: {e}")
+        return
+
+    try:
+        message = await bot.send_photo(chat_id=chat_id, photo=image_url, caption=caption, reply_markup=reply_markup)
+    except RetryAfter:
+        raise
+    except Exception as e:
+        logger.error(f"Error enviando foto: {e}")
+        await _send_text_with_notice(bot, chat_id, caption, "No pude enviar la imagen en este momento. 🍔", reply_markup)
+        return
+
+    if message and message.photo:
+        try:
+            # La última resolución es la más grande
+            await asyncio.to_thread(get_file_id_cache().set, message.photo[-1].file_id, query_key, url_key)
+        except Exception as e:
+            logger.error(f"Error guardando file_id: {e}")
+
+
+def detect_intent_locally(user_message: str):
+    """Clasifica con el modelo local; retorna None si no hay modelo o la confianza es baja."""
+    classifier = get_intent_classifier()
+    if classifier is None:
+        return None
+    intent, confidence = classifier.predict(user_message)
+    if confidence >= Config.INTENT_CLASSIFIER_THRESHOLD and intent in VALID_INTENTS:
+        metrics.inc("bot_intent_source_total", source="local")
+        return intent
     return None
 
 
-async def detect_intent(user_message: str, config: BotConfig) -> str:
+async def detect_intent(user_message: str, config: ConfigSnapshot) -> str:
+    """Clasifica la intención del usuario (modelo local y, si no basta, OpenAI)."""
+    local_intent = detect_intent_locally(user_message)
+    if local_intent:
+        return local_intent
+    return await detect_intent_llm(user_message, config)
+
+
+async def detect_intent_llm(user_message: str, config: ConfigSnapshot) -> str:
     """Clasifica la intención del usuario usando OpenAI."""
+    metrics.inc("bot_intent_source_total", source="llm")
     try:
-        client = get_openai_client()
-        response = client.chat.completions.create(
+        response = await get_llm_governor().create(
+            priority=PRIORITY_INTENT,
+            label="intent",
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": f"Eres un clasificador de intenciones experto para un bot de {config.topic}. Clasifica el mensaje del usuario en UNA de estas categorías: 'compra', 'cotizacion', 'inventario', 'consulta'. Responde SOLO con la palabra de la categoría."},
@@ -108,17 +321,210 @@ async def detect_intent(user_message: str, config: BotConfig) -> str:
         )
         intent = response.choices[0].message.content.lower().strip()
         # Limpiar posibles respuestas ruidosas
-        for valid_intent in ['compra', 'cotizacion', 'inventario', 'consulta']:
+        for valid_intent in VALID_INTENTS:
             if valid_intent in intent:
+                log_labeled_message(user_message, valid_intent)
                 return valid_intent
+        log_labeled_message(user_message, "consulta")
         return "consulta"
     except Exception as e:
         logger.error(f"Error detectando intención: {e}")
         return "consulta"
 
 
+def get_intent_context(user_msg_lower: str, intent: str, config: ConfigSnapshot) -> str:
+    """Retorna el contexto específico de la intención (o cadena vacía para 'consulta')."""
+    for name, keyword, text in config.intent_contexts:
+        if keyword in user_msg_lower or intent == name:
+            return text
+    return ""
+
+
+def build_messages(system_prompt: str, user_message: str, history: list = None) -> list:
+    """Mensajes para OpenAI: prompt de sistema + historial del chat + mensaje actual."""
+    return [{"role": "system", "content": system_prompt}, *(history or []), {"role": "user", "content": user_message}]
+
+
+async def generate_response(user_message: str, system_prompt: str, history: list = None) -> str:
+    """Genera la respuesta principal con OpenAI."""
+    response = await get_llm_governor().create(
+        priority=PRIORITY_ANSWER,
+        label="answer",
+        model="gpt-3.5-turbo",
+        messages=build_messages(system_prompt, user_message, history),
+        max_tokens=400,
+        temperature=0.3
+    )
+    return response.choices[0].message.content
+
+
+async def generate_response_streaming(user_message: str, system_prompt: str, streamer: StreamingReply,
+                                      history: list = None) -> str:
+    """Genera la respuesta principal en streaming, mostrándola a medida que llega."""
+    stream = await get_llm_governor().stream(
+        priority=PRIORITY_ANSWER,
+        label="answer_stream",
+        model="gpt-3.5-turbo",
+        messages=build_messages(system_prompt, user_message, history),
+        max_tokens=400,
+        temperature=0.3
+    )
+    async for chunk in stream:
+        if chunk.choices:
+            await streamer.feed(chunk.choices[0].delta.content)
+    return await streamer.finish()
+
+
+# Herramienta forzada para obtener intención y respuesta en una sola llamada
+RESPOND_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "responder",
+        "description": "Entrega la intención del usuario y la respuesta final para enviarle.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "intent": {"type": "string", "enum": VALID_INTENTS},
+                "answer": {"type": "string"}
+            },
+            "required": ["intent", "answer"]
+        }
+    }
+}
+
+
+def build_single_call_prompt(config: ConfigSnapshot, user_msg_lower: str, intent: str = None) -> str:
+    """Prompt del modo de una sola llamada: incluye todos los contextos de intención."""
+    forced_context = get_intent_context(user_msg_lower, intent, config)
+    if forced_context:
+        return config.system_prompt + f"\n\nCONTEXTO ACTUAL: {forced_context}"
+    return config.single_call_prompt
+
+
+def _build_intent_instructions(config: ConfigSnapshot) -> str:
+    """Instrucciones de clasificación para el modo de una sola llamada."""
+    contexts = "\n".join(f"- {name}: {text}" for name, _, text in config.intent_contexts)
+    return f"""
+
+CLASIFICACIÓN: Antes de responder clasifica el mensaje en UNA de estas categorías: {', '.join(VALID_INTENTS)}.
+Aplica el contexto de la categoría elegida al redactar la respuesta:
+{contexts}
+- consulta: Responde la consulta general sobre {config.topic}.
+Entrega SIEMPRE el resultado usando la función 'responder'."""
+
+
+# Teclado de opciones
+KEYBOARD = [
+    ['🛒 Compra', '💰 Cotización'],
+    ['📦 Inventario', '❓ Consulta General']
+]
+
+
+async def send_faq_answer(bot, chat_id, rule: dict, reply_markup):
+    """Envía la respuesta fija de una regla de FAQ (con su imagen si la tiene)."""
+    answer = rule["answer"]
+    if not rule.get("image_query"):
+        await bot.send_message(chat_id=chat_id, text=answer, reply_markup=reply_markup)
+        return
+    caption = answer if len(answer) <= CAPTION_LIMIT else None
+    if caption is None:
+        await bot.send_message(chat_id=chat_id, text=answer, reply_markup=reply_markup)
+    await send_image(bot, chat_id, rule["image_query"], reply_markup, caption=caption)
+
+
+def build_config_snapshot(config: BotConfig, version: int, faq_rules: list = None) -> ConfigSnapshot:
+    """Crea el snapshot de la configuración con el prompt, teclado, textos y reglas precalculados."""
+    snapshot = ConfigSnapshot(config.to_dict(), version)
+    # Las reglas de FAQ se compilan una vez por versión de la configuración
+    snapshot.faq_matcher = FaqMatcher(faq_rules) if faq_rules else None
+    snapshot.system_prompt = build_system_prompt(snapshot)
+    snapshot.reply_markup = ReplyKeyboardMarkup(KEYBOARD, resize_keyboard=True, one_time_keyboard=False)
+    snapshot.greeting_text = f"{snapshot.greeting}\n\nSoy experto en {snapshot.topic}. ¿En qué puedo ayudarte hoy?"
+    snapshot.intent_contexts = [
+        (name, keyword, template.format(topic=snapshot.topic)) for name, keyword, template in INTENT_CONTEXTS
+    ]
+    snapshot.single_call_prompt = snapshot.system_prompt + _build_intent_instructions(snapshot)
+    return snapshot
+
+
+def _load_config_snapshot(app, version: int, bot_id: int = None):
+    """Consulta BotConfig y las reglas de FAQ en la base de datos (solo cuando cambia la versión).
+
+    bot_id None es el bot por defecto (el de TELEGRAM_BOT_TOKEN).
+    """
+    with app.app_context():
+        config = BotConfig.get_default() if bot_id is None else db.session.get(BotConfig, bot_id)
+        if not config:
+            return None
+        faq_rules = [rule.to_dict() for rule in FaqRule.query.filter_by(enabled=True, bot_id=config.id).all()]
+        return build_config_snapshot(config, version, faq_rules)
+
+
+# Snapshot de configuración por bot, compartido por el proceso (webhook o polling)
+config_caches = {}
+
+
+def get_config_snapshot(app, bot_id: int = None):
+    """Retorna la configuración vigente del bot sin tocar la base de datos en el camino caliente."""
+    cache = config_caches.get(bot_id)
+    if cache is None:
+        cache = config_caches.setdefault(
+            bot_id, ConfigCache(lambda app, version: _load_config_snapshot(app, version, bot_id))
+        )
+    return cache.get(app)
+
+
+async def generate_response_with_intent(user_message: str, config: ConfigSnapshot, local_intent: str = None,
+                                        history: list = None) -> tuple:
+    """Obtiene intención y respuesta en una única llamada a OpenAI (function calling).
+
+    Si el clasificador local está seguro (local_intent), se usa directamente su contexto.
+    """
+    user_msg_lower = user_message.lower().strip()
+    response = await get_llm_governor().create(
+        priority=PRIORITY_ANSWER,
+        label="answer_with_intent",
+        model="gpt-3.5-turbo",
+        messages=build_messages(build_single_call_prompt(config, user_msg_lower, local_intent), user_message, history),
+        tools=[RESPOND_TOOL],
+        tool_choice={"type": "function", "function": {"name": "responder"}},
+        max_tokens=420,
+        temperature=0.3
+    )
+    message = response.choices[0].message
+    intent, answer = local_intent or "consulta", message.content or ""
+    if message.tool_calls:
+        try:
+            arguments = json.loads(message.tool_calls[0].function.arguments)
+            answer = arguments.get("answer") or answer
+            if not local_intent:
+                if arguments.get("intent") in VALID_INTENTS:
+                    intent = arguments["intent"]
+                # La intención la eligió el LLM: sirve para reentrenar el clasificador local
+                log_labeled_message(user_message, intent)
+        except (ValueError, AttributeError) as e:
+            logger.error(f"Respuesta estructurada inválida: {e}")
+    return intent, answer
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja los mensajes recibidos por el bot."""
+    # Datos para el registro de interacciones; _handle_message completa ruta, intención y error
+    interaction = {}
+    start = time.perf_counter()
+    with metrics.span("total"), UsageTracker() as usage:
+        await _handle_message(update, context, interaction)
+    interaction_log = get_interaction_log()
+    if interaction_log and "route" in interaction:
+        interaction_log.record(
+            latency=time.perf_counter() - start,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            **interaction
+        )
+
+
+async def _handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE, interaction: dict):
     import traceback
     
     app = context.application.bot_data.get("flask_app")
@@ -137,91 +543,162 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
         chat_id = update.message.chat_id
         user_msg_lower = user_message.lower().strip()
+        metrics.inc("bot_messages_total")
 
-        # Obtener configuración
-        with app.app_context():
-            config = BotConfig.query.first()
-            if not config: return
-
-            # Teclado de opciones
-            keyboard = [
-                ['🛒 Compra', '💰 Cotización'],
-                ['📦 Inventario', '❓ Consulta General']
-            ]
-            reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
-
-            # 1. SALUDO INICIAL (Flexible para variaciones)
-            greeting_keywords = ["hola", "buen", "buenas", "buenos", "saludos", "que tal", "qué tal", "hi", "hello"]
-            is_start = user_message.startswith('/') or any(user_msg_lower.startswith(kw) for kw in greeting_keywords)
-            
-            if is_start:
-                await context.bot.send_message(
-                    chat_id=chat_id, 
-                    text=f"{config.greeting}\n\nSoy experto en {config.topic}. ¿En qué puedo ayudarte hoy?",
-                    reply_markup=reply_markup
-                )
-                return
+        # Obtener configuración (snapshot en memoria)
+        with metrics.span("config"):
+            config = get_config_snapshot(app, context.application.bot_data.get("bot_id"))
+        if not config: return
+        interaction.update(bot_id=config.id, chat_id=chat_id, message=user_message, route="llm", intent=None)
+
+        reply_markup = config.reply_markup
+
+        # 1. SALUDO INICIAL (Flexible para variaciones)
+        greeting_keywords = ["hola", "buen", "buenas", "buenos", "saludos", "que tal", "qué tal", "hi", "hello"]
+        is_start = user_message.startswith('/') or any(user_msg_lower.startswith(kw) for kw in greeting_keywords)
+        
+        if is_start:
+            metrics.inc("bot_intents_total", intent="saludo")
+            interaction.update(route="saludo", intent="saludo")
+            await context.bot.send_message(
+                chat_id=chat_id, 
+                text=config.greeting_text,
+                reply_markup=reply_markup
+            )
+            return
 
+        memory = get_conversation_memory(app)
+
+        # 1b. PREGUNTAS FRECUENTES (reglas de /config: respuesta fija sin pasar por OpenAI)
+        faq_rule = config.faq_matcher.match(user_message) if config.faq_matcher else None
+        if faq_rule:
+            metrics.inc("bot_intents_total", intent="faq")
+            interaction.update(route="faq", intent="faq")
+            with metrics.span("reply"):
+                await send_faq_answer(context.bot, chat_id, faq_rule, reply_markup)
+            if memory:
+                await memory.append(chat_id, user_message, faq_rule["answer"], bot_id=config.id)
+            return
+
+        with metrics.span("history"):
+            history = await memory.get_messages(chat_id, bot_id=config.id) if memory else []
+        # En un seguimiento la respuesta depende de lo último que se habló: no se usa la caché. Un mensaje que
+        # retoma un chat viejo sí la consulta, pero lo generado con historial no se guarda (podría citarlo)
+        follow_up = bool(history) and memory.is_follow_up(chat_id, bot_id=config.id)
+        response_cache = None if follow_up else get_response_cache()
+        store_response = response_cache is not None and not history
+        # Respuesta mostrada progresivamente (solo en el modo de dos llamadas)
+        streamer = None
+
+        if Config.INTENT_MODE == "single_call":
+            # 2-4. INTENCIÓN Y RESPUESTA EN UNA SOLA LLAMADA
+            # Sin clasificación previa la caché usa '*' como intención
+            local_intent = detect_intent_locally(user_message)
+            cache_intent = local_intent or "*"
+            intent, bot_response = local_intent or "consulta", None
+            if response_cache:
+                bot_response = await response_cache.aget(user_message, cache_intent, config.cache_version)
+                metrics.inc("bot_cache_requests_total", cache="response", result="miss" if bot_response is None else "hit")
+                if bot_response is not None:
+                    interaction["route"] = "cache"
+                    # Respuesta cacheada sin clasificar: la intención es desconocida
+                    intent = local_intent or "desconocida"
+            if bot_response is None:
+                if not local_intent:
+                    metrics.inc("bot_intent_source_total", source="single_call")
+                with metrics.span("completion"):
+                    intent, bot_response = await generate_response_with_intent(user_message, config, local_intent, history)
+                if store_response:
+                    await response_cache.aset(user_message, cache_intent, config.cache_version, bot_response)
+                logger.info(f"Intención detectada: {intent}")
+        else:
             # 2. DETECTAR INTENCIÓN
-            intent = await detect_intent(user_message, config)
+            with metrics.span("intent"):
+                intent = await detect_intent(user_message, config)
             logger.info(f"Intención detectada: {intent}")
 
-            # 3. PROCESAR SEGÚN INTENCIÓN (Flujos específicos)
-            intent_context = ""
-            if "compra" in user_msg_lower or intent == "compra":
-                intent_context = f"El usuario tiene intención de COMPRA. Proporciona opciones de compra relacionadas con {config.topic}."
-            elif "cotiza" in user_msg_lower or intent == "cotizacion":
-                intent_context = f"El usuario pide una COTIZACIÓN. Ofrece estimaciones o solicita detalles para cotizar servicios de {config.topic}."
-            elif "inventario" in user_msg_lower or intent == "inventario":
-                intent_context = f"El usuario consulta el INVENTARIO. Informa sobre la disponibilidad de productos o stock de {config.topic}."
-            
-            # 4. GENERAR RESPUESTA CON OPENAI
-            system_prompt = build_system_prompt(config)
-            if intent_context:
-                system_prompt += f"\n\nCONTEXTO ACTUAL: {intent_context}"
-            
-            client = get_openai_client()
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=400,
-                temperature=0.3
-            )
+            bot_response = None
+            if response_cache:
+                bot_response = await response_cache.aget(user_message, intent, config.cache_version)
+                metrics.inc("bot_cache_requests_total", cache="response", result="miss" if bot_response is None else "hit")
+                if bot_response is not None:
+                    interaction["route"] = "cache"
 
-            bot_response = response.choices[0].message.content
-            
-            # 5. DETECTAR INTENCIÓN DE IMAGEN
-            intent_pattern = r'\b(ver|foto|imagen|imágenes|fotos|muéstrame|muestrame|enséñame|ensename|pásame|pasame|show|image|picture|photo)\b'
-            has_intent = bool(re.search(intent_pattern, user_message.lower()))
-            
-            image_tag_match = re.search(r'\[\[IMAGE:\s*(.*?)\]\]', bot_response, re.IGNORECASE)
-            clean_response = re.sub(r'\[\[IMAGE:.*?\]\]', '', bot_response, flags=re.IGNORECASE).strip()
+            if bot_response is None:
+                # 3. PROCESAR SEGÚN INTENCIÓN (Flujos específicos)
+                intent_context = get_intent_context(user_msg_lower, intent, config)
+
+                # 4. GENERAR RESPUESTA CON OPENAI
+                system_prompt = config.system_prompt
+                if intent_context:
+                    system_prompt += f"\n\nCONTEXTO ACTUAL: {intent_context}"
+
+                with metrics.span("completion"):
+                    if Config.STREAM_REPLIES:
+                        streamer = StreamingReply(
+                            context.bot, chat_id, reply_markup,
+                            edit_interval=Config.STREAM_EDIT_INTERVAL,
+                            min_chars=Config.STREAM_MIN_CHARS
+                        )
+                        bot_response = await generate_response_streaming(user_message, system_prompt, streamer, history)
+                    else:
+                        bot_response = await generate_response(user_message, system_prompt, history)
+                if store_response:
+                    await response_cache.aset(user_message, intent, config.cache_version, bot_response)
+
+        metrics.inc("bot_intents_total", intent=intent)
+        interaction["intent"] = intent
 
+        # 5. DETECTAR INTENCIÓN DE IMAGEN
+        intent_pattern = r'\b(ver|foto|imagen|imágenes|fotos|muéstrame|muestrame|enséñame|ensename|pásame|pasame|show|image|picture|photo)\b'
+        has_intent = bool(re.search(intent_pattern, user_message.lower()))
+        
+        image_tag_match = re.search(r'\[\[IMAGE:\s*(.*?)\]\]', bot_response, re.IGNORECASE)
+        clean_response = re.sub(r'\[\[IMAGE:.*?\]\]', '', bot_response, flags=re.IGNORECASE).strip()
+        # En modo streaming el texto limpio ya se mostró al usuario
+        already_sent = streamer is not None and streamer.message is not None
+
+        # Envío de la respuesta (incluye la búsqueda de imagen si corresponde)
+        with metrics.span("reply"):
             if image_tag_match and has_intent:
                 search_query = image_tag_match.group(1)
-                if clean_response:
-                    await context.bot.send_message(chat_id=chat_id, text=clean_response, reply_markup=reply_markup)
-                
-                image_url = await search_image(search_query)
-                if image_url:
-                    try:
-                        await context.bot.send_photo(chat_id=chat_id, photo=image_url, reply_markup=reply_markup)
-                    except Exception as e:
-                        logger.error(f"Error enviando foto: {e}")
-                        await context.bot.send_message(chat_id=chat_id, text="No pude enviar la imagen en este momento. 🍔", reply_markup=reply_markup)
-                else:
-                    await context.bot.send_message(chat_id=chat_id, text="No encontré una foto de eso. 🍔", reply_markup=reply_markup)
-            else:
+                # Texto + foto en un solo envío (send_photo con caption) cuando el texto cabe
+                caption = None
+                if clean_response and not already_sent:
+                    if len(clean_response) <= CAPTION_LIMIT:
+                        caption = clean_response
+                    else:
+                        await context.bot.send_message(chat_id=chat_id, text=clean_response, reply_markup=reply_markup)
+
+                await send_image(context.bot, chat_id, search_query, reply_markup, caption=caption)
+            elif not already_sent:
                 # Enviar respuesta normal (limpia de tags)
                 text_to_send = clean_response if clean_response else bot_response
                 await context.bot.send_message(chat_id=chat_id, text=text_to_send, reply_markup=reply_markup)
 
+        # 6. GUARDAR EL INTERCAMBIO EN LA MEMORIA DEL CHAT
+        if memory:
+            await memory.append(chat_id, user_message, bot_response, bot_id=config.id)
+
+    except LLMUnavailable as e:
+        # OpenAI caído o saturado: respuesta fija en lugar del error técnico
+        logger.error(f"OpenAI no disponible: {e}")
+        metrics.inc("bot_errors_total", type="llm_unavailable")
+        interaction["error"] = "llm_unavailable"
+        try:
+            await context.bot.send_message(chat_id=update.message.chat_id, text=Config.LLM_CANNED_REPLY)
+        except Exception as inner_e:
+            logger.error(f"Error al enviar la respuesta de respaldo: {inner_e}")
+    except RetryAfter as e:
+        # Flood wait persistente: enviar un mensaje de error solo empeoraría el límite
+        logger.error(f"Límite de Telegram alcanzado, respuesta descartada: {e}")
+        metrics.inc("bot_errors_total", type="telegram_flood")
+        interaction["error"] = "telegram_flood"
     except Exception as e:
         logger.error(f"Error procesando mensaje: {e}")
         logger.error(traceback.format_exc())
+        metrics.inc("bot_errors_total", type=type(e).__name__)
+        interaction["error"] = type(e).__name__
         try:
             if update.message:
                 chat_id = update.message.chat_id
@@ -235,15 +712,129 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.error(f"Error al enviar mensaje de error: {inner_e}")
 
 
-def setup_bot(app=None):
-    """Configura y retorna la aplicación del bot."""
-    token = Config.TELEGRAM_BOT_TOKEN
+async def _post_shutdown(application: Application):
+    """Guarda el historial pendiente y libera el pool de conexiones de OpenAI al detener el bot."""
+    await close_conversation_memory()
+    await close_openai_client()
+    await close_shared_requests()
+
+
+def _collect_bot_metrics() -> list:
+    """Expone en /metrics los contadores que ya llevan el governor, el planificador y los limitadores."""
+    governor = get_llm_governor()
+    samples = []
+    for label, stats in list(governor.stats.items()):
+        samples += [
+            ("counter", "bot_llm_calls_total", {"label": label}, stats.calls),
+            ("counter", "bot_llm_errors_total", {"label": label}, stats.errors),
+            ("counter", "bot_llm_tokens_total", {"label": label, "kind": "prompt"}, stats.prompt_tokens),
+            ("counter", "bot_llm_tokens_total", {"label": label, "kind": "completion"}, stats.completion_tokens),
+        ]
+    samples.append(("gauge", "bot_llm_breaker_open", {}, int(governor.breaker.state != "closed")))
+    samples.append(("gauge", "bot_llm_waiting", {}, governor.waiting))
+
+    scheduler_stats = _shared_scheduler.stats()
+    samples.append(("gauge", "bot_scheduler_active", {}, scheduler_stats["active"]))
+    samples.append(("gauge", "bot_scheduler_pending", {}, scheduler_stats["pending"]))
+
+    limiter_stats = [rate_limiter.stats() for rate_limiter in list(_rate_limiters.values())]
+    limiter_stats.append(_retired_limiter_stats)
+    samples.append(("counter", "bot_telegram_retries_total", {}, sum(stats["retries"] for stats in limiter_stats)))
+    samples.append(("counter", "bot_telegram_flood_waits_total", {},
+                    sum(stats["flood_waits"] for stats in limiter_stats)))
+    samples.append(("gauge", "bot_hosted_bots", {}, len(_rate_limiters)))
+
+    response_cache = get_response_cache()
+    if response_cache:
+        samples.append(("gauge", "bot_response_cache_size", {}, response_cache.stats()["size"]))
+    return samples
+
+
+class SharedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest que usan todos los bots del proceso.
+
+    Cada HTTPXRequest crea su propio cliente httpx (pool y contexto SSL,
+    ~0,8 MiB); compartirlo deja el costo de cada bot extra en unos pocos
+    KiB. El shutdown de un bot no lo cierra: lo hace close_shared_requests.
+    """
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def close(self):
+        await super().shutdown()
+
+
+# Recursos compartidos por todas las Applications del proceso (ver setup_bot)
+_shared_scheduler = None
+_shared_requests = None
+# Limitador de cada bot construido, por bot_id (un bot reconstruido reemplaza al anterior)
+_rate_limiters = {}
+# Contadores de los limitadores de bots retirados: los totales de /metrics no retroceden
+_retired_limiter_stats = {"retries": 0, "flood_waits": 0}
+
+
+def _get_shared_resources():
+    global _shared_scheduler, _shared_requests
+    if _shared_scheduler is None:
+        # Orden por chat y concurrencia entre chats, con un solo límite para todos los bots
+        _shared_scheduler = ChatUpdateScheduler(Config.MAX_CONCURRENT_UPDATES, Config.MAX_PENDING_UPDATES)
+        _shared_requests = (SharedHTTPXRequest(connection_pool_size=256), SharedHTTPXRequest(connection_pool_size=8))
+        if Config.METRICS_ENABLED:
+            metrics.get_metrics().register_collector(_collect_bot_metrics)
+    return _shared_scheduler, _shared_requests
+
+
+def release_bot(application: Application):
+    """Quita de las métricas el limitador de un bot retirado (borrado o con otro token)."""
+    bot_id = application.bot_data.get("bot_id")
+    rate_limiter = application.bot.rate_limiter
+    if _rate_limiters.get(bot_id) is rate_limiter:
+        del _rate_limiters[bot_id]
+    stats = rate_limiter.stats()
+    _retired_limiter_stats["retries"] += stats["retries"]
+    _retired_limiter_stats["flood_waits"] += stats["flood_waits"]
+
+
+async def close_shared_requests():
+    """Cierra los clientes HTTP compartidos (al detener el proceso)."""
+    if _shared_requests is not None:
+        for request in _shared_requests:
+            await request.close()
+
+
+def setup_bot(app=None, token: str = None, bot_id: int = None):
+    """Configura y retorna la aplicación de un bot.
+
+    Sin token se usa TELEGRAM_BOT_TOKEN (el bot por defecto, bot_id None).
+    Todas las Applications comparten el planificador, los clientes HTTP,
+    el loop, OpenAI y las cachés; cada una tiene su propio limitador, ya
+    que los límites de Telegram son por token.
+    """
+    token = token or Config.TELEGRAM_BOT_TOKEN
     
     if not token:
         logger.warning("TELEGRAM_BOT_TOKEN no está configurado")
         return None
 
-    application = Application.builder().token(token).build()
+    scheduler, (request, get_updates_request) = _get_shared_resources()
+    rate_limiter = TelegramRateLimiter()
+    application = (
+        Application.builder()
+        .token(token)
+        .base_url(Config.TELEGRAM_API_BASE_URL)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .concurrent_updates(scheduler)
+        .rate_limiter(rate_limiter)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
+    _rate_limiters[bot_id] = rate_limiter
+    application.bot_data["bot_id"] = bot_id
+
+    # Cargar el clasificador local de intenciones una sola vez al arrancar
+    get_intent_classifier()
     
     # Guardar la instancia de Flask en bot_data
     if app:
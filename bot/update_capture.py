@@ -0,0 +1,201 @@
+import os
+import re
+import gzip
+import json
+import time
+import hmac
+import atexit
+import hashlib
+import logging
+import threading
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Objetos de Telegram cuyo "id" identifica a una persona o chat; además se anonimiza el id de
+# cualquier objeto con la forma de un User o un Chat (new_chat_members, forward_origin.sender_user...)
+_ID_OBJECTS = {"from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat", "new_chat_member",
+               "left_chat_member", "via_bot"}
+_IDENTITY_FIELDS = {"is_bot", "first_name", "type"}
+# Campos sueltos con el id de un usuario o chat
+_ID_FIELDS = {"user_id", "chat_id", "sender_chat_id", "migrate_to_chat_id", "migrate_from_chat_id"}
+_NAME_FIELDS = {"first_name", "last_name", "username", "title", "bio", "phone_number", "email"}
+_TEXT_FIELDS = {"text", "caption", "data", "query"}
+# Contenido que no aporta al perfil de tráfico y es sensible por sí mismo
+_DROPPED_FIELDS = {"contact", "location", "venue", "photo", "document", "voice", "video", "audio", "sticker",
+                   "entities", "caption_entities", "reply_to_message", "pinned_message"}
+
+# Palabras que el bot usa para decidir el flujo: se conservan al anonimizar el texto
+KEEP_WORDS = {
+    "hola", "buen", "buenas", "buenos", "saludos", "que", "qué", "tal", "hi", "hello",
+    "ver", "foto", "fotos", "imagen", "imágenes", "muéstrame", "muestrame", "enséñame", "ensename",
+    "pásame", "pasame", "show", "image", "picture", "photo",
+    "compra", "comprar", "cotiza", "cotización", "cotizacion", "precio", "inventario", "stock", "disponible",
+}
+
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_URL_RE = re.compile(r"https?://\S+|www\.\S+", re.IGNORECASE)
+_MENTION_RE = re.compile(r"@\w+")
+_DIGITS_RE = re.compile(r"\+?\d[\d\s-]{4,}\d")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class UpdateScrubber:
+    """Anonimiza actualizaciones de Telegram conservando su forma.
+
+    Los ids se reemplazan por un HMAC estable (mismo usuario → mismo id, con
+    el signo original para distinguir grupos), así el replay mantiene el
+    orden y las ráfagas por chat. El texto se trata según text_mode:
+    "pii" enmascara correos, URLs, menciones y números largos; "redact"
+    además reemplaza cada palabra por 'x' de la misma longitud, salvo las
+    palabras clave que deciden el flujo del bot (saludos, imagen, intención).
+    """
+
+    def __init__(self, salt: str, text_mode: str = "redact"):
+        self.salt = salt.encode()
+        self.text_mode = text_mode
+
+    def scrub_id(self, value: int) -> int:
+        digest = hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()
+        scrubbed = int.from_bytes(digest[:6], "big") + 1
+        return -scrubbed if value < 0 else scrubbed
+
+    def scrub_text(self, text: str) -> str:
+        text = _EMAIL_RE.sub("user@example.com", text)
+        text = _URL_RE.sub("https://example.com", text)
+        text = _MENTION_RE.sub("@usuario", text)
+        text = _DIGITS_RE.sub(lambda m: "0" * len(m.group(0)), text)
+        if self.text_mode == "redact":
+            text = _WORD_RE.sub(
+                lambda m: m.group(0) if m.group(0).lower() in KEEP_WORDS or m.group(0).isdigit() else "x" * len(m.group(0)),
+                text
+            )
+        return text
+
+    def scrub(self, value, key: str = None):
+        if isinstance(value, dict):
+            identity = key in _ID_OBJECTS or not _IDENTITY_FIELDS.isdisjoint(value)
+            scrubbed = {}
+            for field, item in value.items():
+                if field in _DROPPED_FIELDS:
+                    continue
+                if isinstance(item, int) and ((field == "id" and identity) or field in _ID_FIELDS):
+                    scrubbed[field] = self.scrub_id(item)
+                elif field in _NAME_FIELDS and isinstance(item, str):
+                    scrubbed[field] = "x"
+                elif field in _TEXT_FIELDS and isinstance(item, str):
+                    scrubbed[field] = self.scrub_text(item)
+                else:
+                    scrubbed[field] = self.scrub(item, field)
+            return scrubbed
+        if isinstance(value, list):
+            return [self.scrub(item, key) for item in value]
+        return value
+
+
+def chat_id_of(data: dict):
+    """chat_id de una actualización en JSON (None si no tiene)."""
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if isinstance(data.get(field), dict):
+            return data[field].get("chat", {}).get("id")
+    callback = data.get("callback_query")
+    if isinstance(callback, dict) and isinstance(callback.get("message"), dict):
+        return callback["message"].get("chat", {}).get("id")
+    return None
+
+
+class UpdateCapture:
+    """Graba una muestra de las actualizaciones del webhook en JSONL comprimido.
+
+    El muestreo es por chat (hash del chat_id), de modo que las
+    conversaciones muestreadas quedan completas. Cada proceso escribe su
+    propio archivo ({pid} en la ruta); las líneas son
+    {"t": hora de llegada, "update": actualización anonimizada}.
+    """
+
+    def __init__(self, path: str = None, sample_rate: float = None, salt: str = None, text_mode: str = None,
+                 flush_every: int = 100):
+        self.path_template = path or Config.UPDATE_CAPTURE_PATH
+        self.sample_rate = Config.UPDATE_CAPTURE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.scrubber = UpdateScrubber(
+            salt or Config.UPDATE_CAPTURE_SALT or Config.SECRET_KEY,
+            text_mode or Config.UPDATE_CAPTURE_TEXT
+        )
+        self.flush_every = flush_every
+        self.recorded = 0
+        self._file = None
+        self._pid = None
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def sampled(self, data: dict) -> bool:
+        if self.sample_rate >= 1:
+            return True
+        chat_id = chat_id_of(data)
+        key = str(chat_id if chat_id is not None else data.get("update_id"))
+        bucket = int.from_bytes(hashlib.sha1(key.encode()).digest()[:4], "big") / 2 ** 32
+        return bucket < self.sample_rate
+
+    def _open(self):
+        path = self.path_template.format(pid=os.getpid())
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Modo "a": cada reinicio agrega un miembro gzip al mismo archivo (se lee como uno solo)
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._pid = os.getpid()
+
+    def record(self, data: dict):
+        """Graba la actualización si cae en la muestra (no lanza excepciones)."""
+        if not self.sampled(data):
+            return
+        try:
+            line = json.dumps({"t": time.time(), "update": self.scrubber.scrub(data)}, ensure_ascii=False)
+            with self._lock:
+                if self._file is None or self._pid != os.getpid():
+                    self._open()
+                self._file.write(line + "\n")
+                self.recorded += 1
+                now = time.monotonic()
+                # Con poco tráfico también se vuelca cada pocos segundos
+                if self.recorded % self.flush_every == 0 or now - self._last_flush > 5:
+                    self._file.flush()
+                    self._last_flush = now
+        except Exception as e:
+            logger.error(f"Error grabando la actualización: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._file.close()
+            self._file = None
+
+
+def read_capture(paths: list) -> list:
+    """Lee uno o varios archivos de captura y retorna [(t, update)] ordenado por llegada."""
+    records = []
+    for path in paths:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Línea truncada si el proceso terminó sin cerrar el archivo
+                        continue
+                    records.append((record["t"], record["update"]))
+        except EOFError:
+            logger.warning(f"Captura incompleta (el proceso no cerró el archivo): {path}")
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+_capture = None
+
+
+def get_update_capture():
+    """Retorna la captura del proceso (None si está desactivada)."""
+    global _capture
+    if _capture is None and Config.UPDATE_CAPTURE_ENABLED:
+        _capture = UpdateCapture()
+        atexit.register(_capture.close)
+    return _capture
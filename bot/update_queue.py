@@ -0,0 +1,282 @@
+import os
+import time
+import asyncio
+import logging
+
+from config import Config
+from bot.sqlite_store import SQLiteStore, pid_alive
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update: dict) -> int:
+    """chat_id de una actualización cruda de Telegram (id del usuario si no hay chat, 0 si ninguno)."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        # message, edited_message, channel_post...: chat directo; callback_query: chat del mensaje
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+class UpdateQueue(SQLiteStore):
+    """Cola durable de actualizaciones de Telegram en SQLite (WAL).
+
+    update_id es la clave primaria: las reentregas de Telegram se descartan.
+    Las filas completadas se conservan durante retention segundos para
+    seguir deduplicando y luego se eliminan. chat_key agrupa las
+    actualizaciones de un chat: claim() no entrega una mientras otra del
+    mismo chat esté en proceso, así una ráfaga de un chat no ocupa todo el
+    pool y el orden se respeta aunque varios procesos (workers WSGI) lean la
+    misma cola. claimed_by guarda el pid que reservó la fila: si ese proceso
+    muere, recover() la devuelve a la cola sin esperar a stale_after, para no
+    dejar bloqueado a su chat.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS updates (
+        update_id INTEGER PRIMARY KEY,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        claimed_at REAL,
+        chat_key TEXT,
+        claimed_by INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS ix_updates_status ON updates (status, update_id);
+    """
+
+    def __init__(self, path: str = None, max_attempts: int = None, retention: float = None):
+        super().__init__(path or Config.UPDATE_QUEUE_DB)
+        self.max_attempts = Config.UPDATE_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self.retention = Config.UPDATE_QUEUE_RETENTION if retention is None else retention
+
+    def upgrade_schema(self, conn):
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(updates)")}
+        if "chat_key" not in columns:
+            conn.execute("ALTER TABLE updates ADD COLUMN chat_key TEXT")
+        if "claimed_by" not in columns:
+            conn.execute("ALTER TABLE updates ADD COLUMN claimed_by INTEGER")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_updates_chat ON updates (chat_key, status)")
+
+    @staticmethod
+    def chat_key(update: dict, bot_id: int = None):
+        """Clave del chat de la actualización (None si no pertenece a un chat)."""
+        chat_id = update_chat_id(update)
+        return f"{bot_id or 0}:{chat_id}" if chat_id else None
+
+    @staticmethod
+    def key(update_id: int, bot_id: int = None) -> int:
+        """Clave en la cola: los update_id de bots distintos pueden coincidir.
+
+        El bot por defecto usa el update_id tal cual; los demás lo combinan
+        con su id en los bits altos (los update_id caben en 32 bits).
+        """
+        return update_id if bot_id is None else (bot_id << 32) | update_id
+
+    def enqueue(self, update_id: int, payload: str, chat_key: str = None) -> bool:
+        """Guarda la actualización; retorna False si ya se había recibido."""
+        cursor = self.execute(
+            "INSERT OR IGNORE INTO updates (update_id, payload, created_at, chat_key) VALUES (?, ?, ?, ?)",
+            (update_id, payload, time.time(), chat_key)
+        )
+        return cursor.rowcount == 1
+
+    def claim(self, limit: int = 1) -> list:
+        """Reserva actualizaciones pendientes (en orden) y retorna [(update_id, payload)].
+
+        De cada chat solo se entrega la más antigua, y ninguna si el chat ya
+        tiene una en proceso.
+        """
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                """SELECT update_id, payload FROM updates AS u
+                   WHERE status = 'pending' AND (chat_key IS NULL OR NOT EXISTS (
+                       SELECT 1 FROM updates AS o WHERE o.chat_key = u.chat_key
+                       AND (o.status = 'processing' OR (o.status = 'pending' AND o.update_id < u.update_id))))
+                   ORDER BY update_id LIMIT ?""",
+                (limit,)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    """UPDATE updates SET status = 'processing', claimed_at = ?, claimed_by = ?, attempts = attempts + 1
+                       WHERE update_id = ?""",
+                    [(time.time(), os.getpid(), row[0]) for row in rows]
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def complete(self, update_id: int):
+        self.execute("UPDATE updates SET status = 'done', payload = '' WHERE update_id = ?", (update_id,))
+
+    def fail(self, update_id: int):
+        """Devuelve la actualización a la cola, o la marca como fallida si agotó los intentos."""
+        self.execute(
+            "UPDATE updates SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END WHERE update_id = ?",
+            (self.max_attempts, update_id)
+        )
+
+    def recover(self, stale_after: float = None) -> int:
+        """Vuelve a encolar las actualizaciones que quedaron a medias (p. ej. tras un reinicio).
+
+        Las de procesos que ya no existen se recuperan al instante; las demás
+        tras stale_after segundos en proceso.
+        """
+        stale_after = Config.UPDATE_QUEUE_STALE_AFTER if stale_after is None else stale_after
+        owners = self.execute(
+            "SELECT DISTINCT claimed_by FROM updates WHERE status = 'processing' AND claimed_by IS NOT NULL"
+        ).fetchall()
+        dead = [pid for (pid,) in owners if pid != os.getpid() and not pid_alive(pid)]
+        cursor = self.execute(
+            f"""UPDATE updates SET status = 'pending' WHERE status = 'processing'
+                AND (claimed_at < ? OR claimed_by IN ({",".join("?" * len(dead))}))""",
+            (time.time() - stale_after, *dead)
+        )
+        return cursor.rowcount
+
+    def prune(self):
+        """Elimina las filas terminadas fuera de la ventana de deduplicación."""
+        self.execute(
+            "DELETE FROM updates WHERE status IN ('done', 'failed') AND created_at < ?",
+            (time.time() - self.retention,)
+        )
+
+    def depth(self) -> int:
+        return self.execute("SELECT COUNT(*) FROM updates WHERE status = 'pending'").fetchone()[0]
+
+
+class UpdateWorkerPool:
+    """Vacía la UpdateQueue en el loop compartido con hasta `workers` actualizaciones en vuelo.
+
+    Un solo bucle reserva las filas en orden de update_id y lanza cada una
+    como tarea sin esperar a que termine: una ráfaga de un chat espera su
+    turno en el planificador por chat sin ocupar el bucle, y las
+    actualizaciones de otros chats siguen entrando mientras haya cupo.
+    """
+
+    def __init__(self, queue: UpdateQueue, process, workers: int = None, poll_interval: float = None):
+        self.queue = queue
+        self.process = process
+        self.workers = Config.UPDATE_WORKERS if workers is None else workers
+        self.poll_interval = Config.UPDATE_QUEUE_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._dispatcher = None
+        self._maintenance_task = None
+        self._in_flight = set()
+        self._slots = None
+        self._wakeup = None
+        self._loop = None
+        self._stopping = False
+        self._starting = False
+
+    @property
+    def running(self) -> bool:
+        return self._dispatcher is not None
+
+    async def start(self):
+        """Recupera el trabajo pendiente y arranca el pool (idempotente)."""
+        # Varias peticiones del webhook pueden llegar aquí a la vez: solo la primera arranca el pool
+        if self._dispatcher is not None or self._starting:
+            return
+        self._starting = True
+        try:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._stopping = False
+            recovered = await asyncio.to_thread(self.queue.recover)
+            if recovered:
+                logger.info(f"{recovered} actualizaciones recuperadas de la cola")
+            await asyncio.to_thread(self.queue.prune)
+            self._dispatcher = asyncio.create_task(self._dispatch())
+            self._maintenance_task = asyncio.create_task(self._maintenance())
+        finally:
+            self._starting = False
+        logger.info(f"Pool de actualizaciones iniciado ({self.workers} en vuelo como máximo)")
+
+    def notify(self):
+        """Despierta al pool (se puede llamar desde cualquier hilo)."""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _dispatch(self):
+        while not self._stopping:
+            await self._slots.acquire()
+            try:
+                rows = await asyncio.to_thread(self.queue.claim, 1)
+            except RuntimeError:
+                # El ejecutor de hilos ya se cerró: el proceso está terminando
+                self._slots.release()
+                break
+            except Exception as e:
+                logger.error(f"Error leyendo la cola de actualizaciones: {e}")
+                rows = []
+
+            if not rows:
+                self._slots.release()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Las tareas se crean en orden de update_id: el planificador por chat las recibe en orden
+            update_id, payload = rows[0]
+            task = asyncio.create_task(self._run(update_id, payload))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _run(self, update_id: int, payload: str):
+        try:
+            await self.process(payload)
+            await asyncio.to_thread(self.queue.complete, update_id)
+        except asyncio.CancelledError:
+            # Sin await: la tarea ya está cancelada; recover() la reencola si esto falla
+            try:
+                self.queue.fail(update_id)
+            except Exception:
+                pass
+            raise
+        except Exception as e:
+            logger.error(f"Error procesando la actualización {update_id}: {e}")
+            await asyncio.to_thread(self.queue.fail, update_id)
+        finally:
+            self._slots.release()
+
+    async def _maintenance(self):
+        """Recupera trabajos abandonados y limpia la tabla periódicamente."""
+        while not self._stopping:
+            await asyncio.sleep(60)
+            try:
+                await asyncio.to_thread(self.queue.recover)
+                await asyncio.to_thread(self.queue.prune)
+            except Exception as e:
+                logger.error(f"Error en el mantenimiento de la cola: {e}")
+
+    async def stop(self, timeout: float = 10):
+        """Deja de reservar y espera lo que está en vuelo; lo que quede pendiente se procesa tras reiniciar."""
+        self._stopping = True
+        self.notify()
+        for task in (self._maintenance_task, self._dispatcher):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._maintenance_task = None
+        self._dispatcher = None
+        if not self._in_flight:
+            return
+        done, pending = await asyncio.wait(set(self._in_flight), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -23,9 +23,152 @@ class Config:
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Versión de la configuración: se incrementa en cada POST de /config
+    CONFIG_VERSION_FILE = os.environ.get("CONFIG_VERSION_FILE", os.path.join(BASE_DIR, "instance", "config.version"))
+    # Segundos entre comprobaciones del archivo de versión
+    CONFIG_CHECK_INTERVAL = float(os.environ.get("CONFIG_CHECK_INTERVAL", "1"))
+
     # OpenAI
     OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "").strip().replace('"', '').replace("'", "")
+    # Endpoint alternativo (proxy, servidor compatible o el simulado de los benchmarks); vacío = API oficial
+    OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "")
+    # Pool HTTP del cliente compartido de OpenAI
+    OPENAI_HTTP2 = os.environ.get("OPENAI_HTTP2", "true").lower() == "true"
+    OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "20"))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+    OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "30"))
+    OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "30"))
+    OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "5"))
+    # Governor de OpenAI: presupuesto por minuto, reintentos, hedging y circuit breaker
+    OPENAI_RPM = float(os.environ.get("OPENAI_RPM", "3500"))
+    OPENAI_TPM = float(os.environ.get("OPENAI_TPM", "90000"))
+    LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "20"))
+    LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+    LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "false").lower() == "true"
+    # Espera mínima antes de lanzar la petición duplicada (se usa el p95 observado si es mayor)
+    LLM_HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "2"))
+    LLM_BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", "5"))
+    LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))
+    # Modelo más barato para cuando el circuito está abierto (vacío = respuesta fija)
+    OPENAI_FALLBACK_MODEL = os.environ.get("OPENAI_FALLBACK_MODEL", "")
+    LLM_CANNED_REPLY = os.environ.get(
+        "LLM_CANNED_REPLY", "Estoy recibiendo muchas consultas en este momento. ¿Me escribes de nuevo en un minuto? 🙏"
+    )
+    # "two_call": detect_intent + respuesta; "single_call": ambas en una sola completion
+    INTENT_MODE = os.environ.get("INTENT_MODE", "two_call").strip().lower()
+    # Respuestas en streaming con ediciones progresivas (solo en el modo "two_call")
+    STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "false").lower() == "true"
+    STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.5"))
+    STREAM_MIN_CHARS = int(os.environ.get("STREAM_MIN_CHARS", "80"))
+    # Clasificador local de intenciones (se usa el LLM solo si la confianza es baja)
+    INTENT_MODEL_PATH = os.environ.get("INTENT_MODEL_PATH", os.path.join(BASE_DIR, "instance", "intent_model.json"))
+    INTENT_CLASSIFIER_THRESHOLD = float(os.environ.get("INTENT_CLASSIFIER_THRESHOLD", "0.75"))
+    # JSONL donde se guardan los mensajes etiquetados por el LLM (vacío = desactivado)
+    INTENT_LOG_PATH = os.environ.get("INTENT_LOG_PATH", "")
+
+    # Caché de respuestas (clave: mensaje normalizado + intención + versión de la config)
+    RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "512"))
+    RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+    # Ruta SQLite compartida entre workers (vacío = solo memoria)
+    RESPONSE_CACHE_DB = os.environ.get("RESPONSE_CACHE_DB", "")
+    # Similitud mínima (Jaccard de palabras) para reutilizar preguntas casi iguales; 0 = desactivado
+    RESPONSE_CACHE_SIMILARITY = float(os.environ.get("RESPONSE_CACHE_SIMILARITY", "0"))
+
+    # Búsqueda de imágenes (icrawler) en un pool acotado y con caché persistente
+    IMAGE_SEARCH_WORKERS = int(os.environ.get("IMAGE_SEARCH_WORKERS", "2"))
+    IMAGE_SEARCH_TIMEOUT = float(os.environ.get("IMAGE_SEARCH_TIMEOUT", "8"))
+    # Hilos de reserva para crawls que agotaron el tiempo (no se pueden interrumpir)
+    IMAGE_SEARCH_MAX_ABANDONED = int(os.environ.get("IMAGE_SEARCH_MAX_ABANDONED", "4"))
+    IMAGE_CACHE_DB = os.environ.get("IMAGE_CACHE_DB", os.path.join(BASE_DIR, "instance", "image_cache.db"))
+    IMAGE_CACHE_TTL = float(os.environ.get("IMAGE_CACHE_TTL", str(7 * 24 * 3600)))
+    IMAGE_NEGATIVE_TTL = float(os.environ.get("IMAGE_NEGATIVE_TTL", "3600"))
+    # file_id de Telegram de las fotos ya enviadas (LRU persistente)
+    FILE_ID_CACHE_DB = os.environ.get("FILE_ID_CACHE_DB", os.path.join(BASE_DIR, "instance", "file_ids.db"))
+    FILE_ID_CACHE_SIZE = int(os.environ.get("FILE_ID_CACHE_SIZE", "5000"))
 
     # Telegram
     TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
-    WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
\ No newline at end of file
+    WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+    # Servidor de la Bot API (p. ej. un telegram-bot-api local o el simulado de los benchmarks)
+    TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+
+    # Planificador por chat: chats distintos en paralelo hasta este límite
+    MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "8"))
+    MAX_PENDING_UPDATES = int(os.environ.get("MAX_PENDING_UPDATES", "1024"))
+
+    # Límites de salida hacia la Bot API (mensajes por segundo)
+    TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", "30"))
+    TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", "1"))
+    TELEGRAM_CHAT_BURST = float(os.environ.get("TELEGRAM_CHAT_BURST", "3"))
+    TELEGRAM_GROUP_RATE_PER_MIN = float(os.environ.get("TELEGRAM_GROUP_RATE_PER_MIN", "20"))
+    TELEGRAM_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES", "3"))
+    # Envíos en espera antes de frenar a los handlers (backpressure)
+    TELEGRAM_MAX_PENDING_SENDS = int(os.environ.get("TELEGRAM_MAX_PENDING_SENDS", "256"))
+
+    # Polling con varios procesos (run_bot.py --workers N): un fetcher reparte las actualizaciones por chat_id
+    POLLING_WORKERS = int(os.environ.get("POLLING_WORKERS", "1"))
+    POLLING_TIMEOUT = int(os.environ.get("POLLING_TIMEOUT", "30"))
+    # Actualizaciones en la cola de cada worker antes de frenar al fetcher
+    POLLING_WORKER_QUEUE = int(os.environ.get("POLLING_WORKER_QUEUE", "1000"))
+    # Segundos para que los workers terminen lo pendiente al detenerse
+    POLLING_DRAIN_TIMEOUT = float(os.environ.get("POLLING_DRAIN_TIMEOUT", "60"))
+
+    # Cola durable del webhook: se responde 200 al instante y un pool de workers procesa
+    WEBHOOK_QUEUE_ENABLED = os.environ.get("WEBHOOK_QUEUE_ENABLED", "true").lower() == "true"
+    UPDATE_QUEUE_DB = os.environ.get("UPDATE_QUEUE_DB", os.path.join(BASE_DIR, "instance", "update_queue.db"))
+    # Actualizaciones del webhook en vuelo a la vez por proceso (el orden por chat lo garantiza el planificador)
+    UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", "16"))
+    UPDATE_MAX_ATTEMPTS = int(os.environ.get("UPDATE_MAX_ATTEMPTS", "3"))
+    UPDATE_QUEUE_POLL_INTERVAL = float(os.environ.get("UPDATE_QUEUE_POLL_INTERVAL", "1"))
+    # Segundos tras los que una actualización "en proceso" se considera abandonada
+    UPDATE_QUEUE_STALE_AFTER = float(os.environ.get("UPDATE_QUEUE_STALE_AFTER", "300"))
+    # Ventana de deduplicación por update_id (Telegram reintenta hasta 24 h)
+    UPDATE_QUEUE_RETENTION = float(os.environ.get("UPDATE_QUEUE_RETENTION", "86400"))
+
+    # Memoria de conversación por chat (tabla chat_messages + LRU en memoria)
+    HISTORY_ENABLED = os.environ.get("HISTORY_ENABLED", "true").lower() == "true"
+    HISTORY_MAX_TURNS = int(os.environ.get("HISTORY_MAX_TURNS", "20"))
+    # Tokens de historial que se incluyen en cada prompt
+    HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "800"))
+    HISTORY_MAX_CHATS = int(os.environ.get("HISTORY_MAX_CHATS", "1000"))
+    # Las escrituras se agrupan: cada N segundos o al acumular N turnos
+    HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", "5"))
+    HISTORY_FLUSH_SIZE = int(os.environ.get("HISTORY_FLUSH_SIZE", "50"))
+    # Con varios procesos atendiendo un mismo chat (workers WSGI del webhook), el historial en memoria se
+    # revalida contra la base si tiene más de N segundos; 0 = nunca (un solo proceso o afinidad por chat)
+    HISTORY_RELOAD_AFTER = float(os.environ.get("HISTORY_RELOAD_AFTER", "2"))
+    # Un mensaje a menos de N segundos de la última respuesta del chat es un seguimiento: no usa la caché de respuestas
+    HISTORY_FOLLOWUP_WINDOW = float(os.environ.get("HISTORY_FOLLOWUP_WINDOW", "900"))
+    # Resumir con el LLM los turnos que exceden el presupuesto en lugar de descartarlos
+    HISTORY_SUMMARIZE = os.environ.get("HISTORY_SUMMARIZE", "false").lower() == "true"
+
+    # Métricas en formato Prometheus (/metrics); cada proceso vuelca las suyas en METRICS_DIR
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(BASE_DIR, "instance", "metrics"))
+    METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "10"))
+
+    # Registro de interacciones para analítica (/analytics): SQLite WAL propio, escrito en lotes fuera del loop
+    INTERACTION_LOG_ENABLED = os.environ.get("INTERACTION_LOG_ENABLED", "true").lower() == "true"
+    INTERACTION_LOG_DB = os.environ.get("INTERACTION_LOG_DB", os.path.join(BASE_DIR, "instance", "interactions.db"))
+    # Se escribe cada N segundos o al juntar N registros, lo que ocurra primero
+    INTERACTION_LOG_FLUSH_INTERVAL = float(os.environ.get("INTERACTION_LOG_FLUSH_INTERVAL", "5"))
+    INTERACTION_LOG_FLUSH_SIZE = int(os.environ.get("INTERACTION_LOG_FLUSH_SIZE", "200"))
+    # Registros en memoria como máximo si la base no responde (se descartan los más antiguos)
+    INTERACTION_LOG_MAX_PENDING = int(os.environ.get("INTERACTION_LOG_MAX_PENDING", "10000"))
+    # Días que se conservan los registros individuales (los agregados por hora no se borran)
+    INTERACTION_LOG_RETENTION_DAYS = float(os.environ.get("INTERACTION_LOG_RETENTION_DAYS", "30"))
+    # Guardar el texto de cada mensaje (false = solo su longitud)
+    INTERACTION_LOG_TEXT = os.environ.get("INTERACTION_LOG_TEXT", "true").lower() == "true"
+
+    # Grabación de actualizaciones del webhook para replay (JSONL gzip, un archivo por proceso)
+    UPDATE_CAPTURE_ENABLED = os.environ.get("UPDATE_CAPTURE_ENABLED", "false").lower() == "true"
+    UPDATE_CAPTURE_PATH = os.environ.get(
+        "UPDATE_CAPTURE_PATH", os.path.join(BASE_DIR, "instance", "captures", "updates-{pid}.jsonl.gz")
+    )
+    # Fracción de chats grabados (el muestreo es por chat para conservar conversaciones completas)
+    UPDATE_CAPTURE_SAMPLE_RATE = float(os.environ.get("UPDATE_CAPTURE_SAMPLE_RATE", "1"))
+    # Sal del HMAC que anonimiza los ids (vacío = SECRET_KEY)
+    UPDATE_CAPTURE_SALT = os.environ.get("UPDATE_CAPTURE_SALT", "")
+    # "redact": solo se conservan las palabras clave del bot; "pii": se enmascaran correos, URLs y números
+    UPDATE_CAPTURE_TEXT = os.environ.get("UPDATE_CAPTURE_TEXT", "redact").strip().lower()
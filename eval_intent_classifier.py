@@ -0,0 +1,56 @@
+import argparse
+import time
+
+from config import Config
+from bot.intent_classifier import IntentClassifier, load_labeled_messages
+
+
+def percentile(values, pct):
+    """Percentil por el método del rango más cercano."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Evalúa el clasificador local contra las etiquetas del LLM."
+    )
+    parser.add_argument("--data", required=True, help="JSONL con las etiquetas del LLM ('text', 'intent')")
+    parser.add_argument("--model", default=Config.INTENT_MODEL_PATH)
+    parser.add_argument("--threshold", type=float, default=Config.INTENT_CLASSIFIER_THRESHOLD)
+    args = parser.parse_args()
+
+    model = IntentClassifier.load(args.model)
+    texts, labels = load_labeled_messages(args.data)
+    if not texts:
+        print(f"❌ No hay mensajes etiquetados en {args.data}")
+        return
+
+    latencies = []
+    correct = confident = confident_correct = 0
+    for text, label in zip(texts, labels):
+        start = time.perf_counter()
+        intent, confidence = model.predict(text)
+        latencies.append((time.perf_counter() - start) * 1e6)
+
+        correct += intent == label
+        if confidence >= args.threshold:
+            confident += 1
+            confident_correct += intent == label
+
+    total = len(texts)
+    print(f"--- Evaluación del clasificador ({total} mensajes) ---")
+    print(f"Exactitud global:            {correct / total:.1%}")
+    print(f"Cobertura (conf >= {args.threshold:.2f}):  {confident / total:.1%}")
+    if confident:
+        print(f"Exactitud sobre cubiertos:   {confident_correct / confident:.1%}")
+    print(f"Llamadas al LLM evitadas:    {confident} de {total}")
+    print(
+        f"Latencia por mensaje (µs):   p50={percentile(latencies, 50):.1f} "
+        f"p95={percentile(latencies, 95):.1f} p99={percentile(latencies, 99):.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
-from app import app, db
+from app import app, db, init_db
 from models import BotConfig
+from bot.config_cache import bump_config_version
 
 def init_default_config():
+    init_db()
     with app.app_context():
-        db.create_all()
         if not BotConfig.query.first():
             config = BotConfig(
                 name="Grooming Bot",
@@ -14,6 +15,7 @@ def init_default_config():
             )
             db.session.add(config)
             db.session.commit()
+            bump_config_version()
             print("✅ Configuración inicial creada.")
         else:
             print("ℹ️ Ya existe una configuración.")
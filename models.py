@@ -14,6 +14,15 @@ class BotConfig(db.Model):
     greeting = db.Column(db.String(200), default="¡Hola! ¿En qué puedo ayudarte?", nullable=False)
     tone = db.Column(db.String(50), default="amigable", nullable=False)
     topic = db.Column(db.String(200), default="estética canina", nullable=False)
+    # Token propio del bot (vacío = TELEGRAM_BOT_TOKEN del entorno: el bot por defecto)
+    token = db.Column(db.String(100), unique=True, nullable=True)
+    # Telegram lo envía en X-Telegram-Bot-Api-Secret-Token; el webhook enruta con él
+    webhook_secret = db.Column(db.String(64), unique=True, nullable=True)
+
+    @classmethod
+    def get_default(cls):
+        """Configuración del bot por defecto (el que usa TELEGRAM_BOT_TOKEN)."""
+        return cls.query.filter(cls.token.is_(None)).order_by(cls.id).first()
 
     def to_dict(self):
         """Convierte el modelo a diccionario."""
@@ -24,4 +33,83 @@ class BotConfig(db.Model):
             "greeting": self.greeting,
             "tone": self.tone,
             "topic": self.topic,
-        }
\ No newline at end of file
+        }
+
+
+class ChatMessage(db.Model):
+    """Turno de una conversación (o resumen de turnos antiguos) de un chat."""
+
+    __tablename__ = "chat_messages"
+    # La lectura del historial filtra por chat y ordena por fecha
+    __table_args__ = (db.Index("ix_chat_messages_chat_created", "chat_id", "created_at"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    # BotConfig del bot que mantuvo la conversación
+    bot_id = db.Column(db.Integer, nullable=True)
+    chat_id = db.Column(db.BigInteger, nullable=False)
+    # "user", "assistant" o "summary"
+    role = db.Column(db.String(10), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.Float, nullable=False)
+
+    def to_dict(self):
+        """Convierte el modelo a diccionario."""
+        return {
+            "id": self.id,
+            "bot_id": self.bot_id,
+            "chat_id": self.chat_id,
+            "role": self.role,
+            "content": self.content,
+            "created_at": self.created_at,
+        }
+
+
+class FaqRule(db.Model):
+    """Respuesta fija para mensajes que coinciden con palabras clave o una expresión regular."""
+
+    __tablename__ = "faq_rules"
+
+    id = db.Column(db.Integer, primary_key=True)
+    bot_id = db.Column(db.Integer, db.ForeignKey("bot_config.id"), index=True, nullable=True)
+    # Palabras o frases separadas por comas, o una expresión regular si is_regex
+    pattern = db.Column(db.String(500), nullable=False)
+    is_regex = db.Column(db.Boolean, default=False, nullable=False)
+    answer = db.Column(db.Text, nullable=False)
+    # Búsqueda de imagen que acompaña la respuesta (opcional)
+    image_query = db.Column(db.String(200), nullable=True)
+    enabled = db.Column(db.Boolean, default=True, nullable=False)
+    # Si varias reglas coinciden gana la de menor prioridad
+    priority = db.Column(db.Integer, default=100, nullable=False)
+
+    def to_dict(self):
+        """Convierte el modelo a diccionario."""
+        return {
+            "id": self.id,
+            "bot_id": self.bot_id,
+            "pattern": self.pattern,
+            "is_regex": self.is_regex,
+            "answer": self.answer,
+            "image_query": self.image_query,
+            "enabled": self.enabled,
+            "priority": self.priority,
+        }
+
+
+def upgrade_schema():
+    """Agrega a las tablas existentes las columnas nuevas que admiten NULL.
+
+    db.create_all() crea las tablas que faltan pero no modifica las
+    existentes. SQLite no permite agregar columnas UNIQUE: la unicidad de
+    esas columnas en bases antiguas la valida la vista de configuración.
+    """
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(db.engine.dialect)
+            db.session.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    db.session.commit()
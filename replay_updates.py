@@ -0,0 +1,192 @@
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Reproduce actualizaciones grabadas en /webhook respetando (o escalando) su ritmo de llegada."
+    )
+    parser.add_argument("captures", nargs="+", help="Archivos .jsonl.gz de UPDATE_CAPTURE_PATH")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--target", help="URL del webhook de una instancia en marcha (p. ej. http://localhost/webhook)")
+    target.add_argument("--in-process", action="store_true",
+                        help="Procesar en este proceso con la Application del bot (APIs reales)")
+    target.add_argument("--fake-services", action="store_true",
+                        help="Procesar en este proceso contra la Bot API y OpenAI simuladas de bench/")
+    parser.add_argument("--speed", type=float, default=1.0, help="Factor de velocidad (2 = el doble de rápido)")
+    parser.add_argument("--max-gap", type=float, default=None, help="Acortar las pausas sin tráfico a N segundos")
+    parser.add_argument("--limit", type=int, default=None, help="Reproducir solo las primeras N actualizaciones")
+    parser.add_argument("--concurrency", type=int, default=256, help="Peticiones HTTP en vuelo como máximo")
+    parser.add_argument("--openai-latency", type=float, default=0.8, help="Latencia de OpenAI con --fake-services")
+    parser.add_argument("--output", help="Guardar el resumen en JSON")
+    return parser.parse_args()
+
+
+def build_schedule(records: list, speed: float, max_gap: float = None) -> list:
+    """Convierte las horas de llegada en desfases (segundos desde el inicio del replay)."""
+    schedule = []
+    offset, previous = 0.0, None
+    for t, update in records:
+        if previous is not None:
+            gap = t - previous
+            if max_gap is not None:
+                gap = min(gap, max_gap)
+            offset += gap / speed
+        previous = t
+        schedule.append((offset, update))
+    return schedule
+
+
+def renumber(schedule: list) -> list:
+    """Asigna update_id nuevos y crecientes: la cola del webhook descarta los ya vistos."""
+    base = int(time.time()) * 1000
+    for i, (_, update) in enumerate(schedule):
+        update["update_id"] = base + i
+    return schedule
+
+
+def percentile(values: list, pct: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def replay(schedule: list, send, concurrency: int) -> dict:
+    """Lanza send(update) a la hora programada de cada actualización."""
+    semaphore = asyncio.Semaphore(concurrency)
+    lags, latencies, outcomes = [], [], {}
+
+    async def run(update):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                outcome = await send(update)
+            except Exception as e:
+                outcome = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            outcomes[str(outcome)] = outcomes.get(str(outcome), 0) + 1
+
+    tasks = []
+    started = time.perf_counter()
+    for offset, update in schedule:
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lags.append(max(0.0, -delay))
+        tasks.append(asyncio.create_task(run(update)))
+    sent = time.perf_counter() - started
+    await asyncio.gather(*tasks)
+    duration = time.perf_counter() - started
+
+    planned = schedule[-1][0] if schedule else 0
+    return {
+        "updates": len(schedule),
+        "planned_duration": round(planned, 3),
+        "send_duration": round(sent, 3),
+        "duration": round(duration, 3),
+        "target_rate": round(len(schedule) / planned, 2) if planned else None,
+        "achieved_rate": round(len(schedule) / sent, 2) if sent else None,
+        "lag_p50": percentile(lags, 50),
+        "lag_p99": percentile(lags, 99),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "outcomes": outcomes,
+    }
+
+
+def replay_http(schedule: list, url: str, concurrency: int) -> dict:
+    import httpx
+
+    async def main():
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+            async def send(update):
+                response = await client.post(url, json=update)
+                return response.status_code
+            return await replay(schedule, send, concurrency)
+
+    return asyncio.run(main())
+
+
+def replay_in_process(schedule: list, concurrency: int) -> dict:
+    """Pasa las actualizaciones por el planificador y los handlers de este proceso."""
+    from telegram import Update
+    from app import bot_loop, get_telegram_app, _init_bot_instance
+    from bot.scheduler import dispatch_update
+
+    telegram_app = get_telegram_app()
+    if telegram_app is None:
+        raise SystemExit("❌ TELEGRAM_BOT_TOKEN no está configurado")
+
+    async def main():
+        await _init_bot_instance()
+
+        async def send(update):
+            await dispatch_update(telegram_app, Update.de_json(update, telegram_app.bot))
+            return "ok"
+        return await replay(schedule, send, concurrency)
+
+    return bot_loop.run(main())
+
+
+def main():
+    args = parse_args()
+
+    services = None
+    if args.fake_services:
+        # Antes de cualquier import del bot: Config lee el entorno al importarse
+        from bench.fake_services import FakeServices
+        services = FakeServices(openai_latency=args.openai_latency).start()
+        services.configure_environment(tempfile.mkdtemp(prefix="bot-replay-"))
+
+    from bot.update_capture import read_capture
+    records = read_capture(args.captures)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("❌ No hay actualizaciones en las capturas indicadas")
+        if services is not None:
+            services.stop()
+        return
+    schedule = renumber(build_schedule(records, args.speed, args.max_gap))
+    print(f"▶️  Reproduciendo {len(schedule)} actualizaciones en ~{schedule[-1][0]:.1f}s (x{args.speed})")
+
+    try:
+        if args.target:
+            summary = replay_http(schedule, args.target, args.concurrency)
+        else:
+            if services is not None:
+                from app import app
+                from models import db, BotConfig
+                import bot.telegram_bot as telegram_bot
+                telegram_bot._crawl_image = services.crawl_image
+                with app.app_context():
+                    db.create_all()
+                    if not BotConfig.query.first():
+                        db.session.add(BotConfig())
+                        db.session.commit()
+            summary = replay_in_process(schedule, args.concurrency)
+            if services is not None:
+                summary["telegram_requests"] = services.stats()["requests"]
+    finally:
+        if services is not None:
+            services.stop()
+
+    print(f"✅ {summary['updates']} actualizaciones en {summary['duration']}s "
+          f"(objetivo {summary['target_rate']}/s, logrado {summary['achieved_rate']}/s)")
+    print(f"   Retraso de envío p99: {summary['lag_p99'] or 0:.3f}s  "
+          f"Latencia p50/p95/p99: {summary['p50'] or 0:.3f}/{summary['p95'] or 0:.3f}/{summary['p99'] or 0:.3f}s")
+    print(f"   Resultados: {summary['outcomes']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(dict(summary, captures=args.captures, speed=args.speed), f, ensure_ascii=False, indent=2)
+        print(f"   Guardado en: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
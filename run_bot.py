@@ -1,14 +1,14 @@
 import os
 import asyncio
 import logging
+import argparse
 import sys
 
 # Agregar el directorio raíz al path de Python
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 sys.path.insert(0, BASE_DIR)
 
-from app import app
-from bot.telegram_bot import setup_bot
+from config import Config
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,13 +18,15 @@ logger = logging.getLogger("run_bot")
 
 def run_bot_polling():
     """Ejecuta el bot de Telegram en modo polling."""
+    from app import get_telegram_app
+
     # Crear un nuevo loop de eventos para este proceso
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    
-    # El bot necesita el contexto de la app de Flask para SQLAlchemy
-    telegram_app = setup_bot(app)
-    
+
+    # La misma Application que usaría el webhook (con la app de Flask en bot_data para SQLAlchemy)
+    telegram_app = get_telegram_app()
+
     if telegram_app:
         logger.info("🤖 Iniciando bot en modo polling para PythonAnywhere...")
         # run_polling() bloquea el hilo principal
@@ -32,9 +34,25 @@ def run_bot_polling():
     else:
         logger.error("❌ No se pudo inicializar el bot. Verifica TELEGRAM_BOT_TOKEN en .env")
 
+def run_sharded_polling(workers: int):
+    """Un proceso hace polling y reparte las actualizaciones entre varios workers por chat_id."""
+    from bot.sharded_polling import ShardedPoller
+
+    if not Config.TELEGRAM_BOT_TOKEN:
+        logger.error("❌ No se pudo inicializar el bot. Verifica TELEGRAM_BOT_TOKEN en .env")
+        return
+    ShardedPoller(workers).run()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ejecuta el bot en modo polling.")
+    parser.add_argument("--workers", type=int, default=Config.POLLING_WORKERS,
+                        help="Procesos que atienden mensajes (más de 1: fetcher + workers por chat_id)")
+    args = parser.parse_args()
     try:
-        run_bot_polling()
+        if args.workers > 1:
+            run_sharded_polling(args.workers)
+        else:
+            run_bot_polling()
     except KeyboardInterrupt:
         logger.info("Bot detenido manualmente.")
     except Exception as e:
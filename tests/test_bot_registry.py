@@ -0,0 +1,133 @@
+import asyncio
+import threading
+
+import pytest
+from flask import Flask
+from telegram import User
+from telegram.ext import ExtBot
+
+from models import db, BotConfig
+from bot import telegram_bot
+from bot.bot_registry import BotRegistry, _load_routes
+from bot.config_cache import ConfigCache, bump_config_version
+
+
+async def _get_me(self, *args, **kwargs):
+    self._bot_user = User(1, "bot", True, username="bot")
+    return self._bot_user
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """Registro con un bot (token 111:AAA) y estado compartido de telegram_bot propio de la prueba."""
+    monkeypatch.setattr(ExtBot, "get_me", _get_me)
+    monkeypatch.setattr(telegram_bot, "_rate_limiters", {})
+    monkeypatch.setattr(telegram_bot, "_retired_limiter_stats", {"retries": 0, "flood_waits": 0})
+    monkeypatch.setattr(telegram_bot, "_shared_scheduler", None)
+    monkeypatch.setattr(telegram_bot, "_shared_requests", None)
+    monkeypatch.setattr(telegram_bot.Config, "METRICS_ENABLED", False)
+    version_file = str(tmp_path / "config_version")
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'bots.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        bot = BotConfig(token="111:AAA")
+        db.session.add(bot)
+        db.session.commit()
+        bot_id = bot.id
+    registry = BotRegistry(app)
+    registry.routes_cache = ConfigCache(_load_routes, version_file=version_file, check_interval=0)
+    registry.bot_id = bot_id
+
+    def change(token=None, delete=False):
+        with app.app_context():
+            rows = BotConfig.query.filter_by(id=registry.bot_id)
+            if delete:
+                rows.delete()
+            else:
+                rows.update({"token": token})
+            db.session.commit()
+        bump_config_version(version_file)
+
+    registry.change = change
+    return registry
+
+
+def test_replaced_and_deleted_bots_are_shut_down(registry):
+    bot_id = registry.bot_id
+
+    async def scenario():
+        first = await registry.initialize(bot_id)
+        assert telegram_bot._rate_limiters[bot_id] is first.bot.rate_limiter
+
+        registry.change(token="222:BBB")
+        second = await registry.initialize(bot_id)
+        assert second is not first and second.bot.token == "222:BBB"
+        assert not first._initialized and second._initialized
+        assert telegram_bot._rate_limiters[bot_id] is second.bot.rate_limiter
+        assert len(telegram_bot._rate_limiters) == 1
+
+        second.bot.rate_limiter.retries = 3
+        registry.change(delete=True)
+        assert await registry.initialize(bot_id) is None
+        assert not second._initialized
+        assert bot_id not in telegram_bot._rate_limiters
+        assert telegram_bot._retired_limiter_stats["retries"] == 3
+        # Los clientes HTTP compartidos siguen abiertos para los demás bots
+        assert not any(request._client.is_closed for request in telegram_bot._shared_requests)
+        await registry.shutdown()
+        await telegram_bot.close_shared_requests()
+
+    asyncio.run(scenario())
+
+
+def test_retired_bot_waits_for_updates_in_flight(registry):
+    bot_id = registry.bot_id
+
+    async def scenario():
+        first = await registry.initialize(bot_id)
+        release = asyncio.Event()
+
+        async def update_in_flight():
+            with registry.in_flight(first):
+                await release.wait()
+
+        in_flight = asyncio.create_task(update_in_flight())
+        await asyncio.sleep(0)
+        registry.change(token="222:BBB")
+        await registry.initialize(bot_id)
+        still_up = first._initialized
+        release.set()
+        await in_flight
+        await asyncio.sleep(0.01)
+        stopped = not first._initialized
+        await registry.shutdown()
+        await telegram_bot.close_shared_requests()
+        return still_up, stopped
+
+    assert asyncio.run(scenario()) == (True, True)
+
+
+def test_routes_are_reloaded_off_the_loop(registry):
+    loader_threads = []
+    loader = registry.routes_cache.loader
+
+    def tracking_loader(app, version):
+        loader_threads.append(threading.current_thread())
+        return loader(app, version)
+
+    registry.routes_cache.loader = tracking_loader
+
+    async def scenario():
+        await registry.initialize(registry.bot_id)
+        registry.change(token="222:BBB")
+        await registry.initialize(registry.bot_id)
+        # Rutas vigentes y Application construida: no se sale del loop
+        await registry.initialize(registry.bot_id)
+        await registry.shutdown()
+        await telegram_bot.close_shared_requests()
+
+    asyncio.run(scenario())
+    assert len(loader_threads) == 2
+    assert threading.main_thread() not in loader_threads
@@ -0,0 +1,105 @@
+import asyncio
+
+from flask import Flask
+
+from models import db
+from bot.conversation_memory import ConversationMemory
+
+
+def _app(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'history.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def test_history_sees_turns_saved_by_another_process(tmp_path):
+    app = _app(tmp_path)
+    # Dos procesos del webhook atendiendo el mismo chat
+    first = ConversationMemory(app, max_turns=10, summarize=False, reload_after=0.01)
+    second = ConversationMemory(app, max_turns=10, summarize=False, reload_after=0.01)
+
+    async def scenario():
+        await first.append(100, "hola", "¡Hola!")
+        await first.flush()
+        assert len(await second.get_messages(100)) == 2
+
+        await first.append(100, "precio del corte", "Cuesta 20")
+        await first.flush()
+        await second.append(100, "y el baño", "Cuesta 15")
+        await asyncio.sleep(0.02)
+        messages = await second.get_messages(100)
+        await first.close()
+        await second.close()
+        return messages
+
+    messages = asyncio.run(scenario())
+    assert [m["content"] for m in messages] == ["hola", "¡Hola!", "precio del corte", "Cuesta 20", "y el baño", "Cuesta 15"]
+
+
+def test_old_rows_are_pruned_and_summary_is_always_loaded(tmp_path):
+    from models import ChatMessage
+
+    app = _app(tmp_path)
+    memory = ConversationMemory(app, max_turns=4, summarize=False, reload_after=0)
+
+    async def scenario():
+        await memory.append(100, "u0", "a0")
+        memory._pending.append({"bot_id": None, "chat_id": 100, "role": "summary", "content": "resumen",
+                                "created_at": memory._pending[-1]["created_at"] + 1e-6})
+        for i in range(1, 6):
+            await memory.append(100, f"u{i}", f"a{i}")
+            await memory.append(200, f"otro{i}", "ok")
+        await memory.close()
+
+    asyncio.run(scenario())
+    with app.app_context():
+        rows = ChatMessage.query.filter_by(chat_id=100).order_by(ChatMessage.id).all()
+        assert [row.content for row in rows] == ["resumen", "u4", "a4", "u5", "a5"]
+        assert ChatMessage.query.filter_by(chat_id=200).count() == 4
+    # Más de max_turns turnos después del resumen: se carga igual
+    history = ConversationMemory(app, max_turns=4)._load(None, 100)
+    assert history.summary == "resumen"
+    assert [turn["content"] for turn in history.turns] == ["u4", "a4", "u5", "a5"]
+
+
+def test_background_tasks_are_kept_and_finished_on_close(tmp_path, monkeypatch):
+    app = _app(tmp_path)
+    memory = ConversationMemory(app, max_turns=10, token_budget=1, flush_size=1, summarize=True)
+    started = asyncio.Event()
+
+    async def summarize(bot_id, chat_id, history):
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        finally:
+            history.summarizing = False
+
+    monkeypatch.setattr(memory, "_summarize", summarize)
+
+    async def scenario():
+        await memory.append(100, "hola", "¡Hola!")
+        assert len(memory._summaries) == 1 and len(memory._flushes) == 1
+        await started.wait()
+        await memory.close()
+        return memory._summaries, memory._flushes
+
+    assert asyncio.run(scenario()) == (set(), set())
+    with app.app_context():
+        from models import ChatMessage
+        assert ChatMessage.query.count() == 2
+
+
+def test_follow_up_window(tmp_path):
+    memory = ConversationMemory(_app(tmp_path), followup_window=60, summarize=False)
+
+    async def scenario():
+        await memory.append(100, "hola", "¡Hola!")
+        recent = memory.is_follow_up(100)
+        memory._chats[(None, 100)].turns[-1]["created_at"] -= 120
+        await memory.close()
+        return recent, memory.is_follow_up(100), memory.is_follow_up(200)
+
+    assert asyncio.run(scenario()) == (True, False, False)
@@ -0,0 +1,55 @@
+from bot.faq_rules import FaqMatcher, validate_pattern
+
+
+def _rule(rule_id: int, pattern: str, priority: int, is_regex: bool = True) -> dict:
+    return {"id": rule_id, "pattern": pattern, "is_regex": is_regex, "priority": priority, "answer": pattern}
+
+
+def test_regex_priority_wins_over_leftmost_match():
+    matcher = FaqMatcher([_rule(1, r"\benvio\b", 1), _rule(2, r"\bprecio\b", 50)])
+    assert matcher.match("cual es el precio del envio")["id"] == 1
+
+
+def test_regex_priority_with_overlapping_matches():
+    matcher = FaqMatcher([_rule(1, r"corte de pelo", 1), _rule(2, r"precio del corte", 50)])
+    assert matcher.match("precio del corte de pelo")["id"] == 1
+    assert matcher.match("precio del corte")["id"] == 2
+
+
+def test_keyword_and_regex_rules_share_priorities():
+    matcher = FaqMatcher([_rule(1, "horario", 10, is_regex=False), _rule(2, r"abren", 5)])
+    assert matcher.match("a qué hora abren, cuál es el horario")["id"] == 2
+    assert matcher.match("horario?")["id"] == 1
+    assert matcher.match("hola") is None
+
+
+def test_only_rules_whose_literal_is_in_the_message_are_tried():
+    rules = [_rule(i, rf"\bproducto{i}\b", i) for i in range(500)]
+    rules.append(_rule(1000, r"\b(hola|buenas)\b", 1000))
+    matcher = FaqMatcher(rules)
+    # Solo se prueban la regla sin texto obligatorio y las cuyo texto está en el mensaje ("producto4" lo está)
+    assert [rule_id for _, rule_id, _ in matcher.candidates("quiero el producto42 por favor")] == [4, 42, 1000]
+    assert matcher.match("quiero el PRODUCTO42 por favor")["id"] == 42
+    assert matcher.match("buenas tardes")["id"] == 1000
+    assert matcher.match("nada que ver") is None
+
+
+def test_literal_prefilter_keeps_regex_semantics():
+    matcher = FaqMatcher([
+        _rule(1, r"corte (de )?pelo", 1),
+        _rule(2, r"(\w+) y \1", 2),
+        _rule(3, r"pr[eé]cio", 3),
+        _rule(4, r"ba(?:ñ|n)o{1,2}", 4),
+    ])
+    assert matcher.match("un CORTE PELO")["id"] == 1
+    assert matcher.match("perro y perro")["id"] == 2
+    assert matcher.match("perro y gato") is None
+    assert matcher.match("el précio")["id"] == 3
+    # re.IGNORECASE iguala 'ſ' a 's'; el prefiltro no debe descartarla
+    assert FaqMatcher([_rule(5, r"paseo", 1)]).match("PAſEO")["id"] == 5
+    assert matcher.match("un baño")["id"] == 4
+
+
+def test_numeric_backreferences_are_validated_like_they_match():
+    assert validate_pattern(r"(\w+) y \1", True) is None
+    assert validate_pattern(r"(\w+) y \2", True) is not None
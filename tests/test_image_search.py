@@ -0,0 +1,40 @@
+import asyncio
+import threading
+import time
+
+from bot import telegram_bot
+from bot.image_cache import ImageCache
+
+
+def test_timed_out_crawls_are_not_cached_and_do_not_starve_the_pool(tmp_path, monkeypatch):
+    hang = threading.Event()
+
+    def crawl(query):
+        if query.startswith("lento"):
+            hang.wait(5)
+            return "https://img/tarde.jpg"
+        return f"https://img/{query}.jpg"
+
+    cache = ImageCache(str(tmp_path / "images.db"))
+    monkeypatch.setattr(telegram_bot, "_crawl_image", crawl)
+    monkeypatch.setattr(telegram_bot, "_image_cache", cache)
+    monkeypatch.setattr(telegram_bot.Config, "IMAGE_SEARCH_TIMEOUT", 0.2)
+
+    async def scenario():
+        slow = await asyncio.gather(*(telegram_bot.search_image(f"lento {i}") for i in range(telegram_bot.Config.IMAGE_SEARCH_WORKERS)))
+        start = time.monotonic()
+        url = await telegram_bot.search_image("perro")
+        return slow, url, time.monotonic() - start
+
+    try:
+        slow, url, elapsed = asyncio.run(scenario())
+        assert slow == [None] * telegram_bot.Config.IMAGE_SEARCH_WORKERS
+        # Los crawls colgados siguen en sus hilos, pero la búsqueda nueva no espera detrás
+        assert url == "https://img/perro.jpg" and elapsed < 0.2
+        assert cache.get("lento 0") == (False, None)
+    finally:
+        hang.set()
+    deadline = time.monotonic() + 2
+    while telegram_bot._abandoned_crawls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert telegram_bot._abandoned_crawls == 0
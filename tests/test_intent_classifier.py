@@ -0,0 +1,23 @@
+import threading
+
+from bot.intent_classifier import LabelLog, load_labeled_messages
+
+
+def test_label_log_writes_off_the_caller_thread(tmp_path, monkeypatch):
+    path = tmp_path / "labels.jsonl"
+    label_log = LabelLog(str(path), flush_interval=60)
+    writers = []
+    real_open = open
+
+    def tracking_open(*args, **kwargs):
+        writers.append(threading.current_thread())
+        return real_open(*args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", tracking_open)
+    label_log.record("quiero comprar un collar", "compra")
+    label_log.record("¿tienen stock?", "inventario")
+    # record() no toca el archivo: lo escribe el hilo de volcado (o el flush del atexit)
+    assert writers == [] and not path.exists()
+    label_log.flush()
+    monkeypatch.undo()
+    assert load_labeled_messages(str(path)) == (["quiero comprar un collar", "¿tienen stock?"], ["compra", "inventario"])
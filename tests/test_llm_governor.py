@@ -0,0 +1,93 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from bot.llm_governor import LLMGovernor, LLMUnavailable
+
+
+def _bad_request():
+    request = httpx.Request("POST", "https://api.openai.test/v1/chat/completions")
+    return openai.BadRequestError("bad request", response=httpx.Response(400, request=request), body=None)
+
+
+def _governor(outcomes):
+    """Governor sin reintentos ni respaldo cuyo _attempt devuelve o lanza cada resultado en orden."""
+    governor = LLMGovernor(rpm=1000, tpm=1000000, max_retries=0, hedge=False, fallback_model="",
+                           breaker_threshold=1, breaker_cooldown=0)
+
+    async def attempt(kwargs):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    governor._attempt = attempt
+    return governor
+
+
+def _create(governor):
+    return governor.create(model="gpt-test", messages=[{"role": "user", "content": "hola"}])
+
+
+def test_probe_with_client_error_closes_breaker():
+    governor = _governor([asyncio.TimeoutError(), _bad_request(), "ok"])
+
+    async def scenario():
+        with pytest.raises(LLMUnavailable):
+            await _create(governor)
+        # La prueba de half-open recibe un 400: el servicio responde
+        with pytest.raises(openai.BadRequestError):
+            await _create(governor)
+        assert governor.breaker.state == "closed"
+        return await _create(governor)
+
+    assert asyncio.run(scenario()) == "ok"
+
+
+def test_cancelled_probe_releases_breaker():
+    async def scenario():
+        governor = _governor([asyncio.TimeoutError(), "ok"])
+        with pytest.raises(LLMUnavailable):
+            await _create(governor)
+
+        async def hang(kwargs):
+            await asyncio.sleep(60)
+
+        real_attempt, governor._attempt = governor._attempt, hang
+        probe = asyncio.create_task(_create(governor))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert governor.breaker.state == "half_open"
+        governor._attempt = real_attempt
+        return await _create(governor)
+
+    assert asyncio.run(scenario()) == "ok"
+
+
+def test_cancelled_caller_cancels_both_hedged_attempts():
+    async def scenario():
+        governor = LLMGovernor(rpm=1000, tpm=1000000, max_retries=0, hedge=True, hedge_min_delay=0.01,
+                               fallback_model="", breaker_threshold=5, breaker_cooldown=0)
+        governor._stats_for("completion").latencies.extend([0.01] * 20)
+        attempts = []
+
+        async def hang(kwargs):
+            attempts.append(asyncio.current_task())
+            await asyncio.sleep(60)
+
+        governor._attempt = hang
+        call = asyncio.create_task(_create(governor))
+        await asyncio.sleep(0.05)
+        assert len(attempts) == 2
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0.01)
+        # Ninguna petición sigue corriendo (ni ocupando el pool de OpenAI) tras cancelar al llamador
+        return [task.cancelled() for task in attempts]
+
+    assert asyncio.run(scenario()) == [True, True]
@@ -0,0 +1,52 @@
+import os
+import json
+import subprocess
+import sys
+
+from bot.metrics import Metrics, ARCHIVE_NAME
+
+
+def _dead_pid() -> int:
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    return child.pid
+
+
+def _write_snapshot(directory, name: str, pid: int, value: int):
+    snapshot = {"pid": pid, "buckets": [0.1, 1.0], "counters": [["bot_messages_total", {}, value]],
+                "histograms": [], "gauges": [["bot_scheduler_active", {}, 1]]}
+    with open(os.path.join(directory, name), "w") as f:
+        json.dump(snapshot, f)
+
+
+def test_dead_process_files_are_folded_into_the_archive(tmp_path):
+    directory = str(tmp_path)
+    dead = _dead_pid()
+    _write_snapshot(directory, f"{dead}-1.json", dead, 3)
+    _write_snapshot(directory, f"{dead}-2.json", dead, 4)
+    metrics = Metrics(directory, flush_interval=60)
+    metrics.inc("bot_messages_total", 2)
+
+    first = metrics.render()
+    assert "bot_messages_total 9" in first
+    # Los gauges de procesos terminados no se exponen
+    assert "bot_scheduler_active" not in first
+    assert sorted(os.listdir(directory)) == sorted([ARCHIVE_NAME, "archive.lock", os.path.basename(metrics._path)])
+
+    _write_snapshot(directory, f"{dead}-3.json", dead, 1)
+    assert "bot_messages_total 10" in metrics.render()
+    assert "bot_messages_total 10" in metrics.render()
+
+
+def test_interrupted_compaction_does_not_count_twice(tmp_path):
+    directory = str(tmp_path)
+    dead = _dead_pid()
+    _write_snapshot(directory, f"{dead}-1.json", dead, 5)
+    # Archivo acumulado escrito, pero el borrado no llegó a hacerse
+    with open(os.path.join(directory, ARCHIVE_NAME), "w") as f:
+        json.dump({"pid": None, "counters": [["bot_messages_total", {}, 5]], "histograms": [], "gauges": [],
+                   "merged": [f"{dead}-1.json"]}, f)
+    metrics = Metrics(directory, flush_interval=60)
+
+    assert "bot_messages_total 5" in metrics.render()
+    assert not os.path.exists(os.path.join(directory, f"{dead}-1.json"))
@@ -0,0 +1,33 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot.streaming import StreamingReply
+
+
+class _Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.sent.append(text)
+        return SimpleNamespace(message_id=1)
+
+
+def _first_message(deltas):
+    bot = _Bot()
+    reply = StreamingReply(bot, 1, min_chars=80)
+
+    async def scenario():
+        for delta in deltas:
+            await reply.feed(delta)
+
+    asyncio.run(scenario())
+    return bot.sent
+
+
+def test_opening_spanish_marks_do_not_end_the_first_sentence():
+    assert _first_message(["Claro ¿ ", "qué raza ", "es ", "¡ genial "]) == []
+
+
+def test_first_sentence_is_sent_when_it_ends():
+    assert _first_message(["¡Hola! ", "¿En qué ", "te ayudo?"]) == ["¡Hola! ¿En qué"]
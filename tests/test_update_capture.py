@@ -0,0 +1,37 @@
+import json
+
+from bot.update_capture import UpdateScrubber
+
+USER_IDS = (111111111, 222222222, 333333333, 444444444, -1005555555555)
+
+
+def _scrubbed_text(update: dict) -> str:
+    return json.dumps(UpdateScrubber("sal", text_mode="pii").scrub(update))
+
+
+def test_new_chat_members_ids_are_scrubbed():
+    update = {"update_id": 1, "message": {
+        "message_id": 7, "date": 0,
+        "chat": {"id": -1005555555555, "type": "supergroup", "title": "Grupo"},
+        "from": {"id": 111111111, "is_bot": False, "first_name": "Ana"},
+        "new_chat_members": [
+            {"id": 222222222, "is_bot": False, "first_name": "Luis"},
+            {"id": 333333333, "is_bot": True, "first_name": "Bot", "username": "otro_bot"},
+        ],
+    }}
+    text = _scrubbed_text(update)
+    assert not any(str(user_id) in text for user_id in USER_IDS)
+    assert '"message_id": 7' in text
+
+
+def test_forward_origin_ids_are_scrubbed():
+    update = {"update_id": 2, "message": {
+        "message_id": 8, "date": 0,
+        "chat": {"id": 111111111, "type": "private", "first_name": "Ana"},
+        "forward_origin": {"type": "user", "date": 0,
+                           "sender_user": {"id": 444444444, "is_bot": False, "first_name": "Eva"}},
+        "text": "hola",
+    }}
+    text = _scrubbed_text(update)
+    assert not any(str(user_id) in text for user_id in USER_IDS)
+    assert "Eva" not in text
@@ -0,0 +1,76 @@
+import json
+import time
+import asyncio
+
+from bot.update_queue import UpdateQueue, UpdateWorkerPool
+
+
+def _message(chat_id: int, text: str) -> dict:
+    return {"message": {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": text}}
+
+
+def _enqueue(queue, update_id: int, chat_id: int, text: str = ""):
+    data = dict(_message(chat_id, text), update_id=update_id)
+    queue.enqueue(update_id, json.dumps(data), UpdateQueue.chat_key(data))
+
+
+def test_claim_skips_chats_in_process(tmp_path):
+    queue = UpdateQueue(str(tmp_path / "queue.db"))
+    _enqueue(queue, 1, 100)
+    _enqueue(queue, 2, 100)
+    _enqueue(queue, 3, 200)
+
+    assert [row[0] for row in queue.claim(10)] == [1, 3]
+    assert queue.claim(10) == []
+    queue.complete(1)
+    assert [row[0] for row in queue.claim(10)] == [2]
+
+
+def test_burst_from_one_chat_does_not_block_others(tmp_path):
+    queue = UpdateQueue(str(tmp_path / "queue.db"))
+    for update_id in range(1, 9):
+        _enqueue(queue, update_id, 100, "lento")
+    _enqueue(queue, 9, 200, "rapido")
+    finished = {}
+
+    async def process(payload):
+        data = json.loads(payload)
+        if data["message"]["text"] == "lento":
+            await asyncio.sleep(0.1)
+        finished[data["update_id"]] = time.monotonic()
+
+    async def scenario():
+        pool = UpdateWorkerPool(queue, process, workers=4, poll_interval=0.01)
+        start = time.monotonic()
+        await pool.start()
+        while len(finished) < 9:
+            await asyncio.sleep(0.01)
+        await pool.stop()
+        return start
+
+    start = asyncio.run(scenario())
+    # El chat 200 no espera a la ráfaga del chat 100, que se procesa en orden
+    assert finished[9] - start < 0.1
+    assert sorted(range(1, 9), key=finished.get) == list(range(1, 9))
+
+
+def _claim_and_exit(path: str):
+    UpdateQueue(path).claim(1)
+
+
+def test_chat_order_across_processes(tmp_path):
+    import multiprocessing
+
+    path = str(tmp_path / "queue.db")
+    queue = UpdateQueue(path)
+    _enqueue(queue, 1, 100)
+    _enqueue(queue, 2, 100)
+
+    # Otro proceso reserva la primera del chat y muere sin terminarla
+    process = multiprocessing.get_context("spawn").Process(target=_claim_and_exit, args=(path,))
+    process.start()
+    process.join()
+    assert queue.claim(10) == []
+
+    assert queue.recover(stale_after=3600) == 1
+    assert [row[0] for row in queue.claim(10)] == [1]
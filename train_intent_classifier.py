@@ -0,0 +1,37 @@
+import argparse
+
+from config import Config
+from bot.intent_classifier import IntentClassifier, load_labeled_messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entrena el clasificador local de intenciones.")
+    parser.add_argument("--data", default=Config.INTENT_LOG_PATH,
+                        help="JSONL con campos 'text' e 'intent' (por defecto INTENT_LOG_PATH)")
+    parser.add_argument("--output", default=Config.INTENT_MODEL_PATH, help="Ruta del modelo generado")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--learning-rate", type=float, default=0.5)
+    parser.add_argument("--min-df", type=int, default=1, help="Frecuencia mínima de un n-grama")
+    args = parser.parse_args()
+
+    if not args.data:
+        parser.error("Indica --data o configura INTENT_LOG_PATH")
+
+    texts, labels = load_labeled_messages(args.data)
+    if not texts:
+        print(f"❌ No hay mensajes etiquetados en {args.data}")
+        return
+
+    model = IntentClassifier.train(
+        texts, labels, epochs=args.epochs, learning_rate=args.learning_rate, min_df=args.min_df
+    )
+    model.save(args.output)
+
+    correct = sum(model.predict(t)[0] == l for t, l in zip(texts, labels))
+    print(f"✅ Modelo entrenado con {len(texts)} mensajes ({len(model.idf)} n-gramas)")
+    print(f"   Exactitud en entrenamiento: {correct / len(texts):.1%}")
+    print(f"   Guardado en: {args.output}")
+
+
+if __name__ == "__main__":
+    main()